@@ -1,48 +1,54 @@
+import heapq
 import re
-from typing import List, Optional, Tuple
+import statistics
+import time
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
-from sympy import sec
 from app.models import Document, Chunk
 from app.config import SETTINGS
-from app.utils import stable_chunk_id, read_jsonl, write_jsonl
+from app.tracing import record, span
+from app.utils import bounded_imap, stable_chunk_id, read_jsonl, write_jsonl
 
 
 HEADER_RE = re.compile(r"^(#{1,4})\s+(.*)\s*$")
 STEP_RE = re.compile(r"^\s*(\d+)\s*[\).\:-]\s+(.*)$")
 
 
-def classify_section(header_text: str) -> str:
-    h = header_text.strip().lower()
-
-    # normalize a bit
-    h = h.replace("&", "and")
+def compile_taxonomy(taxonomy: List[Tuple[str, List[str]]]) -> Callable[[str], str]:
+    """
+    One regex for the whole taxonomy: an alternation of lookaheads, one branch per
+    section in priority order, each ending in an empty capture group. The regex
+    engine tries branches left to right, so m.lastindex is the first section with a
+    matching keyword, exactly as an if-chain over the sections would give.
+    """
+    names: List[str] = []
+    branches: List[str] = []
+    for name, keywords in taxonomy:
+        contains = [re.escape(k) for k in keywords if not k.startswith("=")]
+        exact = [re.escape(k[1:]) for k in keywords if k.startswith("=")]
+        alts = ([rf".*?(?:{'|'.join(contains)})"] if contains else []) + ([rf"(?:{'|'.join(exact)})\Z"] if exact else [])
+        if alts:
+            names.append(name)
+            branches.append(f"(?={'|'.join(alts)})()")
+    if not branches:
+        return lambda h: "Other"
+    matcher = re.compile("|".join(branches), re.DOTALL)
 
-    if "purpose" in h or "goal" in h or "objective" in h:
-        return "Purpose"
-    if "scope" in h or "applies to" in h:
-        return "Scope"
-    if "safety" in h or "biosafety" in h or "ppe" in h or "hazard" in h:
-        return "Safety"
-    if "material" in h or "reagent" in h or "consumable" in h or "equipment" in h or "disinfectant" in h or "suppl" in h:
-        return "Materials"
+    def classify(header_text: str) -> str:
+        m = matcher.match(header_text.strip().lower().replace("&", "and"))
+        return names[m.lastindex - 1] if m else "Other"
 
-    if "preparation" in h or "setup" in h or "before you begin" in h:
-        return "Preparation"
-    if "procedure" in h or "steps" in h or "protocol" in h or "method" in h:
-        return "Procedure"
-    if "critical" in h or "critical point" in h or "warnings" in h or "caution" in h or "do not" == h.strip():
-        return "Critical Points"
+    return classify
 
-    if "qc" in h or "quality" in h or "acceptance" in h or "criteria" in h:
-        return "QC"
 
-    if "reference" in h or "citation" in h or "link" in h:
-        return "References"
+_classify = compile_taxonomy(SETTINGS.section_taxonomy)
 
-    if "troubleshoot" in h or "troubleshooting" in h or "common issues" in h:
-        return "Troubleshooting"
 
-    return "Other"
+@lru_cache(maxsize=4096)
+def classify_section(header_text: str) -> str:
+    # SOP corpora repeat the same few dozen headers, so most calls are cache hits
+    return _classify(header_text)
 
 
 def join_lines(lines: List[str]) -> str:
@@ -64,7 +70,8 @@ def chunk_procedure_block(
     # Identify numbered steps + their line offsets within block
     steps: List[Tuple[int, int, str]] = []  # (step_num, local_line_idx, raw_line)
     for i, ln in enumerate(block_lines):
-        m = STEP_RE.match(ln)
+        # cheap prefix test first: a step line starts with a digit after indentation
+        m = STEP_RE.match(ln) if ln.lstrip()[:1].isdigit() else None
         if m:
             steps.append((int(m.group(1)), i, ln))
 
@@ -181,7 +188,7 @@ def chunk_document(doc: Document) -> List[Chunk]:
         current_block_lines = []
 
     for idx, ln in enumerate(doc.lines):
-        m = HEADER_RE.match(ln)
+        m = HEADER_RE.match(ln) if ln.startswith("#") else None
         if m:
             # New header: flush previous block
             flush_block(idx - 1)
@@ -213,21 +220,70 @@ def chunk_document(doc: Document) -> List[Chunk]:
     return chunks
 
 
-def main():
-    docs = [Document(**row) for row in read_jsonl(SETTINGS.processed_dir / "docs.jsonl")]
-    all_chunks: List[Chunk] = []
-    for d in docs:
-        all_chunks.extend(chunk_document(d))
-
-    def is_useful_chunk(c: Chunk) -> bool:
+def is_useful_chunk(c: Chunk) -> bool:
     # remove super-short chunks like "# Passaging adherent cells"
-        return len(c.text.strip()) >= 80 and len(c.text.strip().split()) >= 12
+    return len(c.text.strip()) >= 80 and len(c.text.strip().split()) >= 12
+
+
+def chunk_row(row: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """Chunk one docs.jsonl row (runs in a worker process): (kept chunk rows, timing row)."""
+    t0 = time.perf_counter()
+    doc = Document(**row)
+    chunks = chunk_document(doc)
+    kept = [c.model_dump() for c in chunks if is_useful_chunk(c)]
+    timing = {
+        "doc_id": doc.doc_id,
+        "lines": len(doc.lines),
+        "chunks": len(chunks),
+        "kept": len(kept),
+        "ms": round((time.perf_counter() - t0) * 1000, 3),
+    }
+    return kept, timing
+
+
+def print_timing_report(timings: List[Dict[str, Any]], wall_s: float, top: int = 5) -> None:
+    if not timings:
+        return
+    ms = [t["ms"] for t in timings]
+    cuts = statistics.quantiles(ms, n=20, method="inclusive") if len(ms) > 1 else ms * 19
+    print(f"Chunked {len(timings)} docs in {wall_s:.2f}s wall, {sum(ms) / 1000:.2f}s in workers "
+          f"(per doc p50 {cuts[9]:.1f} ms, p95 {cuts[18]:.1f} ms, max {max(ms):.1f} ms)")
+    for t in heapq.nlargest(top, timings, key=lambda t: t["ms"]):
+        print(f"  {t['ms']:>9.1f} ms  {t['doc_id']}  ({t['lines']} lines → {t['kept']}/{t['chunks']} chunks kept)")
+
+
+def main():
+    import argparse
+    ap = argparse.ArgumentParser(description="Chunk docs.jsonl into chunks.jsonl")
+    ap.add_argument("--workers", type=int, default=0, help="Chunking processes (0 = all CPUs, 1 = inline)")
+    ap.add_argument("--max-in-flight", type=int, default=0,
+                    help="Documents submitted ahead of the writer (0 = 4 per worker)")
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    timings: List[Dict[str, Any]] = []
+    n_chunks = 0
+
+    def rows() -> Iterator[Dict[str, Any]]:
+        # docs are read lazily and chunk rows written in document order as results arrive
+        nonlocal n_chunks
+        results = bounded_imap(chunk_row, read_jsonl(SETTINGS.processed_dir / "docs.jsonl"),
+                               workers=args.workers, max_in_flight=args.max_in_flight)
+        for kept, timing in results:
+            timings.append(timing)
+            record("chunk.doc", timing["ms"], doc_id=timing["doc_id"], lines=timing["lines"], chunks=timing["kept"])
+            n_chunks += len(kept)
+            yield from kept
 
-    all_chunks = [c for c in all_chunks if is_useful_chunk(c)]
-    
     out = SETTINGS.processed_dir / "chunks.jsonl"
-    write_jsonl(out, (c.model_dump() for c in all_chunks))
-    print(f"Wrote {len(all_chunks)} chunks → {out}")
+    with span("chunk", workers=args.workers) as attrs:
+        write_jsonl(out, rows())
+        attrs.update(docs=len(timings), chunks=n_chunks)
+    report = SETTINGS.processed_dir / "chunk_timings.jsonl"
+    write_jsonl(report, timings)
+    print(f"Wrote {n_chunks} chunks → {out}")
+    print_timing_report(timings, time.perf_counter() - t0)
+    print(f"Per-document timings → {report}")
 
 
 if __name__ == "__main__":
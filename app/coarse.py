@@ -0,0 +1,172 @@
+"""
+app/coarse.py
+
+Coarse-to-fine retrieval over document and section centroids.
+
+index_faiss writes coarse.npz next to faiss.index: the normalized mean vector
+of every doc_id and of every (doc_id, section), and each group's chunk rows as
+CSR arrays (rows of group g are indptr[g]:indptr[g + 1] in `rows`, ascending).
+
+With SETTINGS.coarse_fanout > 0 readers search a TwoStageIndex instead of the
+flat index. Stage 1 scores the query against the centroids of
+SETTINGS.coarse_level ("doc" or "section") and keeps the best coarse_fanout
+groups, and more if they hold fewer than k allowed rows. Stage 2 scores only
+those groups' chunks exactly against vectors.npy (memory-mapped). A search then
+costs about n_groups + fanout * rows per group instead of n_chunks. Chunks
+outside the chosen groups are never returned; `python -m app.eval --coarse`
+measures that recall loss against the flat search.
+"""
+
+import json
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.config import SETTINGS
+from app.models import Chunk
+from app.tracing import span
+
+
+COARSE_FILE = "coarse.npz"
+MISSING_SCORE = -np.inf
+
+
+class CentroidGroups:
+    """Centroids of one level (doc or section) and the chunk rows of each group."""
+
+    def __init__(self, keys: List[str], centroids: np.ndarray, indptr: np.ndarray, rows: np.ndarray):
+        self.keys = keys              # doc_id, or "doc_id\tsection"
+        self.centroids = centroids    # (n_groups, d) float32, L2-normalized
+        self.indptr = indptr          # (n_groups + 1,) int64
+        self.rows = rows              # (n_chunks,) int64 chunk rows, ascending within a group
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @classmethod
+    def build(cls, X: np.ndarray, keys_per_row: Sequence[str]) -> "CentroidGroups":
+        keys = sorted(set(keys_per_row))
+        pos = {key: g for g, key in enumerate(keys)}
+        group = np.fromiter((pos[key] for key in keys_per_row), dtype="int64", count=len(keys_per_row))
+        rows = np.argsort(group, kind="stable")
+        indptr = np.zeros(len(keys) + 1, dtype="int64")
+        np.cumsum(np.bincount(group, minlength=len(keys)), out=indptr[1:])
+        centroids = np.zeros((len(keys), X.shape[1]), dtype="float32")
+        np.add.at(centroids, group, np.asarray(X, dtype="float32"))
+        centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+        return cls(keys, centroids, indptr, rows)
+
+    def members(self, g: int) -> np.ndarray:
+        return self.rows[self.indptr[g]:self.indptr[g + 1]]
+
+
+def row_keys(chunks: Sequence[Chunk], level: str) -> List[str]:
+    if level == "doc":
+        return [c.doc_id for c in chunks]
+    return [f"{c.doc_id}\t{c.section}" for c in chunks]
+
+
+def build_coarse(X: np.ndarray, chunks: Sequence[Chunk]) -> Dict[str, CentroidGroups]:
+    return {level: CentroidGroups.build(X, row_keys(chunks, level)) for level in ("doc", "section")}
+
+
+def save_coarse(path: Path, levels: Dict[str, CentroidGroups]) -> None:
+    arrays = {}
+    for level, g in levels.items():
+        arrays.update({f"{level}_keys": np.array(json.dumps(g.keys)), f"{level}_centroids": g.centroids,
+                       f"{level}_indptr": g.indptr, f"{level}_rows": g.rows})
+    np.savez(path, **arrays)
+
+
+def load_coarse(index_dir: Path, level: str) -> Optional[CentroidGroups]:
+    path = Path(index_dir) / COARSE_FILE
+    if not path.exists():
+        return None
+    with np.load(path) as z:
+        return CentroidGroups(json.loads(str(z[f"{level}_keys"])), z[f"{level}_centroids"],
+                              z[f"{level}_indptr"], z[f"{level}_rows"])
+
+
+class TwoStageIndex:
+    """Faiss-like search (inner product) over the chunks of the best-matching centroid groups."""
+
+    def __init__(self, base, vectors: np.ndarray, groups: CentroidGroups, fanout: int):
+        self.base = base          # the flat / ANN index, still used for ntotal, metric_type, ...
+        self.vectors = vectors
+        self.groups = groups
+        self.fanout = fanout
+        self.ntotal = base.ntotal
+        self.d = base.d
+        self.metric_type = base.metric_type
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.rows_scanned = 0
+
+    def _candidates(self, order: np.ndarray, k: int, mask: Optional[np.ndarray]) -> np.ndarray:
+        """Rows of the best `fanout` groups with an allowed row (more groups while fewer than k rows)."""
+        parts: List[np.ndarray] = []
+        n_rows = n_groups = 0
+        for g in order:
+            rows = self.groups.members(int(g))
+            if mask is not None:
+                rows = rows[mask[rows]]
+            if not len(rows):
+                continue
+            parts.append(rows)
+            n_rows += len(rows)
+            n_groups += 1
+            if n_groups >= self.fanout and n_rows >= k:
+                break
+        return np.concatenate(parts) if parts else np.zeros(0, dtype="int64")
+
+    def search(self, Q: np.ndarray, k: int, bits: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k per query row, optionally restricted to the rows set in the packed
+        bitmap `bits`. Returns (scores, row ids) like faiss, padded with -1 ids.
+        """
+        Q = np.ascontiguousarray(Q, dtype="float32")
+        mask = np.unpackbits(bits, count=self.ntotal, bitorder="little").astype(bool) if bits is not None else None
+        D = np.full((len(Q), k), MISSING_SCORE, dtype="float32")
+        I = np.full((len(Q), k), -1, dtype="int64")
+        with span("search.coarse", n=len(Q), groups=len(self.groups), fanout=self.fanout) as attrs:
+            order = np.argsort(-(Q @ self.groups.centroids.T), axis=1, kind="stable")
+            picked = [self._candidates(order[i], k, mask) for i in range(len(Q))]
+            attrs["rows"] = sum(len(rows) for rows in picked)
+        with span("search.fine", n=len(Q), rows=attrs["rows"]):
+            for i, rows in enumerate(picked):
+                if not len(rows):
+                    continue
+                rows = np.sort(rows)  # ascending reads from the memory-mapped vectors
+                scores = np.asarray(self.vectors[rows], dtype="float32") @ Q[i]
+                top = np.argsort(-scores, kind="stable")[:k]
+                D[i, :len(top)] = scores[top]
+                I[i, :len(top)] = rows[top]
+        with self._lock:
+            self.queries += len(Q)
+            self.rows_scanned += attrs["rows"]
+        return D, I
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {"level_groups": len(self.groups), "fanout": self.fanout, "queries": self.queries,
+                    "rows_per_query": round(self.rows_scanned / self.queries, 1) if self.queries else None,
+                    "n_chunks": self.ntotal}
+
+
+def with_coarse(index, index_dir: Path, fanout: Optional[int] = None, level: Optional[str] = None):
+    """TwoStageIndex when coarse_fanout > 0 and the build has coarse.npz and vectors.npy, else the index unchanged."""
+    import faiss
+
+    fanout = SETTINGS.coarse_fanout if fanout is None else fanout
+    level = level or SETTINGS.coarse_level
+    if level not in ("doc", "section"):
+        raise ValueError(f"Unknown coarse_level {level!r} (expected doc | section)")
+    vectors_path = Path(index_dir) / "vectors.npy"
+    if fanout <= 0 or index.metric_type != faiss.METRIC_INNER_PRODUCT or not vectors_path.exists():
+        return index
+    groups = load_coarse(index_dir, level)
+    if groups is None:
+        return index
+    return TwoStageIndex(index, np.load(vectors_path, mmap_mode="r"), groups, fanout)
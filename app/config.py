@@ -1,23 +1,132 @@
 from pydantic import BaseModel
 from pathlib import Path
+from typing import List, Tuple
 
 
 class Settings(BaseModel):
     sops_dir: Path = Path("data_raw/sops")
     processed_dir: Path = Path("data/processed")
     index_dir: Path = Path("data/index")
-    logs_dir: Path = Path("data/logs")
+    logs_dir: Path = Path("data/logs")   # spans.jsonl (see app/tracing.py)
+    protocols_max_item_mb: int = 8       # a protocols.io export item larger than this is rejected (app/protocols_io.py)
 
     # Chunking knobs
     max_chars: int = 1400
     procedure_steps_per_chunk: int = 30
 
+    # Section taxonomy for markdown headers (see app/chunker.compile_taxonomy).
+    # First matching section wins; a keyword matches anywhere in the lowercased header
+    # ("&" read as "and"), or the whole header when prefixed with "=". No match → "Other".
+    section_taxonomy: List[Tuple[str, List[str]]] = [
+        ("Purpose", ["purpose", "goal", "objective"]),
+        ("Scope", ["scope", "applies to"]),
+        ("Safety", ["safety", "biosafety", "ppe", "hazard"]),
+        ("Materials", ["material", "reagent", "consumable", "equipment", "disinfectant", "suppl"]),
+        ("Preparation", ["preparation", "setup", "before you begin"]),
+        ("Procedure", ["procedure", "steps", "protocol", "method"]),
+        ("Critical Points", ["critical", "warnings", "caution", "=do not"]),
+        ("QC", ["qc", "quality", "acceptance", "criteria"]),
+        ("References", ["reference", "citation", "link"]),
+        ("Troubleshooting", ["troubleshoot", "common issues"]),
+    ]
+
     # Retrieval knobs
     top_k: int = 5
     NO_ANSWER_THRESHOLD: float = 0.25  # for the eval "no answer" decision
+    abstain_calibration_path: Path = Path("data/index/abstention.json")  # written by `app.eval --sweep`
+
+    # Lexical BM25 fast path + rank fusion (see app/lexical.py)
+    retrieval_mode: str = "dense"       # dense | hybrid
+    bm25_k1: float = 1.2
+    bm25_b: float = 0.75
+    lexical_fast_max_terms: int = 6     # fast path only for short, keyword-like queries
+    lexical_fast_coverage: float = 1.0  # share of the query's IDF mass the top chunk must contain
+    lexical_fast_margin: float = 0.2    # (s1 - s2) / s1 needed to answer without the transformer
+    rrf_k: int = 60
+    fusion_candidates: int = 50         # depth of each ranking fed to reciprocal rank fusion
+
+    # ANN index (see app/index_faiss.build_index)
+    index_type: str = "flat"          # flat | hnsw | ivf_flat | ivf_pq
+    vector_codec: str = "fp32"        # fp32 | fp16 | sq8 | pq  (how flat / hnsw / ivf_flat store vectors)
+    rescore_factor: int = 4           # lossy codecs: re-score k * factor candidates against vectors.npy; <= 1 disables
+    hnsw_m: int = 32
+    hnsw_ef_construction: int = 200
+    hnsw_ef_search: int = 64
+    ivf_nlist: int = 1024             # capped at n_chunks // 39 for small corpora
+    ivf_nprobe: int = 16
+    filter_exact_rows: int = 20_000   # hnsw / ivf: filters matching at most this many rows are scored exactly
+    filter_exact_fraction: float = 0.05  # ... or at most this share of the index (see app/filters.FilteredIndex)
+    filter_max_widen: int = 16        # larger filters: efSearch / nprobe scaled by 1 / selectivity, at most this much
+    pq_m: int = 16                    # sub-quantizers; must divide the embedding dim
+    pq_nbits: int = 8
+    train_sample_size: int = 100_000  # vectors used to train IVF / PQ
+    recall_k: int = 10
+    recall_floor: float = 0.95        # builds below this recall@k vs exact search are not published
+    recall_n_queries: int = 500
+
+    # Coarse-to-fine search over doc / section centroids (see app/coarse.py); 0 = flat search
+    coarse_fanout: int = 0            # centroid groups whose chunks are scored exactly per query
+    coarse_level: str = "section"     # doc | section
+
+    # Sharded index (see app/shards.py); "none" keeps a single faiss.index in index_dir
+    shard_by: str = "none"            # none | family (doc_id prefix, e.g. one shard per site) | hash
+    n_shards: int = 4                 # shard_by="hash"
+    shard_search_threads: int = 0     # fan-out threads per search; 0 = one per shard, capped at the CPU count
+
+    # Versioned publishing (see app/versions.py)
+    index_keep_versions: int = 3      # published versions kept under index_dir/versions (CURRENT always kept)
+    index_poll_s: float = 2.0         # how often long-running readers check CURRENT; 0 disables hot swap
 
     # Embeddings
     embedding_model_name: str = "sentence-transformers/all-MiniLM-L6-v2"
+    embedding_backend: str = "torch"   # torch | onnx | onnx_int8 (export first: python -m app.onnx_backend)
+    embedding_threads: int = 0         # intra-op CPU threads for the backend; 0 = library default
+    onnx_dir: Path = Path("data/models/onnx")
+
+    # On-disk embedding cache (see app/embedding_store.py)
+    embedding_cache: bool = True
+    embedding_cache_dir: Path = Path("data/cache/embeddings")
+    embedding_cache_max_mb: int = 512
+
+    # Query-embedding cache (see app/query_cache.py); 0 disables it
+    query_cache_size: int = 1024
+    query_cache_persist: bool = False
+
+    # Retrieval result cache (see app/result_cache.py); 0 disables it
+    result_cache_size: int = 512
+    result_cache_semantic_threshold: float = 0.0  # > 0 (e.g. 0.97): reuse results of a cached query at least this cosine-similar
+
+    # Cross-encoder rerank of the top candidates (see app/rerank.py)
+    rerank: bool = False
+    rerank_model_name: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+    rerank_candidates: int = 20       # N: retrieval candidates re-scored per query (before budget shrinking)
+    rerank_budget_ms: float = 150.0   # per request (a search_batch call shares one); 0 = no limit
+    rerank_batch_size: int = 16
+    rerank_cache_size: int = 20_000   # cached (query, chunk_id) scores
+
+    # Index / model registry for the Streamlit app (see app/registry.py)
+    registry_budget_mb: int = 4096  # least recently used idle entries are evicted above this
+
+    # Span tracing to logs_dir/spans.jsonl (see app/tracing.py)
+    tracing: bool = True
+    trace_max_mb: int = 20    # spans.jsonl is rotated at this size
+    trace_backups: int = 3    # rotated files kept (spans.jsonl.1 ... .N; also for queries.jsonl)
+
+    # Served-query log for replay load tests (see app/query_log.py, scripts/replay.py)
+    query_log: bool = True
+    query_log_max_mb: int = 50
+
+    # Query daemon (see app/daemon.py)
+    daemon_socket: Path = Path("data/run/query.sock")
+    daemon_idle_timeout_s: int = 3600  # auto-started daemons exit after this long without requests
+
+    # HTTP retrieval service with micro-batching (see app/service.py)
+    service_host: str = "127.0.0.1"
+    service_port: int = 8765
+    service_batch_window_ms: float = 5.0   # how long to gather concurrent requests into one batch
+    service_max_batch: int = 64
+    service_max_queue: int = 256           # beyond this, requests are rejected with 429
+    service_default_timeout_ms: int = 2000 # per-request deadline unless the request sets timeout_ms
 
 
 SETTINGS = Settings()
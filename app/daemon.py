@@ -0,0 +1,151 @@
+"""
+app/daemon.py
+
+Long-running local query daemon. Keeps the embedder, FAISS index, metadata
+and filter bitmaps resident and answers `python -m app.query` over a Unix
+socket, so a CLI question costs one round trip instead of a torch import,
+a model load and an index load.
+
+Start it explicitly with `python -m app.daemon`, or let `app.query` start it
+on first use. It exits after SETTINGS.daemon_idle_timeout_s without requests.
+
+Protocol: one JSON object per line in each direction.
+  {"op": "search", "q": "...", "k": 5, "doc_filter": null, "section_filter": null}
+      -> {"ok": true, "results": [{"score": 0.71, "chunk": {...Chunk fields...}}]}
+  {"op": "ping"}      -> {"ok": true, "pid": 123, "index_dir": "...", "n_chunks": 114,
+                          "index": {"version": ..., "swaps": 0, "last_error": null},
+                          "query_cache": {...}, "embedding_store": {...}, "result_cache": {...},
+                          "rerank": {...pair cache / budget stats, null when SETTINGS.rerank is off},
+                          "hybrid": {...fast-path rate / latency, null in dense mode}}
+  {"op": "shutdown"}  -> {"ok": true}
+Errors come back as {"ok": false, "error": "..."}.
+
+New index versions published by app.index_faiss are picked up without a
+restart (app.versions.HotIndex); each request runs against one version.
+"""
+
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from pathlib import Path
+
+from app.config import SETTINGS
+
+
+class QueryHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                reply = self.server.dispatch(json.loads(line))
+            except Exception as e:
+                reply = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+            self.wfile.write((json.dumps(reply, ensure_ascii=False) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+
+class QueryDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: Path, index_dir: Path, model_name: str, idle_timeout_s: int):
+        from app.embedder import Embedder
+        from app.versions import HotIndex, load_bundle
+
+        self.index_dir = index_dir
+        self.hot = HotIndex(index_dir, load_bundle)  # (index, meta, bitmaps, manifest, lexical), swapped in the background
+        self.embedder = Embedder(model_name)
+        self.embedder.embed_query("warmup")  # load the model before accepting requests
+
+        self.idle_timeout_s = idle_timeout_s
+        self.last_request = time.monotonic()
+        self._search_lock = threading.Lock()
+        super().__init__(str(socket_path), QueryHandler)
+
+    def dispatch(self, req: dict) -> dict:
+        from app.lexical import HYBRID_STATS
+        from app.rerank import rerank_stats
+        from app.result_cache import result_cache_stats
+        from app.retrieval import search
+
+        self.last_request = time.monotonic()
+        op = req.get("op", "search")
+        index, meta, bitmaps, manifest, lexical = self.hot.current  # one snapshot per request
+        if op == "ping":
+            return {"ok": True, "pid": os.getpid(), "index_dir": str(self.index_dir), "n_chunks": len(meta),
+                    "index": self.hot.stats(), **self.embedder.cache_stats(), "result_cache": result_cache_stats(),
+                    "rerank": rerank_stats(), "hybrid": HYBRID_STATS.snapshot() if lexical is not None else None}
+        if op == "shutdown":
+            threading.Thread(target=self.shutdown, daemon=True).start()
+            return {"ok": True}
+        if op != "search":
+            return {"ok": False, "error": f"unknown op {op!r}"}
+
+        with self._search_lock:
+            results = search(
+                index, meta, bitmaps, self.embedder,
+                query=req["q"],
+                k=int(req.get("k", SETTINGS.top_k)),
+                doc_filter=req.get("doc_filter"),
+                section_filter=req.get("section_filter"),
+                lexical=lexical,
+                manifest=manifest,
+            )
+        return {"ok": True, "results": [{"score": s, "chunk": c.model_dump()} for s, c in results]}
+
+    def watch_idle(self) -> None:
+        while True:
+            time.sleep(min(30, max(1, self.idle_timeout_s)))
+            if time.monotonic() - self.last_request > self.idle_timeout_s:
+                print(f"Idle for {self.idle_timeout_s}s, shutting down.", flush=True)
+                self.shutdown()
+                return
+
+
+def socket_alive(socket_path: Path) -> bool:
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(str(socket_path))
+        return True
+    except OSError:
+        return False
+    finally:
+        s.close()
+
+
+def main():
+    import argparse
+    ap = argparse.ArgumentParser(description="Keep the embedder and index resident and serve app.query over a Unix socket")
+    ap.add_argument("--socket", type=Path, default=SETTINGS.daemon_socket)
+    ap.add_argument("--index-dir", type=Path, default=SETTINGS.index_dir)
+    ap.add_argument("--model", default=SETTINGS.embedding_model_name)
+    ap.add_argument("--idle-timeout", type=int, default=SETTINGS.daemon_idle_timeout_s,
+                    help="Seconds without requests before exiting (0 = never)")
+    args = ap.parse_args()
+
+    args.socket.parent.mkdir(parents=True, exist_ok=True)
+    if args.socket.exists():
+        if socket_alive(args.socket):
+            raise SystemExit(f"A daemon is already listening on {args.socket}")
+        args.socket.unlink()  # stale socket from a crashed daemon
+
+    server = QueryDaemon(args.socket, args.index_dir, args.model, args.idle_timeout)
+    if args.idle_timeout > 0:
+        threading.Thread(target=server.watch_idle, daemon=True).start()
+    print(f"Query daemon pid={os.getpid()} listening on {args.socket} ({len(server.hot.current[1])} chunks, "
+          f"version {server.hot.version or 'unversioned'})", flush=True)
+    try:
+        server.serve_forever()
+    finally:
+        server.hot.close()
+        server.server_close()
+        if args.socket.exists():
+            args.socket.unlink()
+
+
+if __name__ == "__main__":
+    main()
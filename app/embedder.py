@@ -1,14 +1,119 @@
+import threading
+from typing import Optional
+
 import numpy as np
-from sentence_transformers import SentenceTransformer
+
+from app.config import SETTINGS
+from app.embedding_store import EmbeddingStore
+from app.query_cache import QueryEmbeddingCache, shared_query_cache
+from app.tracing import memory, span
 
 
 class Embedder:
-    def __init__(self, model_name: str):
-        self.model = SentenceTransformer(model_name)
+    def __init__(self, model_name: str, normalize: bool = True, use_cache: Optional[bool] = None,
+                 backend: Optional[str] = None):
+        self.model_name = model_name
+        self.normalize = normalize
+        self.backend = backend or SETTINGS.embedding_backend
+        if self.backend not in ("torch", "onnx", "onnx_int8"):
+            raise ValueError(f"Unknown embedding_backend {self.backend!r} (expected torch | onnx | onnx_int8)")
+        # ONNX / int8 vectors differ slightly from torch ones, so they get their own cache namespaces
+        self.cache_name = model_name if self.backend == "torch" else f"{model_name}@{self.backend}"
+        self._model = None
+        self._model_lock = threading.Lock()
+
+        self.query_cache: Optional[QueryEmbeddingCache] = shared_query_cache() if SETTINGS.query_cache_size > 0 else None
+
+        if use_cache is None:
+            use_cache = SETTINGS.embedding_cache
+        self.store: Optional[EmbeddingStore] = None
+        if use_cache:
+            self.store = EmbeddingStore(
+                SETTINGS.embedding_cache_dir,
+                self.cache_name,
+                normalize=normalize,
+                max_bytes=SETTINGS.embedding_cache_max_mb * 2**20,
+            )
+
+    @property
+    def model(self):
+        # Loaded (and torch / onnxruntime imported) on first cache miss: a fully cached rebuild never touches the model.
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    with span("embed.load_model", model=self.model_name, backend=self.backend):
+                        self._model = self._load_model()
+                    from app.registry import model_bytes
+                    memory("model", model_bytes(self), model=self.model_name, backend=self.backend)
+        return self._model
+
+    def _load_model(self):
+        if self.backend != "torch":
+            from app.onnx_backend import OnnxEncoder
+            return OnnxEncoder(self.model_name, quantized=self.backend == "onnx_int8", threads=SETTINGS.embedding_threads)
+
+        from sentence_transformers import SentenceTransformer
+        if SETTINGS.embedding_threads > 0:
+            import torch
+            torch.set_num_threads(SETTINGS.embedding_threads)
+        return SentenceTransformer(self.model_name)
+
+    def _encode(self, texts: list[str]) -> np.ndarray:
+        model = self.model  # loaded outside the encode span
+        with span("embed.encode", n=len(texts)):
+            if self.backend != "torch":
+                return model.encode(texts, normalize=self.normalize)
+            emb = model.encode(texts, normalize_embeddings=self.normalize, show_progress_bar=False)
+            return np.asarray(emb, dtype="float32")
 
     def embed_texts(self, texts: list[str]) -> np.ndarray:
-        emb = self.model.encode(texts, normalize_embeddings=True, show_progress_bar=False)
-        return np.asarray(emb, dtype="float32")
+        with span("embed.texts", n=len(texts)):
+            return self._embed_texts(texts)
+
+    def _embed_texts(self, texts: list[str]) -> np.ndarray:
+        if self.store is None or not texts:
+            return self._encode(texts)
+
+        cached = self.store.get_many(texts)
+        missing = [i for i, v in enumerate(cached) if v is None]
+        if not missing:
+            return np.vstack(cached).astype("float32")
+
+        fresh = self._encode([texts[i] for i in missing])
+        self.store.put_many([texts[i] for i in missing], fresh)
+        if len(missing) == len(texts):
+            return fresh
+
+        out = np.empty((len(texts), fresh.shape[1]), dtype="float32")
+        for i, v in enumerate(cached):
+            if v is not None:
+                out[i] = v
+        out[missing] = fresh
+        return out
+
+    def embed_queries(self, queries: list[str]) -> np.ndarray:
+        """Like embed_texts, but through the query cache (normalized text) instead of the chunk store."""
+        with span("embed.queries", n=len(queries)):
+            return self._embed_queries(queries)
+
+    def _embed_queries(self, queries: list[str]) -> np.ndarray:
+        if self.query_cache is None or not queries:
+            return self._encode(queries)
+
+        cached = self.query_cache.get_many(self.cache_name, self.normalize, queries)
+        missing = [i for i, v in enumerate(cached) if v is None]
+        if missing:
+            fresh = self._encode([queries[i] for i in missing])
+            self.query_cache.put_many(self.cache_name, self.normalize, [queries[i] for i in missing], fresh)
+            for i, v in zip(missing, fresh):
+                cached[i] = v
+        return np.vstack(cached).astype("float32")
 
     def embed_query(self, text: str) -> np.ndarray:
-        return self.embed_texts([text])[0]
+        return self.embed_queries([text])[0]
+
+    def cache_stats(self) -> dict:
+        return {
+            "query_cache": self.query_cache.stats() if self.query_cache is not None else None,
+            "embedding_store": self.store.stats() if self.store is not None else None,
+        }
@@ -0,0 +1,249 @@
+"""
+app/embedding_store.py
+
+Content-addressed, on-disk embedding cache shared by index_faiss, eval, query
+and the Streamlit app.
+
+Layout (one namespace directory per (embedding_model_name, normalize) pair):
+  <root>/<model-slug>-<norm|raw>-<hash>/
+    vectors.f32   append-only float32 matrix, one row per cached text
+    keys.bin      append-only offset index: (sha1(text) digest, row) records
+    store.json    {"model": ..., "normalize": ..., "dim": ...}
+    .lock         flock target for appends / compaction
+
+Record i of keys.bin always describes row i of vectors.f32 (appends write the
+rows first, then their records). A crash mid-append can leave a partial row or
+record, or rows without records; on open and before every append both files
+are truncated back to the rows they agree on, so later appends stay aligned.
+
+Rows are read through a read-only memmap. When vectors.f32 grows past the
+size budget, the store is compacted down to ~75% of the budget, keeping the
+entries used most recently by this process first, then the newest rows.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import re
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+KEY_DTYPE = np.dtype([("key", "S20"), ("row", "<i8")])
+
+
+def text_key(text: str) -> bytes:
+    return hashlib.sha1(text.encode("utf-8")).digest()
+
+
+def namespace_dir(root: Path, model_name: str, normalize: bool) -> Path:
+    slug = re.sub(r"[^a-zA-Z0-9]+", "-", model_name).strip("-").lower()[-48:]
+    h = hashlib.sha1(f"{model_name}|{int(normalize)}".encode("utf-8")).hexdigest()[:8]
+    return root / f"{slug}-{'norm' if normalize else 'raw'}-{h}"
+
+
+class EmbeddingStore:
+    def __init__(self, root: Path, model_name: str, normalize: bool = True, max_bytes: int = 512 * 2**20):
+        self.model_name = model_name
+        self.normalize = normalize
+        self.max_bytes = max_bytes
+        self.dir = namespace_dir(Path(root), model_name, normalize)
+        self.dir.mkdir(parents=True, exist_ok=True)
+
+        self.vectors_path = self.dir / "vectors.f32"
+        self.keys_path = self.dir / "keys.bin"
+        self.info_path = self.dir / "store.json"
+        self.lock_path = self.dir / ".lock"
+
+        self.dim: Optional[int] = None
+        self._rows: Dict[bytes, int] = {}
+        self._last_used: Dict[bytes, int] = {}
+        self._tick = 0
+        self._keys_stat = None
+        self._mm: Optional[np.memmap] = None
+        self._mm_rows = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        with self._file_lock():
+            self._repair()
+        self._refresh()
+
+    # -------------------------
+    # Disk state
+    # -------------------------
+
+    @contextmanager
+    def _file_lock(self, mode: int = fcntl.LOCK_EX):
+        with self.lock_path.open("a") as f:
+            fcntl.flock(f, mode)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _repair(self) -> None:
+        """Truncate vectors.f32 and keys.bin to the complete rows both have. Caller holds the exclusive lock."""
+        if self.dim is None and self.info_path.exists():
+            self.dim = int(json.loads(self.info_path.read_text(encoding="utf-8"))["dim"])
+        vec_size = self.vectors_path.stat().st_size if self.vectors_path.exists() else 0
+        keys_size = self.keys_path.stat().st_size if self.keys_path.exists() else 0
+        row_bytes = 4 * self.dim if self.dim else 0
+        n = min(vec_size // row_bytes if row_bytes else 0, keys_size // KEY_DTYPE.itemsize)
+        if vec_size == n * row_bytes and keys_size == n * KEY_DTYPE.itemsize:
+            return
+        for path, size in ((self.vectors_path, n * row_bytes), (self.keys_path, n * KEY_DTYPE.itemsize)):
+            if path.exists():
+                os.truncate(path, size)
+        print(f"Embedding store repaired: truncated to {n} complete rows ({self.dir})")
+        self._rows = {}
+        self._keys_stat = None
+        self._mm = None
+
+    def _refresh(self) -> None:
+        """Pick up rows appended (or a compaction done) by other processes."""
+        if self.dim is None and self.info_path.exists():
+            self.dim = int(json.loads(self.info_path.read_text(encoding="utf-8"))["dim"])
+        if not self.keys_path.exists():
+            return
+
+        st = self.keys_path.stat()
+        if self._keys_stat == (st.st_ino, st.st_size):
+            return
+        if self._keys_stat is None or self._keys_stat[0] != st.st_ino:
+            self._rows = {}
+            self._mm = None
+        recs = np.fromfile(self.keys_path, dtype=KEY_DTYPE)
+        self._rows.update(zip(recs["key"].tolist(), recs["row"].tolist()))
+        self._keys_stat = (st.st_ino, st.st_size)
+
+    def _matrix(self, min_rows: int) -> np.memmap:
+        if self._mm is None or self._mm_rows < min_rows:
+            n = self.vectors_path.stat().st_size // (4 * self.dim)
+            self._mm = np.memmap(self.vectors_path, dtype="float32", mode="r", shape=(n, self.dim))
+            self._mm_rows = n
+        return self._mm
+
+    # -------------------------
+    # Public API
+    # -------------------------
+
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        keys = [text_key(t) for t in texts]
+        with self._lock, self._file_lock(fcntl.LOCK_SH):
+            self._refresh()
+            rows = [self._rows.get(k) for k in keys]
+            found = [r for r in rows if r is not None]
+            out: List[Optional[np.ndarray]] = [None] * len(texts)
+            if found:
+                mm = self._matrix(max(found) + 1)
+                for i, (k, r) in enumerate(zip(keys, rows)):
+                    if r is not None:
+                        out[i] = np.array(mm[r])
+                        self._tick += 1
+                        self._last_used[k] = self._tick
+            self.hits += len(found)
+            self.misses += len(texts) - len(found)
+        return out
+
+    def put_many(self, texts: List[str], X: np.ndarray) -> None:
+        if not texts:
+            return
+        X = np.ascontiguousarray(X, dtype="float32")
+        with self._lock, self._file_lock():
+            self._repair()
+            self._refresh()
+            if self.dim is None:
+                self.dim = int(X.shape[1])
+                self.info_path.write_text(json.dumps({
+                    "model": self.model_name,
+                    "normalize": self.normalize,
+                    "dim": self.dim,
+                }), encoding="utf-8")
+            if X.shape[1] != self.dim:
+                raise ValueError(f"Embedding dim {X.shape[1]} does not match store dim {self.dim} in {self.dir}")
+
+            # Dedupe against what is already on disk (and within the batch)
+            new_keys: List[bytes] = []
+            new_rows: List[int] = []
+            seen = set()
+            for i, t in enumerate(texts):
+                k = text_key(t)
+                if k in self._rows or k in seen:
+                    continue
+                seen.add(k)
+                new_keys.append(k)
+                new_rows.append(i)
+            if not new_keys:
+                return
+
+            start = self.vectors_path.stat().st_size // (4 * self.dim) if self.vectors_path.exists() else 0
+            with self.vectors_path.open("ab") as f:
+                f.write(X[new_rows].tobytes())
+            recs = np.empty(len(new_keys), dtype=KEY_DTYPE)
+            recs["key"] = new_keys
+            recs["row"] = np.arange(start, start + len(new_keys), dtype="int64")
+            with self.keys_path.open("ab") as f:
+                f.write(recs.tobytes())
+
+            for k, r in zip(new_keys, recs["row"].tolist()):
+                self._rows[k] = r
+                self._tick += 1
+                self._last_used[k] = self._tick
+            st = self.keys_path.stat()
+            self._keys_stat = (st.st_ino, st.st_size)
+
+            if self.vectors_path.stat().st_size > self.max_bytes:
+                self._compact()
+
+    def _compact(self) -> None:
+        """Rewrite the store keeping ~75% of max_bytes worth of rows. Caller holds both locks."""
+        row_bytes = 4 * self.dim
+        keep_n = max(0, int(self.max_bytes * 0.75) // row_bytes)
+        by_recency = sorted(
+            self._rows.items(),
+            key=lambda kv: (self._last_used.get(kv[0], 0), kv[1]),
+            reverse=True,
+        )[:keep_n]
+        by_recency.sort(key=lambda kv: kv[1])  # keep on-disk order for sequential reads
+
+        mm = self._matrix(max((r for _, r in by_recency), default=-1) + 1)
+        tmp_vec = self.vectors_path.with_suffix(".f32.tmp")
+        tmp_keys = self.keys_path.with_suffix(".bin.tmp")
+        recs = np.empty(len(by_recency), dtype=KEY_DTYPE)
+        with tmp_vec.open("wb") as f:
+            for new_row, (k, old_row) in enumerate(by_recency):
+                f.write(np.asarray(mm[old_row], dtype="float32").tobytes())
+                recs[new_row] = (k, new_row)
+        recs.tofile(tmp_keys)
+
+        os.replace(tmp_vec, self.vectors_path)
+        os.replace(tmp_keys, self.keys_path)
+
+        evicted = len(self._rows) - len(by_recency)
+        self._rows = {k: i for i, (k, _) in enumerate(by_recency)}
+        self._last_used = {k: self._last_used[k] for k in self._rows if k in self._last_used}
+        self._mm = None
+        st = self.keys_path.stat()
+        self._keys_stat = (st.st_ino, st.st_size)
+        print(f"Embedding store compacted: evicted {evicted} rows, kept {len(self._rows)} ({self.dir})")
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def stats(self) -> Dict[str, object]:
+        size = self.vectors_path.stat().st_size if self.vectors_path.exists() else 0
+        return {
+            "dir": str(self.dir),
+            "rows": len(self._rows),
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -24,19 +24,32 @@ No-answer:
 Notes:
 - Section strings are case-sensitive; keep consistent with meta.jsonl.
 - This eval does NOT “compare answer text”; it evaluates retrieval correctness + abstention.
+
+Usage:
+  python -m app.eval                                  # one encode + search per query
+  python -m app.eval --batched                        # one encode + one search for all queries
+  python -m app.eval --batched --workers 4 --gold big.jsonl
+  python -m app.eval --batched --sweep                # abstention threshold curve → JSON
+  python -m app.eval --hybrid                         # BM25 fast path + RRF fusion, with fast-path stats
+  python -m app.eval --rerank [--rerank-budget-ms 0]  # quality + latency with and without the cross-encoder
+  python -m app.eval --coarse --coarse-fanout 1,2,4   # centroid-routed search vs flat: recall loss, rows scanned
 """
 
 import json
 import statistics
+import time
 from pathlib import Path
 from typing import List, Dict, Optional, Set, Tuple, Iterable, TypeVar
 
 import faiss
+import numpy as np
 
 from app.config import SETTINGS
+from app.meta_store import ColumnarStore, load_meta
 from app.models import Chunk
-from app.utils import read_jsonl
 from app.embedder import Embedder
+from app.shards import load_search_index
+from app.versions import resolve
 
 
 # -------------------------
@@ -150,124 +163,356 @@ def should_abstain(index, top_score: Optional[float]) -> bool:
     # default: treat as distance (e.g. L2)
     return top_score > float(thr)
 
+def abstain_mask(index, top_scores: np.ndarray, thr: Optional[float] = None) -> np.ndarray:
+    """Vectorized should_abstain over an array of top-1 scores (NaN = no result)."""
+    if thr is None:
+        thr = getattr(SETTINGS, "NO_ANSWER_THRESHOLD", None)
+    missing = np.isnan(top_scores)
+    if thr is None:
+        return missing
+    if getattr(index, "metric_type", None) == faiss.METRIC_INNER_PRODUCT:
+        return missing | (top_scores < float(thr))
+    return missing | (top_scores > float(thr))
+
 
 # -------------------------
-# Main
+# Per-example results
 # -------------------------
+#
+# Both evaluation paths produce the same arrays, one entry per gold example:
+#   no_answer  bool   gold says no_answer
+#   top_score  float  top-1 retrieval score (NaN if nothing came back)
+#   rank_doc   int    1-based rank of first expected doc among unique docs (0 = miss@K)
+#   rank_pair  int    same for (doc_id, section) pairs (0 = miss@K or no pair gold)
+#   has_pair   bool   example has (doc_id, section) gold
+#
+# Ranks are recorded regardless of abstention, so the report (or a threshold
+# sweep) can apply any threshold afterwards.
 
-def main():
-    gold = load_gold(Path("eval/gold_questions.jsonl"))
-    index = faiss.read_index(str(SETTINGS.index_dir / "faiss.index"))
-    meta = [Chunk(**row) for row in read_jsonl(SETTINGS.index_dir / "meta.jsonl")]
-    embedder = Embedder(SETTINGS.embedding_model_name)
+def expected_targets(ex: Dict) -> Tuple[Set[str], Set[Tuple[str, str]]]:
+    exp_docs = get_expected_doc_ids(ex)
+    exp_pairs = get_expected_pairs(ex)
+    # If gold only provided expected pairs, derive expected docs for doc-only eval
+    if not exp_docs and exp_pairs:
+        exp_docs = {d for (d, _) in exp_pairs}
+    return exp_docs, exp_pairs
 
-    # NOTE: If you are deduping to SOP-level, hit@10 SOPs doesn't make much sense with 8 SOPs.
-    # If you still want chunk-level hit@10, do not dedupe doc_ids.
-    ks = [1, 3, 5, 10]
-    K = max(ks)
 
-    # Retrieval counters (answerable only)
-    hits_doc = {k: 0 for k in ks}
-    hits_pair = {k: 0 for k in ks}
-    ranks_doc: List[Optional[int]] = []
-    ranks_pair: List[Optional[int]] = []
+def new_results(n: int) -> Dict[str, np.ndarray]:
+    return {
+        "no_answer": np.zeros(n, dtype=bool),
+        "top_score": np.full(n, np.nan, dtype="float32"),
+        "rank_doc": np.zeros(n, dtype="int32"),
+        "rank_pair": np.zeros(n, dtype="int32"),
+        "has_pair": np.zeros(n, dtype=bool),
+    }
 
-    # No-answer counters
-    n_total = len(gold)
-    n_answerable = 0
-    n_no_answer = 0
 
-    no_answer_correct = 0   # gold says no_answer, we abstained
-    no_answer_wrong = 0     # gold says no_answer, we did not abstain
-    false_abstain = 0       # gold answerable, we abstained
+def concat_results(parts: List[Dict[str, np.ndarray]]) -> Dict[str, np.ndarray]:
+    return {k: np.concatenate([p[k] for p in parts]) for k in parts[0]}
 
-    # For doc+section reporting clarity
-    n_answerable_with_section_gold = 0
 
-    for ex in gold:
-        query = ex["query"]
-        is_no_answer = bool(ex.get("no_answer", False))
+def evaluate_per_query(gold: List[Dict], index, meta: List[Chunk], embedder: Embedder, K: int) -> Dict[str, np.ndarray]:
+    res = new_results(len(gold))
 
-        q = embedder.embed_query(query).reshape(1, -1).astype("float32")
+    for n, ex in enumerate(gold):
+        res["no_answer"][n] = bool(ex.get("no_answer", False))
+
+        q = embedder.embed_query(ex["query"]).reshape(1, -1).astype("float32")
 
         # Retrieve more chunks, then dedupe down to K unique doc_ids/pairs
         K_search = max(30, K * 10)
         scores, idxs = index.search(q, K_search)
 
-        top_score = None
-        if scores is not None and len(scores) > 0 and len(scores[0]) > 0:
-            top_score = float(scores[0][0])
-
-        pred_no_answer = should_abstain(index, top_score)
-
-        # Handle gold no-answer examples
-        if is_no_answer:
-            n_no_answer += 1
-            if pred_no_answer:
-                no_answer_correct += 1
-            else:
-                no_answer_wrong += 1
-            # Do not include this example in retrieval hit@k / MRR
-            continue
-
-        # Answerable example
-        n_answerable += 1
+        if scores is not None and len(scores) > 0 and len(scores[0]) > 0 and int(idxs[0][0]) >= 0:
+            res["top_score"][n] = float(scores[0][0])
 
-        if pred_no_answer:
-            # Abstained but should have answered -> treat as miss for retrieval metrics
-            false_abstain += 1
-            ranks_doc.append(None)
-            ranks_pair.append(None)
+        if res["no_answer"][n]:
             continue
 
         # FAISS can return -1 if something goes wrong / empty index
         idx_list = [int(i) for i in idxs[0] if int(i) >= 0]
         retrieved_chunks = [meta[i] for i in idx_list]
 
-        # Expected targets
-        exp_docs = get_expected_doc_ids(ex)
-        exp_pairs = get_expected_pairs(ex)
+        exp_docs, exp_pairs = expected_targets(ex)
+        res["has_pair"][n] = bool(exp_pairs)
 
-        # If gold only provided expected pairs, derive expected docs for doc-only eval
-        if not exp_docs and exp_pairs:
-            exp_docs = {d for (d, _) in exp_pairs}
+        # Dedup in rank order (SOP-level + section-level)
+        retrieved_doc_ids = unique_in_order(c.doc_id for c in retrieved_chunks)[:K]
+        retrieved_pairs = unique_in_order((c.doc_id, getattr(c, "section", None)) for c in retrieved_chunks)[:K]
 
+        res["rank_doc"][n] = first_hit_rank(retrieved_doc_ids, lambda d: d in exp_docs) or 0
         if exp_pairs:
-            n_answerable_with_section_gold += 1
+            res["rank_pair"][n] = first_hit_rank(retrieved_pairs, lambda p: p in exp_pairs) or 0
 
-        # Chunk-level lists
-        doc_ids_by_chunk = [c.doc_id for c in retrieved_chunks]
-        pairs_by_chunk = [(c.doc_id, getattr(c, "section", None)) for c in retrieved_chunks]
+    return res
 
-        # Dedup in rank order (SOP-level + section-level)
-        retrieved_doc_ids = unique_in_order(doc_ids_by_chunk)[:K]
-        retrieved_pairs = unique_in_order(pairs_by_chunk)[:K]
 
-        # --- Doc-only metrics ---
-        rank_doc = first_hit_rank(retrieved_doc_ids, lambda d: d in exp_docs)
-        ranks_doc.append(rank_doc)
-        for k in ks:
-            topk = set(retrieved_doc_ids[:k])
-            if exp_docs.intersection(topk):
-                hits_doc[k] += 1
+# -------------------------
+# Batched evaluation
+# -------------------------
 
-        # --- Doc+Section metrics ---
-        if exp_pairs:
-            rank_pair = first_hit_rank(retrieved_pairs, lambda p: p in exp_pairs)
-        else:
-            rank_pair = None
-        ranks_pair.append(rank_pair)
+def meta_codes(meta: List[Chunk]) -> Tuple[Dict[str, int], np.ndarray, Dict[Tuple[str, str], int], np.ndarray]:
+    """Integer-encode doc_id and (doc_id, section) for every index row."""
+    if isinstance(meta, ColumnarStore):
+        # Already dictionary-encoded on disk: combine the code columns, no row decoding.
+        doc_codes, doc_list = meta.codes("doc_id")
+        section_codes, section_list = meta.codes("section")
+        combined = np.asarray(doc_codes, dtype="int64") * len(section_list) + np.asarray(section_codes)
+        uniq, pair_codes = np.unique(combined, return_inverse=True)
+        pair_vocab = {(doc_list[u // len(section_list)], section_list[u % len(section_list)]): j
+                      for j, u in enumerate(uniq.tolist())}
+        return {d: i for i, d in enumerate(doc_list)}, np.asarray(doc_codes), pair_vocab, pair_codes.astype("int32")
+
+    doc_vocab: Dict[str, int] = {}
+    pair_vocab: Dict[Tuple[str, str], int] = {}
+    doc_codes = np.empty(len(meta), dtype="int32")
+    pair_codes = np.empty(len(meta), dtype="int32")
+    for i, c in enumerate(meta):
+        doc_codes[i] = doc_vocab.setdefault(c.doc_id, len(doc_vocab))
+        pair_codes[i] = pair_vocab.setdefault((c.doc_id, c.section), len(pair_vocab))
+    return doc_vocab, doc_codes, pair_vocab, pair_codes
+
+
+def first_hit_ranks(codes: np.ndarray, expected: np.ndarray, K: int) -> np.ndarray:
+    """
+    codes:    (nq, K_search) code per retrieved chunk, -1 for empty slots
+    expected: (nq, n_codes) bool, True where the code is a gold target
+    Returns the 1-based rank of the first hit among the unique codes of each row
+    (unique_in_order + first_hit_rank, vectorized), 0 if no hit within K.
+    """
+    nq, ks = codes.shape
+    if nq == 0 or ks == 0:
+        return np.zeros(nq, dtype="int32")
+    valid = codes >= 0
+    safe = np.where(valid, codes, 0)
+    rows = np.arange(nq)[:, None]
+
+    # First occurrence of each code within its row
+    keys = (rows * (expected.shape[1] + 1) + (codes + 1)).ravel()
+    _, first_idx = np.unique(keys, return_index=True)
+    first = np.zeros(nq * ks, dtype=bool)
+    first[first_idx] = True
+    first = first.reshape(nq, ks) & valid
+    unique_rank = np.cumsum(first, axis=1)
+
+    hit = expected[rows, safe] & valid
+    any_hit = hit.any(axis=1)
+    pos = hit.argmax(axis=1)
+    rank = unique_rank[np.arange(nq), pos]
+    return np.where(any_hit & (rank <= K), rank, 0).astype("int32")
+
+
+def evaluate_batched(gold: List[Dict], index, meta: List[Chunk], embedder: Embedder, K: int, codes=None) -> Dict[str, np.ndarray]:
+    res = new_results(len(gold))
+    if not gold:
+        return res
+    codes = codes if codes is not None else meta_codes(meta)
+
+    # One encode call and one search call for the whole query matrix
+    Q = embedder.embed_queries([ex["query"] for ex in gold]).astype("float32")
+    K_search = min(max(30, K * 10), index.ntotal)
+    scores, idxs = index.search(Q, K_search)
+
+    has_result = idxs[:, 0] >= 0 if K_search else np.zeros(len(gold), dtype=bool)
+    res["top_score"] = np.where(has_result, scores[:, 0] if K_search else np.nan, np.nan).astype("float32")
+    fill_ranks(res, gold, idxs, codes, K)
+    return res
+
+
+def fill_ranks(res: Dict[str, np.ndarray], gold: List[Dict], idxs: np.ndarray, codes, K: int) -> None:
+    """no_answer / has_pair / rank_doc / rank_pair from retrieved rows (nq, K_search), -1 = empty slot."""
+    doc_vocab, doc_codes, pair_vocab, pair_codes = codes
+    res["no_answer"] = np.array([bool(ex.get("no_answer", False)) for ex in gold], dtype=bool)
+
+    exp_doc = np.zeros((len(gold), len(doc_vocab)), dtype=bool)
+    exp_pair = np.zeros((len(gold), len(pair_vocab)), dtype=bool)
+    for n, ex in enumerate(gold):
+        if res["no_answer"][n]:
+            continue
+        exp_docs, exp_pairs = expected_targets(ex)
+        res["has_pair"][n] = bool(exp_pairs)
+        exp_doc[n, [doc_vocab[d] for d in exp_docs if d in doc_vocab]] = True
+        exp_pair[n, [pair_vocab[p] for p in exp_pairs if p in pair_vocab]] = True
+
+    valid = idxs >= 0
+    safe_idxs = np.where(valid, idxs, 0)
+    res["rank_doc"] = first_hit_ranks(np.where(valid, doc_codes[safe_idxs], -1), exp_doc, K)
+    res["rank_pair"] = first_hit_ranks(np.where(valid, pair_codes[safe_idxs], -1), exp_pair, K)
+
+
+def evaluate_hybrid(gold: List[Dict], index, meta: List[Chunk], embedder: Embedder, lexical, K: int) -> Dict[str, np.ndarray]:
+    """
+    Ranks from the hybrid retriever (BM25 fast path, else RRF of BM25 + dense).
+    top_score, which drives abstention, stays the dense top-1 cosine: hybrid scores
+    are not on the threshold's scale.
+    """
+    from app.retrieval import hybrid_rows
+
+    codes = meta_codes(meta)
+    res = evaluate_batched(gold, index, meta, embedder, K, codes=codes)
+    if not gold:
+        return res
+    K_search = min(max(30, K * 10), index.ntotal)
+    rows = hybrid_rows(index, None, embedder, lexical, [ex["query"] for ex in gold],
+                       [K_search] * len(gold), [(None, None)] * len(gold))
+    idxs = np.full((len(gold), K_search), -1, dtype="int64")
+    for n, (_, r, _) in enumerate(rows):
+        idxs[n, :len(r)] = r[:K_search]
+    fill_ranks(res, gold, idxs, codes, K)
+    return res
+
+
+def evaluate_reranked(gold: List[Dict], index, meta: List[Chunk], embedder: Embedder, reranker, K: int,
+                      budget_ms: float) -> Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray], np.ndarray, np.ndarray]:
+    """
+    Per query: dense search, then a cross-encoder rerank of the top
+    SETTINGS.rerank_candidates under budget_ms. Returns the results without and
+    with the rerank and the per-query latency (ms) of each. top_score stays the
+    dense top-1 in both, so abstention is unchanged.
+    """
+    codes = meta_codes(meta)
+    K_search = min(max(30, K * 10), index.ntotal)
+    n_candidates = max(K, SETTINGS.rerank_candidates)
+    base_idxs = np.full((len(gold), K_search), -1, dtype="int64")
+    rr_idxs = np.full((len(gold), K_search), -1, dtype="int64")
+    base_ms = np.zeros(len(gold))
+    rr_ms = np.zeros(len(gold))
+    top_score = np.full(len(gold), np.nan, dtype="float32")
+
+    for n, ex in enumerate(gold):
+        t0 = time.perf_counter()
+        q = embedder.embed_query(ex["query"]).reshape(1, -1).astype("float32")
+        scores, idxs = index.search(q, K_search)
+        t1 = time.perf_counter()
+        rows = [int(i) for i in idxs[0] if int(i) >= 0]
+        head = rows[:n_candidates]
+        hits = reranker.rerank(ex["query"], [(float(s), meta[i]) for s, i in zip(scores[0], head)], len(head), budget_ms)
+        row_of = {meta[i].chunk_id: i for i in head}
+        reranked = [row_of[c.chunk_id] for _, c in hits] + rows[len(head):]
+        t2 = time.perf_counter()
+
+        base_ms[n] = (t1 - t0) * 1000
+        rr_ms[n] = (t2 - t0) * 1000
+        if rows:
+            top_score[n] = float(scores[0][0])
+        base_idxs[n, :len(rows)] = rows
+        rr_idxs[n, :len(reranked)] = reranked
+
+    base, rr = new_results(len(gold)), new_results(len(gold))
+    for res, idxs in ((base, base_idxs), (rr, rr_idxs)):
+        res["top_score"] = top_score.copy()
+        fill_ranks(res, gold, idxs, codes, K)
+    return base, rr, base_ms, rr_ms
+
+
+def evaluate_coarse(gold: List[Dict], index, meta: List[Chunk], embedder: Embedder, K: int, fanouts: List[int],
+                    level: str) -> Tuple[Dict[str, np.ndarray], List[Dict]]:
+    """
+    Flat search vs coarse-to-fine search (app/coarse.py) at each fan-out, one
+    query at a time and K chunks deep (as search() would ask, not the deeper
+    K_search of the other modes, which would pull in extra groups). Returns the
+    flat results and, per fan-out, the ranks, chunk-level recall@K against the
+    flat top K, rows scored per query and per-query latency.
+    """
+    from app.coarse import TwoStageIndex, with_coarse
+
+    flat = index.base if isinstance(index, TwoStageIndex) else index
+    index_dir = resolve(SETTINGS.index_dir)
+    codes = meta_codes(meta)
+    K_search = min(K, flat.ntotal)
+    Q = embedder.embed_queries([ex["query"] for ex in gold]).astype("float32")
+
+    def run(ix) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        scores = np.full((len(gold), K_search), np.nan, dtype="float32")
+        idxs = np.full((len(gold), K_search), -1, dtype="int64")
+        ms = np.zeros(len(gold))
+        for n in range(len(gold)):
+            t0 = time.perf_counter()
+            D, I = ix.search(Q[n:n + 1], K_search)
+            scores[n], idxs[n] = D[0], I[0]
+            ms[n] = (time.perf_counter() - t0) * 1000
+        return scores, idxs, ms
+
+    def results(scores: np.ndarray, idxs: np.ndarray) -> Dict[str, np.ndarray]:
+        res = new_results(len(gold))
+        res["top_score"] = np.where(idxs[:, 0] >= 0, scores[:, 0], np.nan).astype("float32")
+        fill_ranks(res, gold, idxs, codes, K)
+        return res
+
+    flat_scores, flat_idxs, flat_ms = run(flat)
+    rows = [{"fanout": 0, "res": results(flat_scores, flat_idxs), "recall_vs_flat": 1.0,
+             "rows_per_query": float(flat.ntotal), "ms": flat_ms}]
+    for fanout in fanouts:
+        two = with_coarse(flat, index_dir, fanout, level)
+        if not isinstance(two, TwoStageIndex):
+            raise SystemExit(f"No {index_dir / 'coarse.npz'} (or no vectors.npy); rebuild with python -m app.index_faiss")
+        scores, idxs, ms = run(two)
+        overlap = [len(set(a[:K][a[:K] >= 0]) & set(b[:K][b[:K] >= 0])) / max(1, int((a[:K] >= 0).sum()))
+                   for a, b in zip(flat_idxs, idxs)]
+        rows.append({"fanout": fanout, "res": results(scores, idxs), "recall_vs_flat": float(np.mean(overlap)),
+                     "rows_per_query": two.stats()["rows_per_query"], "ms": ms})
+    return rows[0]["res"], rows
+
+
+_WORKER: Dict[str, object] = {}
+
+
+def _init_worker(index_dir: str, model_name: str) -> None:
+    index, meta, embedder = load_resources(Path(index_dir), model_name)
+    _WORKER.update(index=index, meta=meta, embedder=embedder, codes=meta_codes(meta))
+
+
+def _eval_shard(args: Tuple[List[Dict], int]) -> Dict[str, np.ndarray]:
+    shard, K = args
+    return evaluate_batched(shard, _WORKER["index"], _WORKER["meta"], _WORKER["embedder"], K, codes=_WORKER["codes"])
+
+
+def evaluate_sharded(gold: List[Dict], K: int, workers: int, shard_size: int) -> Dict[str, np.ndarray]:
+    """Split the gold set into contiguous shards and evaluate them in worker processes."""
+    from concurrent.futures import ProcessPoolExecutor
+
+    shards = [(gold[i:i + shard_size], K) for i in range(0, len(gold), shard_size)]
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(str(resolve(SETTINGS.index_dir)), SETTINGS.embedding_model_name),  # one version for every worker
+    ) as ex:
+        parts = list(ex.map(_eval_shard, shards))
+    return concat_results(parts) if parts else new_results(0)
+
+
+# -------------------------
+# Reporting
+# -------------------------
+
+def as_rank_list(ranks: np.ndarray) -> List[Optional[int]]:
+    return [int(r) if r > 0 else None for r in ranks]
 
-        for k in ks:
-            if not exp_pairs:
-                continue
-            topk_pairs = set(retrieved_pairs[:k])
-            if exp_pairs.intersection(topk_pairs):
-                hits_pair[k] += 1
 
-    # -------------------------
-    # Reporting
-    # -------------------------
+def print_report(res: Dict[str, np.ndarray], index, ks: List[int]) -> None:
+    K = max(ks)
+    no_answer = res["no_answer"]
+    answerable = ~no_answer
+    abstained = abstain_mask(index, res["top_score"])
+
+    n_total = len(no_answer)
+    n_answerable = int(answerable.sum())
+    n_no_answer = int(no_answer.sum())
+
+    no_answer_correct = int((no_answer & abstained).sum())   # gold says no_answer, we abstained
+    no_answer_wrong = int((no_answer & ~abstained).sum())    # gold says no_answer, we did not abstain
+    false_abstain = int((answerable & abstained).sum())      # gold answerable, we abstained
+
+    # Abstained-but-answerable examples count as misses for retrieval metrics
+    scored = answerable & ~abstained
+    ranks_doc = as_rank_list(np.where(scored, res["rank_doc"], 0)[answerable])
+    ranks_pair = as_rank_list(np.where(scored, res["rank_pair"], 0)[answerable])
+    hits_doc = {k: sum(1 for r in ranks_doc if r is not None and r <= k) for k in ks}
+    hits_pair = {k: sum(1 for r in ranks_pair if r is not None and r <= k) for k in ks}
+
+    # For doc+section reporting clarity
+    n_answerable_with_section_gold = int((scored & res["has_pair"]).sum())
 
     print(f"Examples: {n_total}")
     print(f"Answerable: {n_answerable} | No-answer: {n_no_answer}")
@@ -317,5 +562,234 @@ def main():
         print(f"false abstains (should answer but abstained): {false_abstain}/{n_answerable} = {false_abstain/n_answerable:.3f}")
 
 
+def retrieval_metrics(res: Dict[str, np.ndarray], ks: List[int]) -> Dict[str, float]:
+    """hit@k / MRR@K over answerable examples, without abstention (pure retrieval quality)."""
+    K = max(ks)
+    answerable = ~res["no_answer"]
+    n = int(answerable.sum())
+    out: Dict[str, float] = {"n_answerable": n}
+    if not n:
+        return out
+    rank_doc = res["rank_doc"][answerable]
+    rank_pair = res["rank_pair"][answerable]
+    n_pair = int(res["has_pair"][answerable].sum())
+    for k in ks:
+        out[f"hit@{k}"] = float(((rank_doc > 0) & (rank_doc <= k)).sum() / n)
+        if n_pair:
+            out[f"hit@{k}_pair"] = float(((rank_pair > 0) & (rank_pair <= k)).sum() / n_pair)
+    out[f"mrr@{K}"] = mrr(as_rank_list(rank_doc), n)
+    if n_pair:
+        out[f"mrr@{K}_pair"] = mrr(as_rank_list(rank_pair), n)
+    return out
+
+
+# -------------------------
+# Threshold sweep
+# -------------------------
+
+def sweep_thresholds(res: Dict[str, np.ndarray], index, thresholds: np.ndarray, ks: List[int]) -> List[Dict]:
+    """
+    Abstention metrics for every threshold at once: (T, n) masks built by
+    broadcasting the recorded top-1 scores against the threshold grid.
+    """
+    no_answer = res["no_answer"]
+    answerable = ~no_answer
+    n_ans = int(answerable.sum())
+    n_no = int(no_answer.sum())
+
+    scores = res["top_score"][None, :]
+    thr = thresholds[:, None]
+    if getattr(index, "metric_type", None) == faiss.METRIC_INNER_PRODUCT:
+        abstained = scores < thr
+    else:
+        abstained = scores > thr
+    abstained |= np.isnan(scores)
+
+    abstain_acc = (abstained & no_answer).sum(axis=1) / max(n_no, 1)
+    false_abstain = (abstained & answerable).sum(axis=1) / max(n_ans, 1)
+    scored = answerable & ~abstained
+    hit = {k: (scored & (res["rank_doc"] > 0) & (res["rank_doc"] <= k)).sum(axis=1) / max(n_ans, 1) for k in ks}
+    # Same denominator as print_report: answerable, not abstained, with section gold
+    n_pair = np.maximum((scored & res["has_pair"]).sum(axis=1), 1)
+    hit_pair = {k: (scored & (res["rank_pair"] > 0) & (res["rank_pair"] <= k)).sum(axis=1) / n_pair for k in ks}
+
+    curve = []
+    for t in range(len(thresholds)):
+        row = {
+            "threshold": round(float(thresholds[t]), 6),
+            "abstain_accuracy": float(abstain_acc[t]) if n_no else None,
+            "false_abstain_rate": float(false_abstain[t]),
+        }
+        row.update({f"hit@{k}": float(hit[k][t]) for k in ks})
+        row.update({f"hit@{k}_pair": float(hit_pair[k][t]) for k in ks})
+        curve.append(row)
+    return curve
+
+
+def recommend_threshold(curve: List[Dict]) -> Dict:
+    """
+    Operating point = best balanced accuracy between abstaining on no_answer
+    questions and answering answerable ones. Ties (flat stretches of the curve)
+    resolve to the middle of the tied range, away from both edges.
+    """
+    def balanced(row: Dict) -> float:
+        acc = row["abstain_accuracy"] if row["abstain_accuracy"] is not None else 0.0
+        return 0.5 * (acc + (1.0 - row["false_abstain_rate"]))
+
+    best = max(balanced(r) for r in curve)
+    tied = [r for r in curve if balanced(r) >= best - 1e-12]
+    return dict(tied[len(tied) // 2], balanced_accuracy=best)
+
+
+def run_sweep(res: Dict[str, np.ndarray], index, ks: List[int], n_thresholds: int, out: Path) -> Dict:
+    scores = res["top_score"][~np.isnan(res["top_score"])]
+    if len(scores):
+        lo, hi = float(scores.min()), float(scores.max())
+        pad = 0.01 * max(hi - lo, 1e-6)
+        thresholds = np.linspace(lo - pad, hi + pad, n_thresholds).astype("float32")
+    else:
+        thresholds = np.zeros(1, dtype="float32")
+
+    curve = sweep_thresholds(res, index, thresholds, ks)
+    result = {
+        "embedding_model": SETTINGS.embedding_model_name,
+        "metric": "inner_product" if getattr(index, "metric_type", None) == faiss.METRIC_INNER_PRODUCT else "distance",
+        "n_answerable": int((~res["no_answer"]).sum()),
+        "n_no_answer": int(res["no_answer"].sum()),
+        "recommended": recommend_threshold(curve),
+        "curve": curve,
+    }
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(result, indent=2), encoding="utf-8")
+    return result
+
+
+# -------------------------
+# Main
+# -------------------------
+
+def load_resources(index_dir: Path, model_name: str):
+    index_dir = resolve(index_dir)
+    manifest_path = index_dir / "manifest.json"
+    manifest = json.loads(manifest_path.read_text(encoding="utf-8")) if manifest_path.exists() else {}
+    index = load_search_index(index_dir, manifest)
+    meta = load_meta(index_dir, expected_n=index.ntotal)
+    embedder = Embedder(model_name)
+    return index, meta, embedder
+
+
+def print_rerank_report(base: Dict[str, np.ndarray], rr: Dict[str, np.ndarray], base_ms: np.ndarray,
+                        rr_ms: np.ndarray, ks: List[int], stats: Dict[str, object]) -> None:
+    print("\n=== RERANK (without → with) ===")
+    m0, m1 = retrieval_metrics(base, ks), retrieval_metrics(rr, ks)
+    for name in m0:
+        if name != "n_answerable":
+            print(f"{name:<16} {m0[name]:.3f} → {m1[name]:.3f} ({m1[name] - m0[name]:+.3f})")
+    if len(base_ms):
+        p = lambda xs, q: float(np.percentile(xs, q))
+        print(f"latency ms p50/p95: {p(base_ms, 50):.1f}/{p(base_ms, 95):.1f} → {p(rr_ms, 50):.1f}/{p(rr_ms, 95):.1f}")
+    print(f"reranked requests: {stats['requests']} | shrunk by budget: {stats['shrunk']} | skipped: {stats['skipped']} | "
+          f"ms/pair: {stats['ms_per_pair']}")
+
+
+def print_coarse_report(rows: List[Dict], ks: List[int], level: str, n_groups: int) -> None:
+    K = max(ks)
+    print(f"\n=== COARSE-TO-FINE ({level} centroids, {n_groups} groups; fan-out 0 = flat) ===")
+    print(f"{'fanout':>6} {'rows/query':>10} {f'recall@{K} vs flat':>17} {'hit@1':>6} {'hit@1_pair':>10} "
+          f"{f'mrr@{K}':>7} {'p50 ms':>7} {'p95 ms':>7}")
+    for row in rows:
+        m = retrieval_metrics(row["res"], ks)
+        print(f"{row['fanout']:>6} {row['rows_per_query'] or 0:>10.1f} {row['recall_vs_flat']:>17.3f} "
+              f"{m.get('hit@1', 0):>6.3f} {m.get('hit@1_pair', 0):>10.3f} {m.get(f'mrr@{K}', 0):>7.3f} "
+              f"{np.percentile(row['ms'], 50):>7.2f} {np.percentile(row['ms'], 95):>7.2f}")
+
+
+def main():
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Retrieval + abstention eval over a gold JSONL file")
+    ap.add_argument("--gold", type=Path, default=Path("eval/gold_questions.jsonl"))
+    ap.add_argument("--batched", action="store_true",
+                    help="Encode all queries in one call and search the whole query matrix at once")
+    ap.add_argument("--workers", type=int, default=1,
+                    help="With --batched: shard the gold file across this many processes")
+    ap.add_argument("--shard-size", type=int, default=1000,
+                    help="Gold examples per worker shard")
+    ap.add_argument("--sweep", action="store_true",
+                    help="Record scores/ranks once and sweep the abstention threshold instead of reporting")
+    ap.add_argument("--hybrid", action="store_true",
+                    help="Rank with the BM25 fast path + RRF fusion (needs lexical.npz from app.index_faiss)")
+    ap.add_argument("--rerank", action="store_true",
+                    help="Per-query search, also reranked by the cross-encoder (app/rerank.py); report both")
+    ap.add_argument("--rerank-budget-ms", type=float, default=SETTINGS.rerank_budget_ms,
+                    help="Per-query rerank budget for --rerank (0 = no limit)")
+    ap.add_argument("--coarse", action="store_true",
+                    help="Per-query flat search vs centroid-routed search (app/coarse.py) at each --coarse-fanout")
+    ap.add_argument("--coarse-fanout", default="1,2,4,8", help="Comma-separated fan-outs for --coarse")
+    ap.add_argument("--coarse-level", choices=["doc", "section"], default=SETTINGS.coarse_level)
+    ap.add_argument("--n-thresholds", type=int, default=400)
+    ap.add_argument("--sweep-out", type=Path, default=SETTINGS.abstain_calibration_path)
+    args = ap.parse_args()
+
+    gold = load_gold(args.gold)
+
+    # NOTE: If you are deduping to SOP-level, hit@10 SOPs doesn't make much sense with 8 SOPs.
+    # If you still want chunk-level hit@10, do not dedupe doc_ids.
+    ks = [1, 3, 5, 10]
+    K = max(ks)
+
+    t0 = time.perf_counter()
+    if args.batched and args.workers > 1:
+        res = evaluate_sharded(gold, K, args.workers, args.shard_size)
+        index = load_search_index(SETTINGS.index_dir)  # for metric_type only
+    else:
+        index, meta, embedder = load_resources(SETTINGS.index_dir, SETTINGS.embedding_model_name)
+        if args.hybrid:
+            from app.lexical import load_lexical
+            lexical = load_lexical(resolve(SETTINGS.index_dir))
+            if lexical is None:
+                raise SystemExit(f"No lexical.npz in {SETTINGS.index_dir}; rebuild with python -m app.index_faiss")
+            res = evaluate_hybrid(gold, index, meta, embedder, lexical, K)
+        elif args.rerank:
+            from app.rerank import Reranker
+            reranker = Reranker(SETTINGS.rerank_model_name, SETTINGS.rerank_cache_size, SETTINGS.rerank_batch_size)
+            _ = reranker.model, embedder.model  # load both models before timing
+            res, res_rr, base_ms, rr_ms = evaluate_reranked(gold, index, meta, embedder, reranker, K, args.rerank_budget_ms)
+        elif args.coarse:
+            fanouts = [int(f) for f in args.coarse_fanout.split(",") if f.strip()]
+            res, coarse_rows = evaluate_coarse(gold, index, meta, embedder, K, fanouts, args.coarse_level)
+        elif args.batched:
+            res = evaluate_batched(gold, index, meta, embedder, K)
+        else:
+            res = evaluate_per_query(gold, index, meta, embedder, K)
+    elapsed = time.perf_counter() - t0
+
+    if args.sweep:
+        result = run_sweep(res, index, ks, args.n_thresholds, args.sweep_out)
+        rec = result["recommended"]
+        print(f"Swept {len(result['curve'])} thresholds over {len(gold)} examples → {args.sweep_out}")
+        print(f"Recommended threshold: {rec['threshold']:.4f} | abstain accuracy: {rec['abstain_accuracy']} | "
+              f"false abstain rate: {rec['false_abstain_rate']:.3f} | hit@{K}: {rec[f'hit@{K}']:.3f}")
+        return
+
+    print_report(res, index, ks)
+    if args.rerank:
+        print_rerank_report(res, res_rr, base_ms, rr_ms, ks, reranker.stats())
+    if args.coarse:
+        from app.coarse import load_coarse
+        n_groups = len(load_coarse(resolve(SETTINGS.index_dir), args.coarse_level))
+        print_coarse_report(coarse_rows, ks, args.coarse_level, n_groups)
+    if args.hybrid:
+        from app.lexical import HYBRID_STATS
+        h = HYBRID_STATS.snapshot()
+        print("\n=== HYBRID ===")
+        print(f"lexical fast path: {h['fast_path']}/{h['queries']} = {h['fast_path_rate'] or 0:.3f} | "
+              f"fast p50/p95 ms: {h['fast_path_latency']['p50_ms']}/{h['fast_path_latency']['p95_ms']} | "
+              f"fused p50/p95 ms: {h['fused_latency']['p50_ms']}/{h['fused_latency']['p95_ms']}")
+    mode = ('hybrid' if args.hybrid else 'rerank' if args.rerank else 'coarse' if args.coarse
+            else 'batched' if args.batched else 'per-query')
+    print(f"\nEval time: {elapsed:.2f}s ({mode}, workers={args.workers})")
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,232 @@
+"""
+app/filters.py
+
+Per-doc_id and per-section ID bitmaps over index rows, built at index time
+(filters.npz next to faiss.index). They turn sidebar filters into a FAISS
+IDSelectorBitmap, so filtering happens inside the search instead of
+over-retrieving and dropping hits, and they give the facet counts for the
+filter dropdowns.
+
+On HNSW / IVF indexes a selector can return fewer than k hits, so those are
+searched through FilteredIndex, which scores small filters exactly and tops up
+any short result from vectors.npy.
+
+Bitmaps are packed little-endian (bit i of byte i >> 3 is row i), which is
+the layout faiss.IDSelectorBitmap expects.
+"""
+
+import json
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.config import SETTINGS
+from app.models import Chunk
+from app.rescore import unwrap
+from app.tracing import span
+
+
+MIN_CHUNK_CHARS = 80  # rows shorter than this (stripped) are never returned by search()
+
+
+def pack(mask: np.ndarray) -> np.ndarray:
+    return np.packbits(mask.astype(bool), bitorder="little")
+
+
+def popcount(bits: np.ndarray) -> int:
+    return int(np.unpackbits(bits).sum())
+
+
+class FilterBitmaps:
+    def __init__(self, n: int, doc_ids: List[str], doc_bits: np.ndarray,
+                 sections: List[str], section_bits: np.ndarray, useful_bits: np.ndarray):
+        self.n = n
+        self.doc_ids = doc_ids
+        self.sections = sections
+        self.doc_bits = doc_bits          # (n_docs, ceil(n/8)) uint8
+        self.section_bits = section_bits  # (n_sections, ceil(n/8)) uint8
+        self.useful_bits = useful_bits    # (ceil(n/8),) uint8
+        self._doc_pos = {d: i for i, d in enumerate(doc_ids)}
+        self._section_pos = {s: i for i, s in enumerate(sections)}
+
+    @classmethod
+    def from_chunks(cls, chunks: List[Chunk]) -> "FilterBitmaps":
+        n = len(chunks)
+        doc_ids = sorted({c.doc_id for c in chunks})
+        sections = sorted({c.section for c in chunks})
+        doc_pos = {d: i for i, d in enumerate(doc_ids)}
+        section_pos = {s: i for i, s in enumerate(sections)}
+
+        doc_mask = np.zeros((len(doc_ids), n), dtype=bool)
+        section_mask = np.zeros((len(sections), n), dtype=bool)
+        useful = np.zeros(n, dtype=bool)
+        for i, c in enumerate(chunks):
+            doc_mask[doc_pos[c.doc_id], i] = True
+            section_mask[section_pos[c.section], i] = True
+            useful[i] = len(c.text.strip()) >= MIN_CHUNK_CHARS
+
+        return cls(
+            n,
+            doc_ids, np.packbits(doc_mask, axis=1, bitorder="little"),
+            sections, np.packbits(section_mask, axis=1, bitorder="little"),
+            pack(useful),
+        )
+
+    # -------------------------
+    # Persistence
+    # -------------------------
+
+    def save(self, path: Path) -> None:
+        np.savez(
+            path,
+            n=np.array(self.n),
+            vocab=np.array(json.dumps({"doc_ids": self.doc_ids, "sections": self.sections})),
+            doc_bits=self.doc_bits,
+            section_bits=self.section_bits,
+            useful_bits=self.useful_bits,
+        )
+
+    @classmethod
+    def load(cls, path: Path) -> "FilterBitmaps":
+        with np.load(path) as z:
+            vocab = json.loads(str(z["vocab"]))
+            return cls(int(z["n"]), vocab["doc_ids"], z["doc_bits"], vocab["sections"],
+                       z["section_bits"], z["useful_bits"])
+
+    # -------------------------
+    # Queries
+    # -------------------------
+
+    def select(self, doc_id: Optional[str] = None, section: Optional[str] = None, useful_only: bool = True) -> np.ndarray:
+        """Packed bitmap of rows matching all given filters."""
+        bits = self.useful_bits.copy() if useful_only else pack(np.ones(self.n, dtype=bool))
+        if doc_id is not None:
+            pos = self._doc_pos.get(doc_id)
+            bits &= self.doc_bits[pos] if pos is not None else 0
+        if section is not None:
+            pos = self._section_pos.get(section)
+            bits &= self.section_bits[pos] if pos is not None else 0
+        return bits
+
+    def count(self, doc_id: Optional[str] = None, section: Optional[str] = None) -> int:
+        return popcount(self.select(doc_id, section))
+
+    def facet_counts(self, field: str, doc_id: Optional[str] = None, section: Optional[str] = None) -> Dict[str, int]:
+        """Searchable rows per doc_id (field="doc_id") or per section, given the other filter."""
+        base = self.select(doc_id if field != "doc_id" else None, section if field != "section" else None)
+        values, bits = (self.doc_ids, self.doc_bits) if field == "doc_id" else (self.sections, self.section_bits)
+        counts = np.unpackbits(bits & base[None, :], axis=1).sum(axis=1)
+        return {v: int(c) for v, c in zip(values, counts)}
+
+
+def _inner(index):
+    """The faiss index under IDMap wrappers, downcast (None for None)."""
+    import faiss
+
+    base = faiss.downcast_index(index) if index is not None else None
+    while isinstance(base, faiss.IndexIDMap):
+        base = faiss.downcast_index(base.index)
+    return base
+
+
+def search_params(bits: np.ndarray, n: int, index=None, widen: float = 1.0) -> Tuple[object, np.ndarray]:
+    """
+    faiss.SearchParameters restricted to the rows set in `bits`, of the type the
+    index expects (HNSW / IVF reject plain SearchParameters) and carrying its
+    current efSearch / nprobe, multiplied by `widen` for selective filters.
+    The selector holds a raw pointer into `bits`; keep the returned array alive for the search.
+    """
+    import faiss
+
+    bits = np.ascontiguousarray(bits, dtype=np.uint8)
+    sel = faiss.IDSelectorBitmap(n, faiss.swig_ptr(bits))
+
+    base = _inner(index)
+    if isinstance(base, faiss.IndexHNSW):
+        ef = base.hnsw.efSearch
+        return faiss.SearchParametersHNSW(sel=sel, efSearch=max(ef, int(ef * widen))), bits
+    if isinstance(base, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=sel, nprobe=min(base.nlist, max(base.nprobe, int(base.nprobe * widen)))), bits
+    return faiss.SearchParameters(sel=sel), bits
+
+
+def approximate(index) -> bool:
+    """True for graph / multi-list indexes, where a selector can cut the search short of k hits."""
+    import faiss
+
+    base = _inner(index)
+    return isinstance(base, faiss.IndexHNSW) or (isinstance(base, faiss.IndexIVF) and base.nlist > 1)
+
+
+def exact_search(vectors: np.ndarray, Q: np.ndarray, k: int, rows: np.ndarray,
+                 block: int = 32_768) -> Tuple[np.ndarray, np.ndarray]:
+    """Exact inner-product top-k of Q over `rows` of vectors; (scores, row ids) padded with -1 ids."""
+    D = np.full((len(Q), k), -np.inf, dtype="float32")
+    I = np.full((len(Q), k), -1, dtype="int64")
+    for start in range(0, len(rows), block):
+        part = rows[start:start + block]  # ascending reads from the memory-mapped vectors
+        S = Q @ np.asarray(vectors[part], dtype="float32").T
+        D = np.hstack([D, S])
+        I = np.hstack([I, np.broadcast_to(part, S.shape)])
+        order = np.argsort(-D, axis=1, kind="stable")[:, :k]
+        D = np.take_along_axis(D, order, axis=1)
+        I = np.take_along_axis(I, order, axis=1)
+    return D, I
+
+
+class FilteredIndex:
+    """
+    Filtered search for HNSW / IVF indexes, which with an ID selector can return
+    fewer than k hits: the graph walk or the probed lists run out of allowed rows
+    before finding k. Filters matching few rows (SETTINGS.filter_exact_rows, or
+    filter_exact_fraction of the index) are scored exactly against vectors.npy.
+    Larger ones go through the index with efSearch / nprobe scaled by
+    1 / selectivity (at most filter_max_widen), and any query still short of k
+    hits is redone exactly.
+    """
+
+    def __init__(self, base, vectors: np.ndarray):
+        self.base = base          # the ANN index (possibly a RescoredIndex)
+        self.vectors = vectors
+        self.ntotal = base.ntotal
+        self.d = base.d
+        self.metric_type = base.metric_type
+
+    def search(self, Q: np.ndarray, k: int, params=None, bits: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """faiss-like search; with `bits` (packed bitmap) only those rows, as close to exact as above."""
+        if bits is None:
+            return self.base.search(Q, k, params=params)
+        Q = np.ascontiguousarray(Q, dtype="float32")
+        rows = np.flatnonzero(np.unpackbits(bits, count=self.ntotal, bitorder="little"))
+        exact = len(rows) <= max(SETTINGS.filter_exact_rows, SETTINGS.filter_exact_fraction * self.ntotal)
+        with span("search.filtered", rows=len(rows), exact=exact) as attrs:
+            if exact:
+                return exact_search(self.vectors, Q, k, rows)
+            widen = min(SETTINGS.filter_max_widen, self.ntotal / len(rows))
+            params, _bits = search_params(bits, self.ntotal, unwrap(self.base), widen)
+            D, I = self.base.search(Q, k, params=params)
+            short = (I[:, :min(k, len(rows))] < 0).any(axis=1)
+            attrs["filled"] = int(short.sum())
+            if short.any():
+                D[short], I[short] = exact_search(self.vectors, Q[short], k, rows)
+            return D, I
+
+
+def with_exact_filter(index, vectors: Optional[np.ndarray]):
+    """FilteredIndex over approximate indexes when the float vectors are available, else the index unchanged."""
+    import faiss
+
+    if vectors is None or vectors.shape[0] != index.ntotal or index.metric_type != faiss.METRIC_INNER_PRODUCT:
+        return index
+    return FilteredIndex(index, vectors) if approximate(unwrap(index)) else index
+
+
+def load_or_build(index_dir: Path, meta: List[Chunk]) -> FilterBitmaps:
+    path = index_dir / "filters.npz"
+    if path.exists():
+        bm = FilterBitmaps.load(path)
+        if bm.n == len(meta):
+            return bm
+    # Index built before bitmaps existed (or out of sync): build in memory.
+    return FilterBitmaps.from_chunks(meta)
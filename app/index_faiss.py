@@ -1,51 +1,581 @@
+import argparse
+import hashlib
 import json
+import shutil
 from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
 import numpy as np
 import faiss
 from tqdm import tqdm
 
+from app.coarse import build_coarse, save_coarse
 from app.config import SETTINGS
 from app.models import Chunk
 from app.utils import read_jsonl, write_jsonl
 from app.embedder import Embedder
+from app.filters import FilterBitmaps, exact_search, with_exact_filter
+from app.lexical import LexicalIndex
+from app.meta_store import write_chunk_meta
+from app.rescore import LOSSLESS_CODECS, RescoredIndex
+from app.tracing import span
 
 
-def main():
-    chunks_path = SETTINGS.processed_dir / "chunks.jsonl"
-    chunks = [Chunk(**row) for row in read_jsonl(chunks_path)]
-    texts = [c.text for c in chunks]
+def text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
 
-    embedder = Embedder(SETTINGS.embedding_model_name)
 
-    # Batch embed
+def embed_in_batches(embedder: Embedder, texts: List[str], bs: int = 64) -> np.ndarray:
     embs = []
-    bs = 64
     for i in tqdm(range(0, len(texts), bs), desc="Embedding"):
         embs.append(embedder.embed_texts(texts[i:i+bs]))
-    X = np.vstack(embs).astype("float32")
+    return np.vstack(embs).astype("float32")
+
+
+def pq_string(d: int, n: int) -> str:
+    if d % SETTINGS.pq_m:
+        raise SystemExit(f"pq_m={SETTINGS.pq_m} must divide the embedding dim {d}")
+    # 2**nbits centroids per sub-quantizer need at least that many training vectors
+    nbits = min(SETTINGS.pq_nbits, max(1, int(np.log2(max(n, 2)))))
+    return f"PQ{SETTINGS.pq_m}x{nbits}"
+
+
+def storage_string(d: int, n: int) -> str:
+    """How vectors are stored inside flat / hnsw / ivf_flat indexes (SETTINGS.vector_codec)."""
+    codec = SETTINGS.vector_codec
+    if codec == "fp32":
+        return "Flat"
+    if codec == "fp16":
+        return "SQfp16"
+    if codec == "sq8":
+        return "SQ8"
+    if codec == "pq":
+        return pq_string(d, n)
+    raise SystemExit(f"Unknown vector_codec {codec!r} (expected fp32 | fp16 | sq8 | pq)")
+
+
+def factory_string(d: int, n: int) -> str:
+    """faiss.index_factory description for SETTINGS.index_type, sized for n vectors."""
+    # IDs are row positions in meta.jsonl, so meta[i] lookups keep working.
+    t = SETTINGS.index_type
+    if t == "flat":
+        if SETTINGS.vector_codec == "pq":
+            # IndexPQ can't take an ID selector; a single-list IVF-PQ is the same full scan and can take one
+            return f"IDMap2,IVF1,{pq_string(d, n)}"
+        return f"IDMap2,{storage_string(d, n)}"
+    if t == "hnsw":
+        return f"IDMap2,HNSW{SETTINGS.hnsw_m},{storage_string(d, n)}"
+
+    # k-means wants ~39 training points per centroid
+    nlist = max(1, min(SETTINGS.ivf_nlist, n // 39))
+    if t == "ivf_flat":
+        return f"IDMap2,IVF{nlist},{storage_string(d, n)}"
+    if t == "ivf_pq":
+        return f"IDMap2,IVF{nlist},{pq_string(d, n)}"
+    raise SystemExit(f"Unknown index_type {t!r} (expected flat | hnsw | ivf_flat | ivf_pq)")
+
+
+def effective_codec() -> str:
+    return "pq" if SETTINGS.index_type == "ivf_pq" else SETTINGS.vector_codec
+
+
+def exact_build() -> bool:
+    return SETTINGS.index_type == "flat" and effective_codec() == "fp32"
+
+
+def configure_search(index: faiss.Index) -> None:
+    """Query-time knobs; written into the index file so every reader gets them."""
+    base = faiss.downcast_index(index.index) if hasattr(index, "index") else index
+    if hasattr(base, "hnsw"):
+        base.hnsw.efSearch = SETTINGS.hnsw_ef_search
+    if hasattr(base, "nprobe"):
+        base.nprobe = min(SETTINGS.ivf_nprobe, base.nlist)
+
+
+def build_index(X: np.ndarray) -> faiss.Index:
+    n, d = X.shape
+    index = faiss.index_factory(d, factory_string(d, n), faiss.METRIC_INNER_PRODUCT)  # cosine (we normalized)
+    base = faiss.downcast_index(index.index)
+    if hasattr(base, "hnsw"):
+        base.hnsw.efConstruction = SETTINGS.hnsw_ef_construction
+
+    if not index.is_trained:
+        rng = np.random.default_rng(0)
+        sample = X if n <= SETTINGS.train_sample_size else X[rng.choice(n, SETTINGS.train_sample_size, replace=False)]
+        index.train(sample)
+
+    index.add_with_ids(X, np.arange(n, dtype="int64"))
+    configure_search(index)
+    return index
+
+
+def as_served(index: faiss.Index, X: np.ndarray):
+    """The index the way readers will search it: with exact re-scoring for lossy codecs."""
+    if effective_codec() in LOSSLESS_CODECS or SETTINGS.rescore_factor <= 1:
+        return index
+    return RescoredIndex(index, X, SETTINGS.rescore_factor)
+
+
+# -------------------------
+# Recall guard
+# -------------------------
+
+def recall_queries(embedder: Embedder, X: np.ndarray, n_queries: int) -> Tuple[np.ndarray, str]:
+    """Gold questions where we have them, topped up with noisy copies of random chunk vectors."""
+    gold_texts: List[str] = []
+    for p in sorted(Path("eval").glob("*.jsonl")):
+        gold_texts.extend(row["query"] for row in read_jsonl(p) if row.get("query"))
+    gold_texts = gold_texts[:n_queries]
+    parts = [embedder.embed_queries(gold_texts)] if gold_texts else []
+
+    n_synth = n_queries - len(gold_texts)
+    if n_synth > 0:
+        rng = np.random.default_rng(1)
+        base = X[rng.integers(0, X.shape[0], n_synth)]
+        noisy = base + rng.normal(0, 0.05, base.shape).astype("float32")
+        noisy /= np.linalg.norm(noisy, axis=1, keepdims=True)
+        parts.append(noisy.astype("float32"))
+    source = f"{len(gold_texts)} gold + {max(n_synth, 0)} synthetic"
+    return np.vstack(parts).astype("float32"), source
+
+
+def measure_recall(index: faiss.Index, X: np.ndarray, Q: np.ndarray, k: int) -> float:
+    """Mean |ANN top-k ∩ exact top-k| / k over the query sample."""
+    k = min(k, X.shape[0])
+    exact = faiss.IndexFlatIP(X.shape[1])
+    exact.add(X)
+    _, truth = exact.search(Q, k)
+    _, got = index.search(Q, k)
+    overlap = [len(set(t.tolist()) & set(g.tolist())) for t, g in zip(truth, got)]
+    return float(np.mean(overlap)) / k
+
+
+def measure_filtered_recall(index, X: np.ndarray, bitmaps: FilterBitmaps, chunks: List[Chunk],
+                            Q: np.ndarray, k: int) -> float:
+    """
+    measure_recall for sidebar-filtered searches, run the way readers run them
+    (retrieval.filtered_search). Each query is restricted to the doc_id (even
+    rows) or section (odd rows) of a random chunk, so small and large filters
+    both show up; recall is against exact search over the allowed rows.
+    """
+    from app.retrieval import filtered_search
+
+    rng = np.random.default_rng(2)
+    picks = rng.integers(0, len(chunks), len(Q))
+    overlap: List[float] = []
+    for i, r in enumerate(picks.tolist()):
+        doc_filter, section_filter = (chunks[r].doc_id, None) if i % 2 == 0 else (None, chunks[r].section)
+        rows = np.flatnonzero(np.unpackbits(bitmaps.select(doc_filter, section_filter), count=bitmaps.n,
+                                            bitorder="little"))
+        k_eff = min(k, len(rows))
+        if not k_eff:
+            continue
+        _, truth = exact_search(X, Q[i:i + 1], k_eff, rows)
+        _, got = filtered_search(index, bitmaps, Q[i:i + 1], k, doc_filter, section_filter)
+        overlap.append(len(set(truth[0].tolist()) & set(got[0].tolist())) / k_eff)
+    return float(np.mean(overlap)) if overlap else 1.0
+
+
+# -------------------------
+# Quality accounting
+# -------------------------
+
+def memory_footprint(index: faiss.Index, n: int, d: int) -> Dict[str, float]:
+    index_bytes = int(faiss.serialize_index(index).nbytes)
+    fp32_bytes = n * d * 4
+    return {
+        "index_bytes": index_bytes,
+        "fp32_vectors_bytes": fp32_bytes,
+        "bytes_per_vector": round(index_bytes / max(n, 1), 1),
+        "ratio_vs_fp32": round(index_bytes / max(fp32_bytes, 1), 4),
+        "rescore_copy_bytes": fp32_bytes if effective_codec() not in LOSSLESS_CODECS else 0,  # on disk, mmap'd
+    }
+
+
+def quality_vs_exact(served, X: np.ndarray, chunks: List[Chunk], embedder: Embedder) -> Optional[Dict]:
+    """hit@k / MRR from app.eval on the gold files, for the served index and for exact fp32 search."""
+    from app.eval import evaluate_batched, load_gold, meta_codes, retrieval_metrics
+
+    gold: List[Dict] = []
+    paths = sorted(Path("eval").glob("*.jsonl"))
+    for p in paths:
+        gold.extend(load_gold(p))
+    if not gold:
+        return None
+
+    ks = [1, 3, 5, 10]
+    exact = faiss.IndexFlatIP(X.shape[1])
+    exact.add(X)
+    codes = meta_codes(chunks)
+    base = retrieval_metrics(evaluate_batched(gold, exact, chunks, embedder, max(ks), codes=codes), ks)
+    got = retrieval_metrics(evaluate_batched(gold, served, chunks, embedder, max(ks), codes=codes), ks)
+    return {
+        "gold": [str(p) for p in paths],
+        "exact": base,
+        "index": got,
+        "delta": {m: round(got[m] - base[m], 4) for m in base if m != "n_answerable"},
+    }
+
+
+def load_previous_build(index_dir: Path) -> Optional[Tuple[faiss.Index, Optional[np.ndarray], List[Dict], dict]]:
+    faiss_path = index_dir / "faiss.index"
+    meta_path = index_dir / "meta.jsonl"
+    manifest_path = index_dir / "manifest.json"
+    if not faiss_path.exists() or not meta_path.exists() or not manifest_path.exists():
+        return None
+
+    manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+    if (manifest.get("embedding_model") != SETTINGS.embedding_model_name
+            or manifest.get("embedding_backend", "torch") != SETTINGS.embedding_backend):
+        print("Embedding model or backend changed since last build; doing a full rebuild.")
+        return None
+
+    index = faiss.read_index(str(faiss_path))
+    old_meta = list(read_jsonl(meta_path))
+    if index.ntotal != len(old_meta):
+        print("Existing index and meta.jsonl disagree; doing a full rebuild.")
+        return None
+
+    # Float copy of the vectors: lossless reuse whatever the index type
+    vectors_path = index_dir / "vectors.npy"
+    vectors = np.load(vectors_path, mmap_mode="r") if vectors_path.exists() else None
+    if vectors is not None and vectors.shape[0] != len(old_meta):
+        vectors = None
+    return index, vectors, old_meta, manifest
+
+
+def plan_incremental(old_meta: List[Dict], chunks: List[Chunk]) -> Tuple[List[Optional[int]], Dict[str, int]]:
+    """
+    For each new chunk, find the old row whose vector can be reused:
+    same chunk_id and same text hash first, else any old row with identical text
+    (e.g. a chunk whose line range shifted because an earlier line was edited).
+    Returns (old_row_or_None per new chunk, counts).
+    """
+    old_by_id: Dict[str, Tuple[int, str]] = {}
+    old_by_hash: Dict[str, int] = {}
+    for i, row in enumerate(old_meta):
+        h = text_hash(row["text"])
+        old_by_id[row["chunk_id"]] = (i, h)
+        old_by_hash.setdefault(h, i)
+
+    reuse: List[Optional[int]] = []
+    counts = {"unchanged": 0, "moved": 0, "changed": 0, "added": 0, "removed": 0}
+    new_ids = set()
+    for c in chunks:
+        new_ids.add(c.chunk_id)
+        h = text_hash(c.text)
+        prev = old_by_id.get(c.chunk_id)
+        if prev is not None and prev[1] == h:
+            reuse.append(prev[0])
+            counts["unchanged"] += 1
+        elif h in old_by_hash:
+            reuse.append(old_by_hash[h])
+            counts["moved"] += 1
+        else:
+            reuse.append(None)
+            counts["changed" if prev is not None else "added"] += 1
+
+    counts["removed"] = sum(1 for cid in old_by_id if cid not in new_ids)
+    return reuse, counts
+
+
+def incremental_vectors(
+    old_index: faiss.Index,
+    old_vectors: Optional[np.ndarray],
+    reuse: List[Optional[int]],
+    chunks: List[Chunk],
+    embedder: Embedder,
+) -> np.ndarray:
+    d = old_index.d
+    X = np.zeros((len(chunks), d), dtype="float32")
+
+    kept_new = np.array([i for i, r in enumerate(reuse) if r is not None], dtype="int64")
+    kept_old = np.array([r for r in reuse if r is not None], dtype="int64")
+    if len(kept_old):
+        if old_vectors is not None:
+            X[kept_new] = old_vectors[kept_old]
+        else:  # older builds without vectors.npy (flat indexes reconstruct exactly)
+            X[kept_new] = old_index.reconstruct_batch(kept_old)
+
+    todo = [i for i, r in enumerate(reuse) if r is None]
+    if todo:
+        X[todo] = embed_in_batches(embedder, [chunks[i].text for i in todo])
+    return X
+
+
+def verify_against_full(X: np.ndarray, chunks: List[Chunk], embedder: Embedder, atol: float = 1e-4) -> Tuple[bool, np.ndarray]:
+    # A fresh encode: the embedder's store holds the very vectors being checked
+    fresh = Embedder(embedder.model_name, embedder.normalize, use_cache=False, backend=embedder.backend)
+    X_full = embed_in_batches(fresh, [c.text for c in chunks])
+    if X_full.shape != X.shape:
+        return False, X_full
+    max_diff = float(np.max(np.abs(X_full - X))) if X.size else 0.0
+    print(f"Verify: max |incremental - full| = {max_diff:.2e}")
+    return max_diff <= atol, X_full
+
+
+def build_directory(
+    chunks: List[Chunk],
+    out_dir: Path,
+    embedder: Embedder,
+    incremental: bool = False,
+    verify: bool = False,
+    with_quality: bool = True,
+    previous_dir: Optional[Path] = None,
+) -> dict:
+    """
+    Embed (or reuse from previous_dir), build, recall-check and write one complete
+    index directory; returns its manifest.
+    """
+    texts = [c.text for c in chunks]
+
+    build = {"mode": "full", "embedded": len(chunks)}
+    previous = load_previous_build(previous_dir) if incremental and previous_dir is not None else None
+    if previous is not None:
+        old_index, old_vectors, old_meta, _ = previous
+        reuse, counts = plan_incremental(old_meta, chunks)
+        print("Incremental: " + ", ".join(f"{k}={v}" for k, v in counts.items()))
+        with span("index.embed", n=counts["changed"] + counts["added"], mode="incremental"):
+            X = incremental_vectors(old_index, old_vectors, reuse, chunks, embedder)
+        build = {"mode": "incremental", "embedded": counts["changed"] + counts["added"], **counts}
+
+        if verify:
+            ok, X_full = verify_against_full(X, chunks, embedder)
+            if not ok:
+                print("Verify failed: incremental vectors differ from a full rebuild; publishing the full rebuild.")
+                X = X_full
+                build = {"mode": "full", "embedded": len(chunks), "verify_fallback": True}
+            else:
+                build["verified"] = True
+    else:
+        with span("index.embed", n=len(texts), mode="full"):
+            X = embed_in_batches(embedder, texts)
 
     d = X.shape[1]
-    index = faiss.IndexFlatIP(d)  # cosine if normalized (we normalized)
-    index.add(X)
+    with span("index.build", n=len(chunks), index_type=SETTINGS.index_type, codec=effective_codec()):
+        index = build_index(X)
 
-    SETTINGS.index_dir.mkdir(parents=True, exist_ok=True)
-    faiss_path = SETTINGS.index_dir / "faiss.index"
-    meta_path = SETTINGS.index_dir / "meta.jsonl"
+    served = as_served(index, X)
 
-    faiss.write_index(index, str(faiss_path))
-    write_jsonl(meta_path, (c.model_dump() for c in chunks))
+    recall = {"k": min(SETTINGS.recall_k, len(chunks)), "value": 1.0, "exact": True}
+    if not exact_build():
+        with span("index.recall"):
+            Q, source = recall_queries(embedder, X, SETTINGS.recall_n_queries)
+            value = measure_recall(served, X, Q, SETTINGS.recall_k)
+            filtered = measure_filtered_recall(with_exact_filter(served, X), X, FilterBitmaps.from_chunks(chunks),
+                                               chunks, Q, SETTINGS.recall_k)
+        recall = {"k": min(SETTINGS.recall_k, len(chunks)), "value": round(value, 4), "filtered": round(filtered, 4),
+                  "exact": False, "n_queries": len(Q), "queries": source, "floor": SETTINGS.recall_floor}
+        print(f"recall@{recall['k']} vs exact search: {value:.4f}, with doc / section filters {filtered:.4f} "
+              f"({source} queries)")
+        if min(value, filtered) < SETTINGS.recall_floor:
+            raise SystemExit(
+                f"Refusing to publish: recall@{recall['k']} {value:.4f} (filtered {filtered:.4f}) "
+                f"< recall_floor {SETTINGS.recall_floor}. "
+                f"Raise hnsw_ef_search / ivf_nprobe / rescore_factor or pick another index_type / vector_codec."
+            )
+
+    memory = memory_footprint(index, len(chunks), d)
+    with span("index.quality"):
+        quality = quality_vs_exact(served, X, chunks, embedder) if with_quality else None
+    print(f"index size: {memory['index_bytes'] / 1e6:.2f} MB ({memory['ratio_vs_fp32']:.2%} of fp32)")
+    if quality:
+        print("quality vs exact fp32: " + ", ".join(f"{m} {v:+.4f}" for m, v in quality["delta"].items()))
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    faiss_path = out_dir / "faiss.index"
+    meta_path = out_dir / "meta.jsonl"
+    filters_path = out_dir / "filters.npz"
+    lexical_path = out_dir / "lexical.npz"
+    coarse_path = out_dir / "coarse.npz"
+
+    with span("index.write"):
+        faiss.write_index(index, str(faiss_path))
+        np.save(out_dir / "vectors.npy", X)
+        write_jsonl(meta_path, (c.model_dump() for c in chunks))
+        write_chunk_meta(out_dir / "meta", chunks)
+        FilterBitmaps.from_chunks(chunks).save(filters_path)
+        LexicalIndex.build(texts).save(lexical_path)
+        save_coarse(coarse_path, build_coarse(X, chunks))
 
     manifest = {
         "n_chunks": len(chunks),
         "dim": d,
         "embedding_model": SETTINGS.embedding_model_name,
+        "embedding_backend": SETTINGS.embedding_backend,
         "faiss_index": str(faiss_path),
+        "index_type": SETTINGS.index_type,
+        "index_factory": factory_string(d, len(chunks)),
+        "vector_codec": effective_codec(),
+        "rescore_factor": SETTINGS.rescore_factor if served is not index else 0,
+        "recall": recall,
+        "memory": memory,
+        "quality": quality,
+        "vectors": str(out_dir / "vectors.npy"),
         "meta": str(meta_path),
+        "meta_columnar": str(out_dir / "meta"),
+        "filters": str(filters_path),
+        "lexical": str(lexical_path),
+        "coarse": str(coarse_path),
+        "build": build,
     }
-    (SETTINGS.index_dir / "manifest.json").write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    (out_dir / "manifest.json").write_text(json.dumps(manifest, indent=2), encoding="utf-8")
 
-    print(f"Index built: {faiss_path}")
+    print(f"Index built: {faiss_path} ({build['mode']}, embedded {build['embedded']}/{len(chunks)})")
     print(f"Meta saved : {meta_path}")
+    return manifest
+
+
+# -------------------------
+# Sharded builds
+# -------------------------
+
+def write_sharded_root(index_dir: Path, names: List[str], embedder: Embedder) -> dict:
+    """
+    Global meta / filters / BM25 and the shard table for index_dir, from the shard
+    directories as they are on disk. No shard is re-embedded or rebuilt here.
+    """
+    from app.shards import load_sharded, shard_dir
+    from app.versions import read_manifest
+
+    shards: List[Dict] = []
+    chunks: List[Chunk] = []
+    for name in names:
+        d = shard_dir(index_dir, name)
+        m = read_manifest(d)
+        shards.append({
+            "name": name,
+            "offset": len(chunks),
+            "n_chunks": m["n_chunks"],
+            "dir": str(d),
+            "index_type": m["index_type"],
+            "vector_codec": m["vector_codec"],
+            "recall": m["recall"]["value"],
+            "index_bytes": m["memory"]["index_bytes"],
+            "build": m["build"],
+        })
+        chunks.extend(Chunk(**row) for row in read_jsonl(d / "meta.jsonl"))
+    models = {read_manifest(shard_dir(index_dir, n)).get("embedding_model") for n in names}
+    if len(models) > 1:
+        raise SystemExit(f"Shards were embedded with different models {sorted(models)}; rebuild all shards.")
+
+    manifest = {"shards": shards}
+    sharded = load_sharded(index_dir, manifest)
+    X = np.vstack([np.load(shard_dir(index_dir, n) / "vectors.npy", mmap_mode="r") for n in names]).astype("float32")
+    quality = quality_vs_exact(sharded, X, chunks, embedder)
+    if quality:
+        print("quality vs exact fp32 (all shards): " + ", ".join(f"{m} {v:+.4f}" for m, v in quality["delta"].items()))
+
+    meta_path = index_dir / "meta.jsonl"
+    filters_path = index_dir / "filters.npz"
+    lexical_path = index_dir / "lexical.npz"
+    write_jsonl(meta_path, (c.model_dump() for c in chunks))
+    write_chunk_meta(index_dir / "meta", chunks)
+    FilterBitmaps.from_chunks(chunks).save(filters_path)
+    LexicalIndex.build([c.text for c in chunks]).save(lexical_path)
+
+    manifest.update({
+        "n_chunks": len(chunks),
+        "dim": int(X.shape[1]),
+        "embedding_model": models.pop(),
+        "embedding_backend": SETTINGS.embedding_backend,
+        "shard_by": SETTINGS.shard_by,
+        "n_shards": len(shards),
+        "index_type": ",".join(sorted({s["index_type"] for s in shards})),
+        "vector_codec": ",".join(sorted({s["vector_codec"] for s in shards})),
+        "quality": quality,
+        "meta": str(meta_path),
+        "meta_columnar": str(index_dir / "meta"),
+        "filters": str(filters_path),
+        "lexical": str(lexical_path),
+    })
+    (index_dir / "manifest.json").write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    print(f"Sharded index: {len(shards)} shards, {len(chunks)} chunks → {index_dir}")
+    return manifest
+
+
+def build_sharded(
+    chunks: List[Chunk],
+    embedder: Embedder,
+    out_dir: Path,
+    previous_dir: Optional[Path],
+    only: Optional[str],
+    incremental: bool,
+    verify: bool,
+) -> None:
+    from app.shards import partition, shard_dir
+    from app.versions import read_manifest
+    from app.versions import link_tree
+
+    parts = partition(chunks)
+    names = list(parts)
+    if only is not None:
+        previous = read_manifest(previous_dir) if previous_dir is not None else {}
+        if previous.get("shard_by") != SETTINGS.shard_by:
+            raise SystemExit(f"The current build is not shard_by={SETTINGS.shard_by!r}; run a full build first.")
+        if only not in parts:
+            raise SystemExit(f"No chunks map to shard {only!r} (shards: {', '.join(parts)})")
+        built = {s["name"] for s in previous["shards"]}
+        new = sorted(set(parts) - built - {only})
+        if new:
+            print(f"Shards not in the current build are built too: {', '.join(new)}")
+        rebuild = {only, *new}
+        names = sorted(built | rebuild)
+
+    for name in names:
+        if only is not None and name not in rebuild:
+            # untouched shard: the new version shares the published files
+            link_tree(shard_dir(previous_dir, name), shard_dir(out_dir, name))
+            continue
+        print(f"--- shard {name}: {len(parts[name])} chunks")
+        previous_shard = shard_dir(previous_dir, name) if previous_dir is not None else None
+        build_directory(parts[name], shard_dir(out_dir, name), embedder, incremental, verify,
+                        with_quality=False, previous_dir=previous_shard)
+
+    write_sharded_root(out_dir, names, embedder)
+
+
+def main():
+    from app.versions import current_version, new_version_dir, prune, publish, remove_legacy_layout, resolve
+
+    ap = argparse.ArgumentParser(description="Build the FAISS index from chunks.jsonl and publish it as a new version")
+    ap.add_argument("--incremental", action="store_true",
+                    help="Only embed chunks that were added or changed since the last build")
+    ap.add_argument("--verify", action="store_true",
+                    help="With --incremental: also do a full rebuild and fall back to it if vectors disagree")
+    ap.add_argument("--shard", default=None,
+                    help="With shard_by set: rebuild only this shard (e.g. sop-tc) plus any shard new since the "
+                         "published build; the others are reused as published")
+    args = ap.parse_args()
+
+    if SETTINGS.shard_by == "none" and args.shard:
+        raise SystemExit("--shard needs a sharded build (set shard_by = family | hash)")
+
+    chunks_path = SETTINGS.processed_dir / "chunks.jsonl"
+    chunks = [Chunk(**row) for row in read_jsonl(chunks_path)]
+
+    embedder = Embedder(SETTINGS.embedding_model_name)
+
+    root = SETTINGS.index_dir
+    parent = current_version(root)
+    previous_dir = resolve(root) if (resolve(root) / "manifest.json").exists() else None
+    out_dir = new_version_dir(root)
+    try:
+        with span("index", n=len(chunks), shard_by=SETTINGS.shard_by, incremental=args.incremental, version=out_dir.name):
+            if SETTINGS.shard_by != "none":
+                build_sharded(chunks, embedder, out_dir, previous_dir, args.shard, args.incremental, args.verify)
+            else:
+                build_directory(chunks, out_dir, embedder, args.incremental, args.verify, previous_dir=previous_dir)
+    except BaseException:
+        shutil.rmtree(out_dir, ignore_errors=True)  # never leave a half-written version behind
+        raise
+
+    publish(root, out_dir, parent)
+    if parent is None and previous_dir == root:
+        remove_legacy_layout(root)
+    removed = prune(root)
+    if removed:
+        print(f"Pruned old versions: {', '.join(removed)}")
 
 
 if __name__ == "__main__":
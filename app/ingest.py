@@ -1,7 +1,9 @@
+import itertools
 from pathlib import Path
-from typing import List
+from typing import Iterator, List, Optional
 from app.models import Document
 from app.config import SETTINGS
+from app.tracing import span
 from app.utils import get_git_sha, write_jsonl
 
 
@@ -22,28 +24,52 @@ def infer_title(lines: List[str], fallback: str) -> str:
     return fallback
 
 
+def load_document(p: Path, sha: Optional[str]) -> Document:
+    lines = p.read_text(encoding="utf-8").splitlines()
+    doc_id = infer_doc_id(p.name)
+    title = infer_title(lines, fallback=p.stem)
+    return Document(
+        doc_id=doc_id,
+        title=title,
+        source_path=str(p),
+        version=sha,
+        lines=lines
+    )
+
+
 def load_documents() -> List[Document]:
     sha = get_git_sha()
-    docs: List[Document] = []
-    for p in sorted(SETTINGS.sops_dir.glob("*.md")):
-        lines = p.read_text(encoding="utf-8").splitlines()
-        doc_id = infer_doc_id(p.name)
-        title = infer_title(lines, fallback=p.stem)
-        docs.append(Document(
-            doc_id=doc_id,
-            title=title,
-            source_path=str(p),
-            version=sha,
-            lines=lines
-        ))
-    return docs
+    return [load_document(p, sha) for p in sorted(SETTINGS.sops_dir.glob("*.md"))]
+
+
+def load_protocols(paths: List[Path], workers: int) -> Iterator[Document]:
+    """protocols.io exports, streamed item by item (see app/protocols_io.py)."""
+    from app.protocols_io import iter_documents
+    for row in iter_documents(paths, workers=workers):
+        yield Document(**row)
 
 
 def main():
-    docs = load_documents()
+    import argparse
+    ap = argparse.ArgumentParser(description="Collect SOP markdown (and protocols.io exports) into docs.jsonl")
+    ap.add_argument("--protocols", type=Path, nargs="*", default=[],
+                    help="protocols.io API export(s) to import, e.g. protocols.json")
+    ap.add_argument("--workers", type=int, default=0,
+                    help="Processes converting protocols (0 = all CPUs, 1 = inline)")
+    args = ap.parse_args()
+
+    docs = itertools.chain(load_documents(), load_protocols(args.protocols, args.workers))
     out = SETTINGS.processed_dir / "docs.jsonl"
-    write_jsonl(out, (d.model_dump() for d in docs))
-    print(f"Wrote {len(docs)} docs → {out}")
+    with span("ingest", protocols=len(args.protocols)) as attrs:
+        attrs["docs"] = 0
+
+        def rows():
+            for d in docs:
+                attrs["docs"] += 1
+                yield d.model_dump()
+
+        write_jsonl(out, rows())
+    print(f"Wrote {attrs['docs']} docs → {out}")
 
 
 if __name__ == "__main__":
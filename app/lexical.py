@@ -0,0 +1,221 @@
+"""
+app/lexical.py
+
+BM25 inverted index over Chunk.text, built next to the FAISS index
+(lexical.npz), and the lexical fast path used by retrieval_mode="hybrid".
+
+Postings are CSR arrays: the rows of term t are indptr[t]:indptr[t + 1] in
+`postings` (int32 chunk row, ascending) and `impacts` (float32, the term's
+precomputed BM25 contribution to that chunk). A query sums a few slices into
+a dense score vector; no per-document dicts, no pickling.
+
+Tokens keep the things people type verbatim: "1x10^4", "70%", "0.25",
+"cells/ml", "sop-tc-002", catalogue numbers like "a1234-01".
+"""
+
+import re
+import threading
+from collections import Counter, deque
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.config import SETTINGS
+
+
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-_/.,^][a-z0-9]+)*%?")
+
+# Ignored when deciding whether a query is lexical enough for the fast path (still indexed and scored).
+STOPWORDS = frozenset(
+    "a an and are as at be before by can do does for from how i if in into is it of on or should "
+    "the their then there these this to was what when where which who why will with you your".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(text.casefold())
+
+
+class LexicalIndex:
+    def __init__(self, terms: List[str], indptr: np.ndarray, postings: np.ndarray, impacts: np.ndarray,
+                 idf: np.ndarray, n: int):
+        self.terms = terms
+        self.indptr = indptr      # (n_terms + 1,) int64
+        self.postings = postings  # (nnz,) int32 chunk rows, ascending within a term
+        self.impacts = impacts    # (nnz,) float32 BM25 contribution
+        self.idf = idf            # (n_terms,) float32
+        self.n = n
+        self._term_pos = {t: i for i, t in enumerate(terms)}
+        self._max_idf = float(idf.max()) if len(idf) else 1.0
+
+    @classmethod
+    def build(cls, texts: List[str], k1: Optional[float] = None, b: Optional[float] = None) -> "LexicalIndex":
+        k1 = SETTINGS.bm25_k1 if k1 is None else k1
+        b = SETTINGS.bm25_b if b is None else b
+        n = len(texts)
+
+        vocab: Dict[str, int] = {}
+        term_col: List[int] = []
+        doc_col: List[int] = []
+        tf_col: List[int] = []
+        doc_len = np.zeros(n, dtype="float32")
+        for i, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_len[i] = len(tokens)
+            for t, c in Counter(tokens).items():
+                term_col.append(vocab.setdefault(t, len(vocab)))
+                doc_col.append(i)
+                tf_col.append(c)
+
+        term_ids = np.array(term_col, dtype="int64")
+        docs = np.array(doc_col, dtype="int32")
+        tf = np.array(tf_col, dtype="float32")
+        order = np.lexsort((docs, term_ids))
+        term_ids, docs, tf = term_ids[order], docs[order], tf[order]
+
+        counts = np.bincount(term_ids, minlength=len(vocab))
+        indptr = np.zeros(len(vocab) + 1, dtype="int64")
+        np.cumsum(counts, out=indptr[1:])
+        df = counts.astype("float32")
+
+        idf = np.log1p((n - df + 0.5) / (df + 0.5)).astype("float32")
+        avgdl = float(doc_len.mean()) if n else 1.0
+        norm = k1 * (1 - b + b * doc_len[docs] / max(avgdl, 1e-9))
+        impacts = (idf[term_ids] * tf * (k1 + 1) / (tf + norm)).astype("float32")
+        return cls(list(vocab), indptr, docs, impacts, idf, n)
+
+    # -------------------------
+    # Persistence
+    # -------------------------
+
+    def save(self, path: Path) -> None:
+        np.savez(
+            path,
+            n=np.array(self.n),
+            terms=np.array(self.terms, dtype=str),
+            indptr=self.indptr,
+            postings=self.postings,
+            impacts=self.impacts,
+            idf=self.idf,
+        )
+
+    @classmethod
+    def load(cls, path: Path) -> "LexicalIndex":
+        with np.load(path) as z:
+            return cls(z["terms"].tolist(), z["indptr"], z["postings"], z["impacts"], z["idf"], int(z["n"]))
+
+    # -------------------------
+    # Queries
+    # -------------------------
+
+    def query_terms(self, query: str) -> List[str]:
+        return list(dict.fromkeys(tokenize(query)))
+
+    def scores(self, terms: List[str]) -> np.ndarray:
+        acc = np.zeros(self.n, dtype="float32")
+        for t in terms:
+            pos = self._term_pos.get(t)
+            if pos is not None:
+                lo, hi = self.indptr[pos], self.indptr[pos + 1]
+                acc[self.postings[lo:hi]] += self.impacts[lo:hi]  # rows are unique within a term
+        return acc
+
+    def search(self, query: str, k: int, bits: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+        """Top-k (scores, rows) by BM25 among rows set in the packed bitmap `bits`, plus the query terms."""
+        terms = self.query_terms(query)
+        acc = self.scores(terms)
+        if bits is not None:
+            acc *= np.unpackbits(bits, count=self.n, bitorder="little")
+        cand = np.flatnonzero(acc > 0)
+        if len(cand) > k:
+            cand = cand[np.argpartition(-acc[cand], k - 1)[:k]]
+        cand = cand[np.argsort(-acc[cand], kind="stable")]
+        return acc[cand], cand.astype("int64"), terms
+
+    def contains(self, term: str, row: int) -> bool:
+        pos = self._term_pos.get(term)
+        if pos is None:
+            return False
+        rows = self.postings[self.indptr[pos]:self.indptr[pos + 1]]
+        j = int(np.searchsorted(rows, row))
+        return j < len(rows) and rows[j] == row
+
+    def confident(self, terms: List[str], scores: np.ndarray, rows: np.ndarray) -> bool:
+        """
+        Fast-path rule: a short keyword-like query whose content terms the top chunk
+        (nearly) all contains, clearly ahead of the runner-up.
+        """
+        content = [t for t in terms if t not in STOPWORDS]
+        if not content or len(content) > SETTINGS.lexical_fast_max_terms or not len(rows):
+            return False
+        weights = [float(self.idf[self._term_pos[t]]) if t in self._term_pos else self._max_idf for t in content]
+        covered = sum(w for t, w in zip(content, weights) if self.contains(t, int(rows[0])))
+        if covered < SETTINGS.lexical_fast_coverage * sum(weights) - 1e-6:
+            return False
+        runner_up = float(scores[1]) if len(scores) > 1 else 0.0
+        return (float(scores[0]) - runner_up) / float(scores[0]) >= SETTINGS.lexical_fast_margin
+
+
+def rrf_fuse(rankings: List[np.ndarray], k: int, rrf_k: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Reciprocal rank fusion of several row rankings (best first; -1 entries ignored)."""
+    rrf_k = SETTINGS.rrf_k if rrf_k is None else rrf_k
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for r, row in enumerate(ranking.tolist()):
+            if row >= 0:
+                fused[row] = fused.get(row, 0.0) + 1.0 / (rrf_k + r + 1)
+    best = sorted(fused.items(), key=lambda kv: -kv[1])[:k]
+    return (np.array([s for _, s in best], dtype="float32"),
+            np.array([row for row, _ in best], dtype="int64"))
+
+
+def load_lexical(index_dir: Path) -> Optional[LexicalIndex]:
+    path = Path(index_dir) / "lexical.npz"
+    return LexicalIndex.load(path) if path.exists() else None
+
+
+# -------------------------
+# Fast-path stats
+# -------------------------
+
+class HybridStats:
+    """How often the lexical fast path answers, and per-path latency (last 1000 queries each)."""
+
+    def __init__(self, window: int = 1000):
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.fast_path = 0
+        self._fast_ms: deque = deque(maxlen=window)
+        self._fused_ms: deque = deque(maxlen=window)
+
+    def record(self, fast: bool, ms: float) -> None:
+        with self._lock:
+            self.queries += 1
+            if fast:
+                self.fast_path += 1
+                self._fast_ms.append(ms)
+            else:
+                self._fused_ms.append(ms)
+
+    @staticmethod
+    def _pct(xs: List[float]) -> Dict[str, Optional[float]]:
+        if not xs:
+            return {"p50_ms": None, "p95_ms": None}
+        p50, p95 = np.percentile(xs, [50, 95])
+        return {"p50_ms": round(float(p50), 3), "p95_ms": round(float(p95), 3)}
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            fast, fused = list(self._fast_ms), list(self._fused_ms)
+            queries, fast_path = self.queries, self.fast_path
+        return {
+            "queries": queries,
+            "fast_path": fast_path,
+            "fast_path_rate": round(fast_path / queries, 4) if queries else None,
+            "fast_path_latency": self._pct(fast),
+            "fused_latency": self._pct(fused),
+        }
+
+
+HYBRID_STATS = HybridStats()
@@ -0,0 +1,186 @@
+"""
+app/meta_store.py
+
+Columnar, memory-mapped chunk metadata (written next to meta.jsonl at index
+time) so consumers don't parse every row into a pydantic model at startup.
+
+Layout of <index_dir>/meta/:
+  columns.json             {"n": ..., "columns": {name: kind}, "vocab": {name: [...]}}
+  <name>.npy               "int"      int32, INT_NULL for None   (line/step columns)
+                           "fixed"    fixed-width bytes           (chunk_id)
+                           "category" int32 codes into vocab, -1 for None
+  <name>.bin + .off.npy    "text"     utf-8 blob + int64 offsets (n + 1)
+                           "json"     same, one JSON document per row
+
+Every array is opened with mmap, so startup cost and resident memory don't
+grow with the number of chunks; rows (and Chunk objects) are materialized
+only for the hits a query returns.
+"""
+
+import json
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.models import Chunk
+from app.utils import read_jsonl
+
+
+INT_NULL = np.iinfo(np.int32).min
+
+CHUNK_SCHEMA: Dict[str, str] = {
+    "chunk_id": "fixed",
+    "doc_id": "category",
+    "doc_title": "category",
+    "source_path": "category",
+    "version": "category",
+    "section": "category",
+    "subsection": "category",
+    "line_start": "int",
+    "line_end": "int",
+    "step_start": "int",
+    "step_end": "int",
+    "text": "text",
+    "tags": "json",
+}
+
+
+# -------------------------
+# Writing
+# -------------------------
+
+def _write_blob(out_dir: Path, name: str, values: List[bytes]) -> None:
+    offsets = np.zeros(len(values) + 1, dtype="int64")
+    np.cumsum([len(v) for v in values], out=offsets[1:])
+    with (out_dir / f"{name}.bin").open("wb") as f:
+        for v in values:
+            f.write(v)
+    np.save(out_dir / f"{name}.off.npy", offsets)
+
+
+def write_columnar(out_dir: Path, rows: Iterable[Dict[str, Any]], schema: Dict[str, str]) -> int:
+    out_dir.mkdir(parents=True, exist_ok=True)
+    cols: Dict[str, List[Any]] = {name: [] for name in schema}
+    n = 0
+    for r in rows:
+        for name in schema:
+            cols[name].append(r.get(name))
+        n += 1
+
+    vocab: Dict[str, List[str]] = {}
+    for name, kind in schema.items():
+        values = cols[name]
+        if kind == "int":
+            arr = np.array([INT_NULL if v is None else int(v) for v in values], dtype="int32")
+            np.save(out_dir / f"{name}.npy", arr)
+        elif kind == "fixed":
+            encoded = [(v or "").encode("utf-8") for v in values]
+            width = max((len(v) for v in encoded), default=1) or 1
+            np.save(out_dir / f"{name}.npy", np.array(encoded, dtype=f"S{width}"))
+        elif kind == "category":
+            pos: Dict[str, int] = {}
+            codes = np.array([-1 if v is None else pos.setdefault(v, len(pos)) for v in values], dtype="int32")
+            vocab[name] = list(pos)
+            np.save(out_dir / f"{name}.npy", codes)
+        elif kind == "text":
+            _write_blob(out_dir, name, [(v or "").encode("utf-8") for v in values])
+        elif kind == "json":
+            _write_blob(out_dir, name, [json.dumps(v, ensure_ascii=False).encode("utf-8") for v in values])
+        else:
+            raise ValueError(f"Unknown column kind {kind!r} for {name}")
+
+    # columns.json last: its presence marks a complete store
+    (out_dir / "columns.json").write_text(
+        json.dumps({"n": n, "columns": schema, "vocab": vocab}, ensure_ascii=False), encoding="utf-8"
+    )
+    return n
+
+
+# -------------------------
+# Reading
+# -------------------------
+
+class ColumnarStore(Sequence):
+    """Read-only, mmap-backed rows; store[i] returns a plain dict."""
+
+    def __init__(self, store_dir: Path):
+        self.dir = Path(store_dir)
+        info = json.loads((self.dir / "columns.json").read_text(encoding="utf-8"))
+        self.n: int = info["n"]
+        self.schema: Dict[str, str] = info["columns"]
+        self.vocab: Dict[str, List[str]] = info["vocab"]
+
+        self._arrays: Dict[str, np.ndarray] = {}
+        self._blobs: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        for name, kind in self.schema.items():
+            if kind in ("text", "json"):
+                offsets = np.load(self.dir / f"{name}.off.npy", mmap_mode="r")
+                blob_path = self.dir / f"{name}.bin"
+                blob = np.memmap(blob_path, dtype=np.uint8, mode="r") if blob_path.stat().st_size else np.zeros(0, np.uint8)
+                self._blobs[name] = (offsets, blob)
+            else:
+                self._arrays[name] = np.load(self.dir / f"{name}.npy", mmap_mode="r")
+
+    @classmethod
+    def exists(cls, store_dir: Path) -> bool:
+        return (Path(store_dir) / "columns.json").exists()
+
+    def __len__(self) -> int:
+        return self.n
+
+    def value(self, i: int, name: str) -> Any:
+        kind = self.schema[name]
+        if kind in ("text", "json"):
+            offsets, blob = self._blobs[name]
+            raw = blob[int(offsets[i]):int(offsets[i + 1])].tobytes().decode("utf-8")
+            return json.loads(raw) if kind == "json" else raw
+        v = self._arrays[name][i]
+        if kind == "int":
+            return None if v == INT_NULL else int(v)
+        if kind == "fixed":
+            return v.decode("utf-8")
+        return None if v < 0 else self.vocab[name][int(v)]
+
+    def row(self, i: int) -> Dict[str, Any]:
+        if i < 0:
+            i += self.n
+        if not 0 <= i < self.n:
+            raise IndexError(i)
+        return {name: self.value(i, name) for name in self.schema}
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self.n))]
+        return self.row(int(i))
+
+    def __iter__(self) -> Iterator[Any]:
+        for i in range(self.n):
+            yield self[i]
+
+    def codes(self, name: str) -> Tuple[np.ndarray, List[str]]:
+        """(codes, vocab) of a category column, without decoding any rows."""
+        return self._arrays[name], self.vocab[name]
+
+
+class ChunkMeta(ColumnarStore):
+    """ColumnarStore whose rows are Chunk models, built lazily per access."""
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self.n))]
+        return Chunk(**self.row(int(i)))
+
+
+def write_chunk_meta(out_dir: Path, chunks: Iterable[Chunk]) -> int:
+    return write_columnar(out_dir, (c.model_dump() for c in chunks), CHUNK_SCHEMA)
+
+
+def load_meta(index_dir: Path, expected_n: Optional[int] = None) -> Sequence[Chunk]:
+    """Columnar meta if the index has it (and it matches), else meta.jsonl parsed into Chunks."""
+    store_dir = Path(index_dir) / "meta"
+    if ColumnarStore.exists(store_dir):
+        meta = ChunkMeta(store_dir)
+        if expected_n is None or len(meta) == expected_n:
+            return meta
+    return [Chunk(**row) for row in read_jsonl(Path(index_dir) / "meta.jsonl")]
@@ -0,0 +1,251 @@
+"""
+app/onnx_backend.py
+
+ONNX Runtime backends for Embedder (SETTINGS.embedding_backend = "onnx" or
+"onnx_int8"), and the tool that exports and verifies them:
+
+  python -m app.onnx_backend                 # export, int8-quantize, verify against torch
+  python -m app.onnx_backend --skip-export   # verify an existing export
+
+Layout of <SETTINGS.onnx_dir>/<model-slug>/:
+  model.onnx        transformer body exported from sentence-transformers (fp32)
+  model.int8.onnx   same, dynamically quantized (int8 weights)
+  tokenizer.json    fast tokenizer, read with `tokenizers` (no torch at query time)
+  export.json       model name, pooling mode, max_length, pad token
+  verify.json       last verification report (cosine agreement + encode latency)
+
+Pooling and normalization run in numpy, so one export serves both
+normalize=True and normalize=False embedders.
+
+onnxruntime and tokenizers are optional dependencies, imported only when an
+ONNX backend is used; exporting additionally needs torch and onnx.
+"""
+
+import json
+import re
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from app.config import SETTINGS
+
+
+BACKENDS = ("torch", "onnx", "onnx_int8")
+
+
+def model_dir(model_name: str) -> Path:
+    slug = re.sub(r"[^a-zA-Z0-9]+", "-", model_name).strip("-").lower()
+    return SETTINGS.onnx_dir / slug
+
+
+def _require(module: str, what: str):
+    import importlib
+    try:
+        return importlib.import_module(module)
+    except ImportError:
+        raise ImportError(
+            f"{what} needs the optional package {module!r} (pip install onnxruntime tokenizers onnx), "
+            f"or set embedding_backend='torch'."
+        ) from None
+
+
+class OnnxEncoder:
+    def __init__(self, model_name: str, quantized: bool = False, threads: int = 0):
+        ort = _require("onnxruntime", "embedding_backend='onnx'")
+        tokenizers = _require("tokenizers", "embedding_backend='onnx'")
+
+        d = model_dir(model_name)
+        path = d / ("model.int8.onnx" if quantized else "model.onnx")
+        if not path.exists() or not (d / "export.json").exists():
+            raise FileNotFoundError(f"No ONNX export at {path}. Run: python -m app.onnx_backend --model {model_name}")
+        info = json.loads((d / "export.json").read_text(encoding="utf-8"))
+        self.pooling: str = info["pooling"]
+
+        self.tokenizer = tokenizers.Tokenizer.from_file(str(d / "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=info["max_length"])
+        self.tokenizer.enable_padding(pad_id=info["pad_id"], pad_token=info["pad_token"])
+
+        opts = ort.SessionOptions()
+        if threads > 0:
+            opts.intra_op_num_threads = threads
+            opts.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(str(path), sess_options=opts, providers=["CPUExecutionProvider"])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+    def encode(self, texts: List[str], normalize: bool = True, batch_size: int = 64) -> np.ndarray:
+        out = []
+        for i in range(0, len(texts), batch_size):
+            encs = self.tokenizer.encode_batch(texts[i:i + batch_size])
+            feeds = {
+                "input_ids": np.array([e.ids for e in encs], dtype="int64"),
+                "attention_mask": np.array([e.attention_mask for e in encs], dtype="int64"),
+                "token_type_ids": np.array([e.type_ids for e in encs], dtype="int64"),
+            }
+            hidden = self.session.run(None, {k: v for k, v in feeds.items() if k in self.input_names})[0]
+
+            if self.pooling == "cls":
+                emb = hidden[:, 0]
+            else:  # mean over real tokens, as sentence-transformers' Pooling does
+                mask = feeds["attention_mask"][:, :, None].astype("float32")
+                emb = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            out.append(emb.astype("float32"))
+
+        X = np.vstack(out) if out else np.zeros((0, 0), dtype="float32")
+        if normalize and len(X):
+            X /= np.clip(np.linalg.norm(X, axis=1, keepdims=True), 1e-12, None)
+        return X
+
+
+# -------------------------
+# Export
+# -------------------------
+
+def export_model(model_name: str) -> Path:
+    torch = _require("torch", "ONNX export")
+    _require("onnx", "ONNX export")
+    from sentence_transformers import SentenceTransformer
+
+    st_model = SentenceTransformer(model_name, device="cpu")
+    modules = list(st_model)
+    pooling = modules[1] if len(modules) > 1 else None
+    extra = [type(m).__name__ for m in modules[2:] if type(m).__name__ != "Normalize"]
+    if pooling is None or extra:
+        raise SystemExit(f"Unsupported sentence-transformers pipeline for ONNX export: {[type(m).__name__ for m in modules]}")
+    if getattr(pooling, "pooling_mode_cls_token", False):
+        pooling_mode = "cls"
+    elif getattr(pooling, "pooling_mode_mean_tokens", False):
+        pooling_mode = "mean"
+    else:
+        raise SystemExit("Only mean and CLS pooling are supported for ONNX export")
+
+    out = model_dir(model_name)
+    out.mkdir(parents=True, exist_ok=True)
+    hf_tokenizer = st_model.tokenizer
+    hf_tokenizer.save_pretrained(str(out))  # writes tokenizer.json for fast tokenizers
+
+    transformer = modules[0].auto_model.eval()
+    sample = hf_tokenizer(["export sample", "a second, longer export sample"], return_tensors="pt", padding=True)
+    names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in sample]
+    axes = {n: {0: "batch", 1: "seq"} for n in names + ["last_hidden_state"]}
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer, tuple(sample[n] for n in names), str(out / "model.onnx"),
+            input_names=names, output_names=["last_hidden_state"], dynamic_axes=axes, opset_version=17,
+        )
+
+    (out / "export.json").write_text(json.dumps({
+        "model": model_name,
+        "pooling": pooling_mode,
+        "max_length": int(st_model.max_seq_length),
+        "pad_id": int(hf_tokenizer.pad_token_id),
+        "pad_token": hf_tokenizer.pad_token,
+    }, indent=2), encoding="utf-8")
+    return out / "model.onnx"
+
+
+def quantize_model(model_name: str) -> Path:
+    _require("onnxruntime", "int8 quantization")
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    d = model_dir(model_name)
+    quantize_dynamic(str(d / "model.onnx"), str(d / "model.int8.onnx"), weight_type=QuantType.QInt8)
+    return d / "model.int8.onnx"
+
+
+# -------------------------
+# Verify
+# -------------------------
+
+def row_cosines(A: np.ndarray, B: np.ndarray) -> np.ndarray:
+    A = A / np.clip(np.linalg.norm(A, axis=1, keepdims=True), 1e-12, None)
+    B = B / np.clip(np.linalg.norm(B, axis=1, keepdims=True), 1e-12, None)
+    return (A * B).sum(axis=1)
+
+
+def encode_latency(embedder, queries: List[str], texts: List[str], bs: int = 64) -> Dict[str, float]:
+    """Single-query latency percentiles and batch throughput, caches bypassed."""
+    embedder.embed_texts(queries[:1])  # warm up (model load, session init)
+    single = []
+    for q in queries:
+        t0 = time.perf_counter()
+        embedder.embed_texts([q])
+        single.append((time.perf_counter() - t0) * 1000)
+    t0 = time.perf_counter()
+    for i in range(0, len(texts), bs):
+        embedder.embed_texts(texts[i:i + bs])
+    elapsed = time.perf_counter() - t0
+    qs = np.percentile(single, [50, 95])
+    return {
+        "query_p50_ms": round(float(qs[0]), 2),
+        "query_p95_ms": round(float(qs[1]), 2),
+        "batch_texts_per_s": round(len(texts) / elapsed, 1) if elapsed > 0 else None,
+    }
+
+
+def verify(model_name: str, texts: List[str], queries: List[str], tolerances: Dict[str, float]) -> Dict:
+    from app.embedder import Embedder
+
+    report: Dict[str, Dict] = {}
+    reference: Optional[np.ndarray] = None
+    for backend in BACKENDS:
+        embedder = Embedder(model_name, use_cache=False, backend=backend)
+        X = embedder.embed_texts(texts)
+        row = {"latency": encode_latency(embedder, queries, texts)}
+        if reference is None:
+            reference = X
+        else:
+            cos = row_cosines(reference, X)
+            row.update({
+                "cosine_min": round(float(cos.min()), 5),
+                "cosine_mean": round(float(cos.mean()), 5),
+                "tolerance": tolerances[backend],
+                "ok": bool(cos.min() >= tolerances[backend]),
+            })
+        report[backend] = row
+    return report
+
+
+def main():
+    import argparse
+    from app.models import Chunk
+    from app.utils import read_jsonl
+
+    ap = argparse.ArgumentParser(description="Export the embedding model to ONNX (+ int8) and verify it against torch")
+    ap.add_argument("--model", default=SETTINGS.embedding_model_name)
+    ap.add_argument("--skip-export", action="store_true", help="Verify the existing export only")
+    ap.add_argument("--tolerance", type=float, default=0.999, help="Min per-chunk cosine vs torch for onnx")
+    ap.add_argument("--int8-tolerance", type=float, default=0.98, help="Min per-chunk cosine vs torch for onnx_int8")
+    ap.add_argument("--sample", type=int, default=0, help="Verify on the first N chunks (0 = all)")
+    ap.add_argument("--n-queries", type=int, default=50, help="Single-query encodes timed per backend")
+    args = ap.parse_args()
+
+    if not args.skip_export:
+        print(f"Exported {export_model(args.model)}")
+        print(f"Quantized {quantize_model(args.model)}")
+
+    chunks = [Chunk(**row) for row in read_jsonl(SETTINGS.processed_dir / "chunks.jsonl")]
+    texts = [c.text for c in chunks][:args.sample or None]
+    queries = [ex["query"] for p in sorted(Path("eval").glob("*.jsonl")) for ex in read_jsonl(p)][:args.n_queries]
+    queries = queries or texts[:args.n_queries]
+
+    report = verify(args.model, texts, queries, {"onnx": args.tolerance, "onnx_int8": args.int8_tolerance})
+    out = model_dir(args.model) / "verify.json"
+    out.write_text(json.dumps({"model": args.model, "n_texts": len(texts), "threads": SETTINGS.embedding_threads,
+                               "backends": report}, indent=2), encoding="utf-8")
+
+    print(f"\n{'backend':<10} {'cos min':>8} {'cos mean':>9} {'q p50 ms':>9} {'q p95 ms':>9} {'texts/s':>9}")
+    for backend, row in report.items():
+        lat = row["latency"]
+        print(f"{backend:<10} {row.get('cosine_min', 1.0):>8.4f} {row.get('cosine_mean', 1.0):>9.4f} "
+              f"{lat['query_p50_ms']:>9.2f} {lat['query_p95_ms']:>9.2f} {lat['batch_texts_per_s'] or 0:>9.1f}")
+    print(f"Report: {out}")
+
+    failed = [b for b, row in report.items() if row.get("ok") is False]
+    if failed:
+        raise SystemExit(f"Cosine agreement below tolerance for: {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+"""
+app/protocols_io.py
+
+Streaming importer for protocols.io API exports (protocols.json and larger
+vendor dumps): {"items": [...], "pagination": ...} or a bare [...] of protocols.
+
+Items are decoded one at a time with json.JSONDecoder.raw_decode over a
+rolling read buffer, so memory stays bounded by the largest single protocol,
+not the file. An item that does not decode within SETTINGS.protocols_max_item_mb
+(a malformed or truncated entry) stops the import with its byte offset instead
+of pulling the rest of the export into the buffer. Conversion to Document runs in a bounded process pool
+(app.utils.bounded_imap) and keeps input order.
+
+Each protocol becomes markdown that app.chunker understands:
+
+  # <title>
+  ## Purpose            description
+  ## Scope              guidelines
+  ## Preparation        before_start
+  ## Safety             warning
+  ## Materials          materials_text (reagent entities rendered with vendor / SKU) + materials
+  ## Procedure          steps, "### <section>" when the step section changes,
+                        "N. text" per step with continuation lines indented
+  ## References         URL, DOI, authors
+
+Rich-text fields are Draft.js JSON ({"blocks": [...], "entityMap": {...}});
+HTML or plain strings are accepted too.
+"""
+
+import html
+import json
+import re
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from app.config import SETTINGS
+from app.utils import bounded_imap
+
+
+READ_SIZE = 1 << 20
+TAG_RE = re.compile(r"<[^>]+>")
+BLOCK_TAG_RE = re.compile(r"</?(p|div|br|li|ul|ol|h[1-6]|tr)\b[^>]*>", re.IGNORECASE)
+MD_HEADER_RE = re.compile(r"^\s*#{1,6}\s")      # would open a new section in app.chunker
+NUMBERED_RE = re.compile(r"^\s*\d+\s*[\).:-]\s")  # would be read as a new step (chunker.STEP_RE)
+
+
+# -------------------------
+# Streaming parse
+# -------------------------
+
+class _StreamDecoder:
+    """raw_decode over a file read in READ_SIZE pieces; the buffer only holds the value being decoded."""
+
+    def __init__(self, f, max_item_bytes: Optional[int] = None):
+        self.f = f
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+        self.max_item_bytes = max_item_bytes or SETTINGS.protocols_max_item_mb * 2**20
+        self.consumed_bytes = 0  # UTF-8 size of the text dropped from the front of buf
+
+    def _fill(self, size: int = READ_SIZE) -> bool:
+        if self.eof:
+            return False
+        data = self.f.read(size)
+        if not data:
+            self.eof = True
+            return False
+        self.consumed_bytes += len(self.buf[:self.pos].encode("utf-8"))
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def offset(self) -> int:
+        """Byte offset of the read position in the file."""
+        return self.consumed_bytes + len(self.buf[:self.pos].encode("utf-8"))
+
+    def peek(self) -> str:
+        """Next non-whitespace character ("" at end of file)."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, ch: str) -> None:
+        got = self.peek()
+        if got != ch:
+            raise ValueError(f"Malformed export: expected {ch!r}, found {got!r}")
+        self.pos += 1
+
+    def value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                obj, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError as e:
+                pending = len(self.buf) - self.pos
+                if pending >= self.max_item_bytes:
+                    raise ValueError(f"Malformed export: item at byte {self.offset()} does not decode within "
+                                     f"{self.max_item_bytes >> 20} MB (protocols_max_item_mb): {e.msg}") from None
+                # read as much again as is pending, so re-parsing from the item start stays linear overall
+                if self._fill(min(max(READ_SIZE, pending), self.max_item_bytes - pending)):
+                    continue
+                raise ValueError(f"Malformed export: item at byte {self.offset()} is truncated or invalid: {e.msg}") from None
+            # a number at the very end of the buffer may continue in the next read
+            if end == len(self.buf) and not self.eof and not isinstance(obj, (dict, list, str)):
+                if self._fill():
+                    continue
+            self.pos = end
+            return obj
+
+    def array_items(self) -> Iterator[Any]:
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            ch = self.peek()
+            self.pos += 1
+            if ch == "]":
+                return
+            if ch != ",":
+                raise ValueError(f"Malformed export: expected ',' or ']', found {ch!r}")
+
+
+def iter_items(path: Path) -> Iterator[Dict[str, Any]]:
+    """Protocols from an export, one at a time, without loading the whole file."""
+    with Path(path).open("r", encoding="utf-8") as f:
+        stream = _StreamDecoder(f)
+        first = stream.peek()
+        if first == "[":
+            yield from stream.array_items()
+            return
+
+        stream.expect("{")
+        while stream.peek() not in ("}", ""):
+            key = stream.value()
+            stream.expect(":")
+            if key == "items":
+                yield from stream.array_items()
+            else:
+                stream.value()  # pagination, status_code, ...: decoded and dropped
+            if stream.peek() == ",":
+                stream.pos += 1
+
+
+# -------------------------
+# Rich text → markdown lines
+# -------------------------
+
+def html_to_lines(text: str) -> List[str]:
+    text = BLOCK_TAG_RE.sub("\n", text)
+    text = html.unescape(TAG_RE.sub("", text))
+    lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
+    return ["\\" + ln if MD_HEADER_RE.match(ln) else ln for ln in lines]
+
+
+def render_entity(entity: Dict[str, Any]) -> str:
+    data = entity.get("data") or {}
+    if entity.get("type") == "reagents" and data.get("name"):
+        vendor = (data.get("vendor") or {}).get("name")
+        extra = ", ".join(x for x in (vendor, f"cat. {data['sku']}" if data.get("sku") else None) if x)
+        return f"{data['name']} ({extra})" if extra else data["name"]
+    if entity.get("type") == "link" and data.get("url"):
+        return data["url"]
+    return ""
+
+
+def rich_text_lines(raw: Any) -> List[str]:
+    """Markdown lines from a Draft.js JSON string (or HTML / plain text)."""
+    if not raw or not isinstance(raw, str):
+        return []
+    try:
+        doc = json.loads(raw)
+    except ValueError:
+        return html_to_lines(raw)
+    if not isinstance(doc, dict) or "blocks" not in doc:
+        return html_to_lines(raw)
+
+    entity_map = doc.get("entityMap") or {}
+    lines: List[str] = []
+    ordered = 0
+    for block in doc["blocks"]:
+        text = block.get("text") or ""
+        # Entities that sit on placeholder whitespace (reagents, links) carry the real content
+        for er in sorted(block.get("entityRanges") or [], key=lambda r: -r.get("offset", 0)):
+            rendered = render_entity(entity_map.get(str(er.get("key")), {}))
+            start, end = er.get("offset", 0), er.get("offset", 0) + er.get("length", 0)
+            if rendered and not text[start:end].strip():
+                text = text[:start] + rendered + text[end:]
+        text = " ".join(text.split())
+
+        kind = block.get("type", "unstyled")
+        ordered = ordered + 1 if kind == "ordered-list-item" else 0
+        if not text:
+            continue
+        indent = "  " * int(block.get("depth") or 0)
+        if kind == "unordered-list-item":
+            lines.append(f"{indent}- {text}")
+        elif kind == "ordered-list-item":
+            # a bullet, so the chunker's step regex never mistakes it for a protocol step
+            lines.append(f"{indent}- ({ordered}) {text}")
+        elif kind.startswith("header-"):
+            lines.append(f"**{text}**")
+        else:
+            lines.append("\\" + text if MD_HEADER_RE.match(text) else text)
+    return lines
+
+
+# -------------------------
+# Protocol → Document
+# -------------------------
+
+def step_lines(step: Dict[str, Any]) -> List[str]:
+    if step.get("step"):
+        return rich_text_lines(step["step"])
+    lines: List[str] = []
+    for comp in step.get("components") or []:
+        source = comp.get("source") or {}
+        if comp.get("type_id") == 1 and source.get("description"):  # v3 "description" component
+            lines.extend(rich_text_lines(source["description"]))
+    return lines
+
+
+def procedure_lines(steps: List[Dict[str, Any]]) -> List[str]:
+    lines: List[str] = []
+    section: Optional[str] = None
+    for n, step in enumerate(steps, start=1):
+        title = " ".join(html_to_lines(step.get("section") or "")) or None
+        if title and title != section:
+            lines += ["", f"### {title}"]
+            section = title
+        body = step_lines(step) or ["(no text)"]
+        lines.append(f"{n}. {body[0]}")
+        lines.extend(f"   {'- ' if NUMBERED_RE.match(ln) else ''}{ln}" for ln in body[1:])
+    return lines
+
+
+def item_to_document(item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Document fields for one protocols.io item (None if it has no usable content)."""
+    if not isinstance(item, dict) or item.get("id") is None:
+        return None
+    title = " ".join(html_to_lines(item.get("title") or "")) or f"protocols.io {item['id']}"
+
+    sections = [
+        ("Purpose", rich_text_lines(item.get("description"))),
+        ("Scope", rich_text_lines(item.get("guidelines"))),
+        ("Preparation", rich_text_lines(item.get("before_start"))),
+        ("Safety", rich_text_lines(item.get("warning"))),
+        ("Materials", rich_text_lines(item.get("materials_text"))
+                      + [f"- {render_entity({'type': 'reagents', 'data': m})}"
+                         for m in item.get("materials") or [] if isinstance(m, dict) and m.get("name")]),
+        ("Procedure", procedure_lines([s for s in item.get("steps") or [] if isinstance(s, dict)])),
+    ]
+
+    refs = [f"- URL: {item['url']}"] if item.get("url") else []
+    if item.get("doi"):
+        refs.append(f"- DOI: {item['doi']}")
+    authors = [f"{a['name']} ({a['affiliation']})" if a.get("affiliation") else a["name"]
+               for a in item.get("authors") or [] if isinstance(a, dict) and a.get("name")]
+    if authors:
+        refs.append(f"- Authors: {'; '.join(authors)}")
+    sections.append(("References", refs))
+
+    if not any(body for name, body in sections if name != "References"):
+        return None
+
+    lines = [f"# {title}"]
+    for name, body in sections:
+        if body:
+            lines += ["", f"## {name}", *body]
+
+    return {
+        "doc_id": f"pio-{item['id']}",
+        "title": title,
+        "source_path": item.get("url") or f"protocols.io/{item['id']}",
+        "version": item.get("doi") or str(item.get("version_id", "")) or None,
+        "lines": lines,
+    }
+
+
+def iter_documents(paths: List[Path], workers: int = 0) -> Iterator[Dict[str, Any]]:
+    """Converted documents from every export, in input order, first occurrence of each doc_id only."""
+    def items() -> Iterator[Dict[str, Any]]:
+        for p in paths:
+            yield from iter_items(p)
+
+    seen = set()
+    for doc in bounded_imap(item_to_document, items(), workers=workers):
+        if doc is None or doc["doc_id"] in seen:
+            continue
+        seen.add(doc["doc_id"])
+        yield doc
@@ -1,10 +1,25 @@
-import faiss
-import numpy as np
+"""
+app/query.py
+
+Command-line search. By default a thin client of the query daemon
+(app/daemon.py), which it starts on first use; --no-daemon runs the search
+in-process instead.
+
+Keep module-level imports light: faiss, numpy and torch are only imported
+on the in-process path (or inside the daemon). scripts/check_import_time.py
+guards this.
+"""
+
+import json
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
 
 from app.config import SETTINGS
 from app.models import Chunk
-from app.utils import read_jsonl
-from app.embedder import Embedder
+
 
 def format_citation(c: Chunk) -> str:
     step_part = ""
@@ -14,23 +29,95 @@ def format_citation(c: Chunk) -> str:
     return f"{c.doc_id} • {c.section}{sub}{step_part} (L{c.line_start}–L{c.line_end})"
 
 
+def daemon_request(socket_path: Path, payload: dict, timeout: float = 60.0) -> dict:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout)
+        s.connect(str(socket_path))
+        s.sendall((json.dumps(payload) + "\n").encode("utf-8"))
+        buf = b""
+        while not buf.endswith(b"\n"):
+            part = s.recv(65536)
+            if not part:
+                break
+            buf += part
+    return json.loads(buf)
+
+
+def ensure_daemon(socket_path: Path, start_timeout: float) -> None:
+    try:
+        daemon_request(socket_path, {"op": "ping"}, timeout=2.0)
+        return
+    except (OSError, ValueError):
+        pass
+
+    socket_path.parent.mkdir(parents=True, exist_ok=True)
+    log_path = socket_path.with_suffix(".log")
+    print(f"Starting query daemon (log: {log_path}) ...", file=sys.stderr)
+    with log_path.open("ab") as log:
+        subprocess.Popen(
+            [sys.executable, "-m", "app.daemon", "--socket", str(socket_path)],
+            stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+
+    deadline = time.monotonic() + start_timeout
+    while time.monotonic() < deadline:
+        time.sleep(0.1)
+        try:
+            daemon_request(socket_path, {"op": "ping"}, timeout=2.0)
+            return
+        except (OSError, ValueError):
+            continue
+    raise SystemExit(f"Query daemon did not come up within {start_timeout:.0f}s; see {log_path}")
+
+
+def search_in_process(args) -> list:
+    from app.embedder import Embedder
+    from app.retrieval import search
+    from app.versions import load_bundle, resolve
+
+    index, meta, bitmaps, _, lexical = load_bundle(resolve(SETTINGS.index_dir))
+    embedder = Embedder(SETTINGS.embedding_model_name)
+    return search(index, meta, bitmaps, embedder, args.q, args.k, args.doc, args.section, lexical=lexical)
+
+
 def main():
     import argparse
     ap = argparse.ArgumentParser()
     ap.add_argument("--q", required=True, help="Query text")
     ap.add_argument("--k", type=int, default=SETTINGS.top_k)
+    ap.add_argument("--doc", default=None, help="Only search this doc_id")
+    ap.add_argument("--section", default=None, help="Only search this section")
+    ap.add_argument("--no-daemon", action="store_true", help="Load the model and index in this process")
+    ap.add_argument("--socket", type=Path, default=SETTINGS.daemon_socket)
+    ap.add_argument("--start-timeout", type=float, default=120.0,
+                    help="Seconds to wait for an auto-started daemon to load")
     args = ap.parse_args()
 
-    index = faiss.read_index(str(SETTINGS.index_dir / "faiss.index"))
-    meta = [Chunk(**row) for row in read_jsonl(SETTINGS.index_dir / "meta.jsonl")]
-
-    embedder = Embedder(SETTINGS.embedding_model_name)
-    q = embedder.embed_query(args.q).reshape(1, -1).astype("float32")
+    from app.query_log import log_query
 
-    scores, idxs = index.search(q, args.k)
+    mode = "in-process" if args.no_daemon else "daemon"
+    if not args.no_daemon:
+        ensure_daemon(args.socket, args.start_timeout)
+    t0 = time.perf_counter()
+    try:
+        if args.no_daemon:
+            results = search_in_process(args)
+        else:
+            reply = daemon_request(args.socket, {
+                "op": "search", "q": args.q, "k": args.k,
+                "doc_filter": args.doc, "section_filter": args.section,
+            })
+            if not reply.get("ok"):
+                raise SystemExit(f"Daemon error: {reply.get('error')}")
+            results = [(r["score"], Chunk(**r["chunk"])) for r in reply["results"]]
+    except BaseException as e:
+        log_query("cli", mode, args.q, args.k, args.doc, args.section, (time.perf_counter() - t0) * 1000,
+                  error=str(e) or type(e).__name__)
+        raise
+    log_query("cli", mode, args.q, args.k, args.doc, args.section, (time.perf_counter() - t0) * 1000, len(results))
 
-    for rank, (i, s) in enumerate(zip(idxs[0], scores[0]), start=1):
-        c = meta[int(i)]
+    for rank, (s, c) in enumerate(results, start=1):
         print(f"\n#{rank} score={float(s):.4f} | {format_citation(c)}\n")
         print(c.text[:1500])
 
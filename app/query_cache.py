@@ -0,0 +1,114 @@
+"""
+app/query_cache.py
+
+Query-embedding cache for Embedder.embed_query / embed_queries.
+
+Keys are (model name, normalize flag, normalized query text), where the
+text is NFKC-normalized, case-folded and whitespace-collapsed, so
+"Trypan  blue formula" and "trypan blue formula" share one entry.
+
+Tier 1 is a bounded in-process LRU. Tier 2 (optional, SETTINGS.query_cache_persist)
+is an EmbeddingStore under <embedding_cache_dir>/queries, so answers survive
+restarts of the daemon or the Streamlit server. One cache is shared by every
+Embedder in the process and is safe to use from several threads.
+"""
+
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.config import SETTINGS
+from app.embedding_store import EmbeddingStore
+
+
+def normalize_query(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFKC", text).casefold().split())
+
+
+class QueryEmbeddingCache:
+    def __init__(self, max_size: int = 1024, persist: bool = False):
+        self.max_size = max_size
+        self.persist = persist
+        self._lru: "OrderedDict[Tuple[str, bool, str], np.ndarray]" = OrderedDict()
+        self._stores: Dict[Tuple[str, bool], EmbeddingStore] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+
+    def _store(self, model_name: str, normalize: bool) -> Optional[EmbeddingStore]:
+        if not self.persist:
+            return None
+        key = (model_name, normalize)
+        if key not in self._stores:
+            self._stores[key] = EmbeddingStore(
+                SETTINGS.embedding_cache_dir / "queries", model_name, normalize=normalize,
+                max_bytes=SETTINGS.embedding_cache_max_mb * 2**20,
+            )
+        return self._stores[key]
+
+    def get_many(self, model_name: str, normalize: bool, queries: List[str]) -> List[Optional[np.ndarray]]:
+        keys = [(model_name, normalize, normalize_query(q)) for q in queries]
+        out: List[Optional[np.ndarray]] = [None] * len(queries)
+        with self._lock:
+            for i, key in enumerate(keys):
+                v = self._lru.get(key)
+                if v is not None:
+                    self._lru.move_to_end(key)
+                    out[i] = v
+                    self.hits += 1
+
+            store = self._store(model_name, normalize)
+            missing = [i for i, v in enumerate(out) if v is None]
+            if store is not None and missing:
+                found = store.get_many([keys[i][2] for i in missing])
+                for i, v in zip(missing, found):
+                    if v is not None:
+                        out[i] = v
+                        self.persistent_hits += 1
+                        self._insert(keys[i], v)
+            self.misses += sum(1 for v in out if v is None)
+        return out
+
+    def put_many(self, model_name: str, normalize: bool, queries: List[str], X: np.ndarray) -> None:
+        keys = [(model_name, normalize, normalize_query(q)) for q in queries]
+        with self._lock:
+            for key, v in zip(keys, X):
+                self._insert(key, np.array(v, dtype="float32"))
+            store = self._store(model_name, normalize)
+            if store is not None:
+                store.put_many([k[2] for k in keys], X)
+
+    def _insert(self, key: Tuple[str, bool, str], v: np.ndarray) -> None:
+        v.setflags(write=False)  # cached vectors are shared between callers
+        self._lru[key] = v
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_size:
+            self._lru.popitem(last=False)
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            lookups = self.hits + self.persistent_hits + self.misses
+            return {
+                "size": len(self._lru),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "persistent_hits": self.persistent_hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits + self.persistent_hits) / lookups if lookups else 0.0,
+            }
+
+
+_SHARED: Optional[QueryEmbeddingCache] = None
+_SHARED_LOCK = threading.Lock()
+
+
+def shared_query_cache() -> QueryEmbeddingCache:
+    global _SHARED
+    with _SHARED_LOCK:
+        if _SHARED is None:
+            _SHARED = QueryEmbeddingCache(SETTINGS.query_cache_size, persist=SETTINGS.query_cache_persist)
+        return _SHARED
@@ -0,0 +1,70 @@
+"""
+app/query_log.py
+
+Log of served queries, so real traffic can be replayed against the
+retriever (scripts/replay.py). The Streamlit app and the query CLI append one
+JSON line per search to <logs_dir>/queries.jsonl:
+
+  {"ts": 1760752260.12, "source": "streamlit", "mode": "in-process", "query": "...", "k": 5,
+   "doc_filter": null, "section_filter": null, "latency_ms": 41.7, "n_results": 5, "error": null}
+
+The file is rotated like spans.jsonl (SETTINGS.query_log_max_mb, keeping
+SETTINGS.trace_backups old files), with the same flock so the Streamlit app
+and CLI runs can append to it at once. SETTINGS.query_log = False disables it.
+Standard library only, like app.tracing, so the query CLI stays light.
+"""
+
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional
+
+from app.config import SETTINGS
+from app.tracing import RotatingJsonlWriter, read_rotated
+
+
+QUERY_LOG_FILE = "queries.jsonl"
+
+_WRITER: Optional[RotatingJsonlWriter] = None
+_WRITER_LOCK = threading.Lock()
+
+
+def writer() -> RotatingJsonlWriter:
+    global _WRITER
+    with _WRITER_LOCK:
+        if _WRITER is None:
+            _WRITER = RotatingJsonlWriter(SETTINGS.logs_dir / QUERY_LOG_FILE, SETTINGS.query_log_max_mb * 2**20,
+                                          SETTINGS.trace_backups)
+        return _WRITER
+
+
+def log_query(
+    source: str,
+    mode: str,
+    query: str,
+    k: int,
+    doc_filter: Optional[str],
+    section_filter: Optional[str],
+    latency_ms: float,
+    n_results: Optional[int] = None,
+    error: Optional[str] = None,
+) -> None:
+    if not SETTINGS.query_log:
+        return
+    writer().write({
+        "ts": round(time.time(), 3),
+        "source": source,
+        "mode": mode,
+        "query": query,
+        "k": k,
+        "doc_filter": doc_filter or None,
+        "section_filter": section_filter or None,
+        "latency_ms": round(latency_ms, 3),
+        "n_results": n_results,
+        "error": error,
+    })
+
+
+def read_query_log(path: Optional[Path] = None) -> Iterator[Dict[str, Any]]:
+    """Logged queries, oldest first (rotated files included)."""
+    return (r for r in read_rotated(path or SETTINGS.logs_dir / QUERY_LOG_FILE) if r.get("query"))
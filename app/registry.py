@@ -0,0 +1,295 @@
+"""
+app/registry.py
+
+Process-wide registry of loaded indexes and embedding models, for front ends
+that let users point at arbitrary index directories (the Streamlit app).
+
+Every entry records an estimate of the memory it holds. When the total goes
+over SETTINGS.registry_budget_mb, the least recently used entries that nobody
+is currently using (refs == 0) are dropped until it fits again. An entry in
+use is never evicted, so the registry can run over budget while many
+different indexes are in use at once; stats() reports that.
+
+release() and resize() name the value that was acquired, not just its key, so
+a holder of an entry that was invalidated and reloaded under the same key never
+touches the new entry. An invalidated entry that is still in use is kept as
+"draining" (still counted) and closed when its last holder releases it.
+
+What counts against the budget is heap memory: the faiss index (the build's
+serialized size), parsed meta.jsonl rows, filter bitmaps, the BM25 arrays and
+model weights. Memory-mapped files (columnar meta, vectors.npy for re-scoring)
+are reported as mapped_bytes but not counted, because the OS can drop those
+pages under pressure.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from app.config import SETTINGS
+
+
+Loader = Callable[[], Tuple[Any, int, Dict[str, int]]]  # -> (value, counted bytes, detail)
+
+
+class Entry:
+    __slots__ = ("kind", "key", "value", "nbytes", "detail", "refs", "hits", "loaded_at", "last_used")
+
+    def __init__(self, kind: str, key: str, value: Any, nbytes: int, detail: Dict[str, int]):
+        self.kind = kind
+        self.key = key
+        self.value = value
+        self.nbytes = nbytes
+        self.detail = detail
+        self.refs = 0
+        self.hits = 0
+        self.loaded_at = time.time()
+        self.last_used = time.monotonic()
+
+
+class ResourceRegistry:
+    def __init__(self, budget_bytes: int):
+        self.budget_bytes = budget_bytes
+        self._entries: Dict[Tuple[str, str], Entry] = {}
+        self._draining: List[Entry] = []  # invalidated while in use; closed on their last release
+        self._loading: Dict[Tuple[str, str], threading.Lock] = {}
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+
+    def acquire(self, kind: str, key: str, loader: Loader) -> Any:
+        """The resident value for (kind, key), loading it if needed; pair every call with release(kind, key, value)."""
+        k = (kind, key)
+        with self._lock:
+            entry = self._entries.get(k)
+            if entry is None:
+                load_lock = self._loading.setdefault(k, threading.Lock())
+            else:
+                return self._use(entry)
+
+        # Load outside the registry lock so other entries stay usable meanwhile;
+        # the per-key lock makes concurrent first requests share one load.
+        with load_lock:
+            with self._lock:
+                entry = self._entries.get(k)
+                if entry is not None:
+                    return self._use(entry)
+            value, nbytes, detail = loader()
+            with self._lock:
+                entry = self._entries[k] = Entry(kind, key, value, nbytes, detail)
+                self._loading.pop(k, None)
+                self.loads += 1
+                value = self._use(entry)
+                self._evict_locked()
+                return value
+
+    def _use(self, entry: Entry) -> Any:
+        entry.refs += 1
+        entry.hits += 1
+        entry.last_used = time.monotonic()
+        return entry.value
+
+    def _find_locked(self, kind: str, key: str, value: Any) -> Optional[Entry]:
+        """The entry (resident or draining) that handed out `value` for (kind, key)."""
+        entry = self._entries.get((kind, key))
+        if entry is not None and entry.value is value:
+            return entry
+        return next((e for e in self._draining if e.kind == kind and e.key == key and e.value is value), None)
+
+    def release(self, kind: str, key: str, value: Any) -> None:
+        with self._lock:
+            entry = self._find_locked(kind, key, value)
+            if entry is not None and entry.refs > 0:
+                entry.refs -= 1
+                entry.last_used = time.monotonic()
+                if entry.refs == 0 and entry in self._draining:
+                    self._draining.remove(entry)
+                    self._close(entry)
+            self._evict_locked()
+
+    @contextmanager
+    def lease(self, kind: str, key: str, loader: Loader) -> Iterator[Any]:
+        value = self.acquire(kind, key, loader)
+        try:
+            yield value
+        finally:
+            self.release(kind, key, value)
+
+    def invalidate(self, kind: Optional[str] = None, key: Optional[str] = None) -> int:
+        """
+        Forget matching entries (e.g. after a rebuild) so the next acquire loads them
+        again. Entries still in use keep working for their holders and are closed
+        when the last of them releases.
+        """
+        with self._lock:
+            drop = [e for k, e in self._entries.items() if (kind is None or k[0] == kind) and (key is None or k[1] == key)]
+            for entry in drop:
+                del self._entries[(entry.kind, entry.key)]
+                if entry.refs > 0:
+                    self._draining.append(entry)
+                else:
+                    self._close(entry)
+            return len(drop)
+
+    def resize(self, kind: str, key: str, value: Any, nbytes: int, detail: Dict[str, int]) -> None:
+        """New memory estimate for an entry whose value changed in place (an index hot swap)."""
+        with self._lock:
+            entry = self._find_locked(kind, key, value)
+            if entry is not None:
+                entry.nbytes, entry.detail = nbytes, detail
+            self._evict_locked()
+
+    def _drop_locked(self, entry: Entry) -> None:
+        del self._entries[(entry.kind, entry.key)]
+        self._close(entry)
+
+    @staticmethod
+    def _close(entry: Entry) -> None:
+        close = getattr(entry.value, "close", None)  # e.g. stop a HotIndex's watcher thread
+        if close is not None:
+            close()
+
+    def _resident_bytes(self) -> int:
+        return sum(e.nbytes for e in self._entries.values()) + sum(e.nbytes for e in self._draining)
+
+    def _evict_locked(self) -> None:
+        total = self._resident_bytes()
+        if total <= self.budget_bytes:
+            return
+        for entry in sorted(self._entries.values(), key=lambda e: e.last_used):
+            if total <= self.budget_bytes:
+                break
+            if entry.refs == 0:
+                self._drop_locked(entry)
+                total -= entry.nbytes
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            entries: List[Dict[str, Any]] = [{
+                "kind": e.kind,
+                "key": e.key,
+                "mb": round(e.nbytes / 2**20, 2),
+                **{f"{name}_mb": round(v / 2**20, 2) for name, v in e.detail.items()},
+                "refs": e.refs,
+                "hits": e.hits,
+                "idle_s": round(now - e.last_used, 1),
+                "loaded_at": time.strftime("%H:%M:%S", time.localtime(e.loaded_at)),
+            } for e in sorted(self._entries.values(), key=lambda e: -e.last_used)]
+            resident = self._resident_bytes()
+            return {
+                "budget_mb": round(self.budget_bytes / 2**20, 1),
+                "resident_mb": round(resident / 2**20, 2),
+                "over_budget": resident > self.budget_bytes,
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "draining": len(self._draining),
+                "entries": entries,
+            }
+
+
+# -------------------------
+# Loaders
+# -------------------------
+
+def _file_bytes(path: Path) -> int:
+    if path.is_dir():
+        return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+    return path.stat().st_size if path.exists() else 0
+
+
+def index_detail(index_dir: Path, index, meta, bitmaps, manifest: dict, lexical) -> Dict[str, int]:
+    from app.coarse import TwoStageIndex
+    from app.filters import FilteredIndex
+    from app.meta_store import ColumnarStore
+    from app.rescore import RescoredIndex
+    from app.shards import ShardedIndex
+
+    if manifest.get("shards"):
+        index_bytes = sum(s.get("index_bytes", 0) for s in manifest["shards"])
+    else:
+        index_bytes = (manifest.get("memory") or {}).get("index_bytes") or index.ntotal * index.d * 4
+
+    mapped = 0
+    if isinstance(meta, ColumnarStore):
+        meta_bytes = 0
+        mapped += _file_bytes(index_dir / "meta")
+    else:
+        meta_bytes = 3 * _file_bytes(index_dir / "meta.jsonl")  # pydantic rows are ~3x their JSON
+    coarse_bytes = 0
+    if isinstance(index, TwoStageIndex):
+        g = index.groups
+        coarse_bytes = g.centroids.nbytes + g.indptr.nbytes + g.rows.nbytes
+    # count vectors.npy once per index directory; stacked wrappers map the same file
+    parts = index.shards if isinstance(index, ShardedIndex) else [index]
+    mapped += sum(p.vectors.nbytes for p in parts if isinstance(p, (TwoStageIndex, FilteredIndex, RescoredIndex)))
+
+    bitmap_bytes = bitmaps.doc_bits.nbytes + bitmaps.section_bits.nbytes + bitmaps.useful_bits.nbytes
+    lexical_bytes = 0
+    if lexical is not None:
+        lexical_bytes = (lexical.indptr.nbytes + lexical.postings.nbytes + lexical.impacts.nbytes
+                         + lexical.idf.nbytes + sum(len(t) + 64 for t in lexical.terms))
+    return {"index": int(index_bytes), "meta": meta_bytes, "filters": int(bitmap_bytes),
+            "lexical": int(lexical_bytes), "coarse": int(coarse_bytes), "mapped": int(mapped)}
+
+
+def measure_index(hot) -> Tuple[int, Dict[str, int]]:
+    index, meta, bitmaps, manifest, lexical = hot.current
+    detail = index_detail(hot.path, index, meta, bitmaps, manifest, lexical)
+    return sum(v for name, v in detail.items() if name != "mapped"), detail
+
+
+def load_index(index_dir: Path, on_resize: Optional[Callable[[Any, int, Dict[str, int]], None]] = None):
+    """
+    A HotIndex over index_dir (hot.current is the (index, meta, bitmaps, manifest, lexical)
+    bundle of the published version) with its memory estimate; on_resize gets the HotIndex
+    and its new estimate after each background swap.
+    """
+    from app.versions import HotIndex, load_bundle
+
+    hot = HotIndex(index_dir, load_bundle, on_swap=(lambda h: on_resize(h, *measure_index(h))) if on_resize else None)
+    counted, detail = measure_index(hot)
+    return hot, counted, detail
+
+
+def model_bytes(embedder) -> int:
+    model = embedder.model  # loads it, so the estimate is of what is actually resident
+    if embedder.backend != "torch":
+        from app.onnx_backend import model_dir
+        name = "model.int8.onnx" if embedder.backend == "onnx_int8" else "model.onnx"
+        return _file_bytes(model_dir(embedder.model_name) / name)
+    params = getattr(model, "parameters", None)
+    if params is None:
+        return 0
+    return int(sum(p.numel() * p.element_size() for p in params()))
+
+
+def load_embedder(model_name: str) -> Tuple[Any, int, Dict[str, int]]:
+    from app.embedder import Embedder
+
+    embedder = Embedder(model_name)
+    nbytes = model_bytes(embedder)
+    return embedder, nbytes, {"model": nbytes}
+
+
+def index_key(index_dir) -> str:
+    return str(Path(index_dir).resolve())
+
+
+def model_key(model_name: str) -> str:
+    return f"{model_name}@{SETTINGS.embedding_backend}"
+
+
+_SHARED: Optional[ResourceRegistry] = None
+_SHARED_LOCK = threading.Lock()
+
+
+def shared_registry() -> ResourceRegistry:
+    global _SHARED
+    with _SHARED_LOCK:
+        if _SHARED is None:
+            _SHARED = ResourceRegistry(SETTINGS.registry_budget_mb * 2**20)
+        return _SHARED
@@ -0,0 +1,205 @@
+"""
+app/rerank.py
+
+Optional cross-encoder rerank of the top retrieval candidates (SETTINGS.rerank).
+
+search() / search_batch() fetch max(k, SETTINGS.rerank_candidates) chunks,
+and the cross-encoder re-scores (query, chunk text) pairs in batches of
+SETTINGS.rerank_batch_size. Pair scores are cached per (normalized query,
+chunk_id), with the chunk text's hash guarding against a rebuild that keeps an
+id but changes its text, so a repeated or paged query only scores new pairs.
+
+Each request has a latency budget (SETTINGS.rerank_budget_ms, 0 = none):
+  - before scoring, the number of candidates N is shrunk until the uncached
+    pairs fit the budget at the measured cost per pair;
+  - while scoring, batches are sent best-first and scoring stops once the
+    budget is spent; N becomes the prefix that was fully scored;
+  - with fewer than 2 candidates left the rerank is skipped.
+A search_batch call (e.g. one micro-batch of the HTTP service) counts as one
+request and its queries share the budget.
+Reranked candidates come first, ordered by cross-encoder score (their scores
+replace the retrieval scores); the rest keep their retrieval order and score.
+Such partly reranked (or unreranked) results are not put in the result cache,
+so a query that arrives during a slow period is reranked fully next time.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from app.config import SETTINGS
+from app.models import Chunk
+from app.query_cache import normalize_query
+from app.tracing import span
+
+
+Hit = Tuple[float, Chunk]
+
+
+class Reranker:
+    def __init__(self, model_name: str, cache_size: int = 20_000, batch_size: int = 16):
+        self.model_name = model_name
+        self.cache_size = cache_size
+        self.batch_size = max(1, batch_size)
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._scores: "OrderedDict[Tuple[str, str, str], float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.ms_per_pair: Optional[float] = None  # moving average of the measured scoring cost
+        self.requests = 0
+        self.skipped = 0
+        self.shrunk = 0
+        self.pairs_scored = 0
+        self.pairs_cached = 0
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    with span("rerank.load_model", model=self.model_name):
+                        from sentence_transformers import CrossEncoder
+                        self._model = CrossEncoder(self.model_name)
+        return self._model
+
+    @staticmethod
+    def _key(query: str, chunk: Chunk) -> Tuple[str, str, str]:
+        return query, chunk.chunk_id, hashlib.sha1(chunk.text.encode("utf-8")).hexdigest()[:12]
+
+    def _predict(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        model = self.model  # loaded outside the budget
+        t0 = time.perf_counter()
+        with span("rerank.predict", n=len(pairs)):
+            scores = model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False)
+        per_pair = (time.perf_counter() - t0) * 1000 / len(pairs)
+        with self._lock:
+            self.ms_per_pair = per_pair if self.ms_per_pair is None else 0.8 * self.ms_per_pair + 0.2 * per_pair
+        return [float(s) for s in scores]
+
+    def rerank(self, query: str, hits: Sequence[Hit], k: int, budget_ms: Optional[float] = None,
+               full: Optional[List[bool]] = None) -> List[Hit]:
+        return self.rerank_many([query], [hits], [k], budget_ms, full)[0]
+
+    def rerank_many(
+        self,
+        queries: List[str],
+        hit_lists: List[Sequence[Hit]],
+        ks: List[int],
+        budget_ms: Optional[float] = None,
+        full: Optional[List[bool]] = None,
+    ) -> List[List[Hit]]:
+        """
+        Rerank several candidate lists under one shared budget (one request); returns
+        the top k of each. If given, full[i] is set to whether list i had every
+        candidate reranked (False when the budget shrank N below it or skipped it).
+        """
+        budget_ms = SETTINGS.rerank_budget_ms if budget_ms is None else budget_ms
+        with span("rerank", n=len(queries)) as attrs:
+            t0 = time.perf_counter()
+            names = [normalize_query(q) for q in queries]
+            keys = [[self._key(name, c) for _, c in hits] for name, hits in zip(names, hit_lists)]
+            depth = max((len(h) for h in hit_lists), default=0)
+            with self._lock:
+                known: Dict[Tuple[str, str, str], float] = {}
+                for row in keys:
+                    for key in row:
+                        if key in self._scores:
+                            known[key] = self._scores[key]
+                            self._scores.move_to_end(key)
+
+            # Shrink N until the uncached pairs fit the budget at the measured cost per pair
+            n = depth
+            if budget_ms > 0 and self.ms_per_pair:
+                allowed = (budget_ms - (time.perf_counter() - t0) * 1000) / self.ms_per_pair
+                while n > 0 and self._uncached(keys, known, n) > allowed:
+                    n -= 1
+
+            # Score missing pairs best-first, in batches, until done or out of budget
+            todo = self._missing(keys, known, n, queries, hit_lists)
+            n_scored = 0
+            for start in range(0, len(todo), self.batch_size):
+                if budget_ms > 0 and start and (time.perf_counter() - t0) * 1000 >= budget_ms:
+                    break
+                batch = todo[start:start + self.batch_size]
+                for (_, key, _), s in zip(batch, self._predict([pair for _, _, pair in batch])):
+                    known[key] = s
+                n_scored += len(batch)
+            if n_scored < len(todo):
+                n = todo[n_scored][0]  # first rank with a pair left unscored
+
+            with self._lock:
+                for key, s in known.items():
+                    self._scores[key] = s
+                    self._scores.move_to_end(key)
+                while len(self._scores) > self.cache_size:
+                    self._scores.popitem(last=False)
+                self.requests += 1
+                self.pairs_scored += n_scored
+                self.pairs_cached += sum(1 for row in keys for key in row[:n] if key in known) - n_scored
+                if n < 2:
+                    self.skipped += 1
+                elif n < depth:
+                    self.shrunk += 1
+
+            attrs.update(candidates=n, depth=depth, scored=n_scored, skipped=n < 2)
+            if full is not None:
+                full[:] = [len(hits) < 2 or n >= len(hits) for hits in hit_lists]
+            if n < 2:
+                return [list(hits[:k]) for hits, k in zip(hit_lists, ks)]
+            out = []
+            for hits, row, k in zip(hit_lists, keys, ks):
+                head = sorted(((known[key], c) for (_, c), key in zip(hits[:n], row[:n])), key=lambda h: -h[0])
+                out.append((head + list(hits[n:]))[:k])
+            return out
+
+    @staticmethod
+    def _uncached(keys: List[List[Tuple[str, str, str]]], known: Dict, n: int) -> int:
+        return sum(1 for row in keys for key in row[:n] if key not in known)
+
+    @staticmethod
+    def _missing(keys, known, n, queries, hit_lists) -> List[Tuple[int, Tuple[str, str, str], Tuple[str, str]]]:
+        """(rank, key, (query, text)) for every unscored pair in the top n, rank by rank."""
+        todo = []
+        seen = set()
+        for rank in range(n):
+            for q, row, hits in zip(queries, keys, hit_lists):
+                if rank < len(row) and row[rank] not in known and row[rank] not in seen:
+                    seen.add(row[rank])
+                    todo.append((rank, row[rank], (q, hits[rank][1].text)))
+        return todo
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            lookups = self.pairs_scored + self.pairs_cached
+            return {
+                "model": self.model_name,
+                "requests": self.requests,
+                "skipped": self.skipped,
+                "shrunk": self.shrunk,
+                "pairs_scored": self.pairs_scored,
+                "pair_cache_hit_ratio": self.pairs_cached / lookups if lookups else 0.0,
+                "ms_per_pair": round(self.ms_per_pair, 3) if self.ms_per_pair is not None else None,
+                "cached_scores": len(self._scores),
+            }
+
+
+_SHARED: Optional[Reranker] = None
+_SHARED_LOCK = threading.Lock()
+
+
+def shared_reranker() -> Optional[Reranker]:
+    """The process-wide reranker, or None when SETTINGS.rerank is off."""
+    global _SHARED
+    if not SETTINGS.rerank:
+        return None
+    with _SHARED_LOCK:
+        if _SHARED is None:
+            _SHARED = Reranker(SETTINGS.rerank_model_name, SETTINGS.rerank_cache_size, SETTINGS.rerank_batch_size)
+        return _SHARED
+
+
+def rerank_stats() -> Optional[Dict[str, object]]:
+    reranker = shared_reranker()
+    return reranker.stats() if reranker is not None else None
@@ -0,0 +1,67 @@
+"""
+app/rescore.py
+
+Exact re-scoring for compressed indexes (fp16 / SQ8 / PQ codecs).
+
+The compressed index picks k * SETTINGS.rescore_factor candidates; their scores
+are then recomputed against the float32 copy of the vectors that index_faiss
+writes to <index_dir>/vectors.npy. That file is memory-mapped, so only the
+pages of rows that are actually re-scored become resident.
+"""
+
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+
+from app.config import SETTINGS
+
+
+LOSSLESS_CODECS = {"fp32"}
+
+
+class RescoredIndex:
+    """Wraps a faiss index; search() has the faiss signature and returns exact inner products."""
+
+    def __init__(self, base, vectors: np.ndarray, factor: int):
+        self.base = base
+        self.vectors = vectors
+        self.factor = factor
+        self.ntotal = base.ntotal
+        self.d = base.d
+        self.metric_type = base.metric_type
+
+    def search(self, Q: np.ndarray, k: int, params=None) -> Tuple[np.ndarray, np.ndarray]:
+        Q = np.ascontiguousarray(Q, dtype="float32")
+        k_cand = min(self.ntotal, max(k, k * self.factor))
+        _, cand = self.base.search(Q, k_cand, params=params)
+
+        valid = cand >= 0
+        exact = np.einsum("qd,qkd->qk", Q, np.asarray(self.vectors[np.where(valid, cand, 0)], dtype="float32"))
+        exact[~valid] = -np.inf
+
+        order = np.argsort(-exact, axis=1, kind="stable")[:, :k]
+        scores = np.take_along_axis(exact, order, axis=1)
+        idxs = np.take_along_axis(cand, order, axis=1)
+        idxs[~np.isfinite(scores)] = -1
+        return scores.astype("float32"), idxs
+
+
+def unwrap(index):
+    """The faiss index underneath RescoredIndex / coarse.TwoStageIndex wrappers (for SearchParameters, ntotal, ...)."""
+    while hasattr(index, "base"):
+        index = index.base
+    return index
+
+
+def with_rescore(index, index_dir: Path, manifest: dict, factor: Optional[int] = None):
+    """RescoredIndex if the build used a lossy codec and a float copy exists, else the index unchanged."""
+    factor = SETTINGS.rescore_factor if factor is None else factor
+    lossy = manifest.get("vector_codec", "fp32") not in LOSSLESS_CODECS
+    vectors_path = Path(index_dir) / "vectors.npy"
+    if not lossy or factor <= 1 or not vectors_path.exists():
+        return index
+    vectors = np.load(vectors_path, mmap_mode="r")
+    if vectors.shape[0] != index.ntotal:
+        return index
+    return RescoredIndex(index, vectors, factor)
@@ -0,0 +1,222 @@
+"""
+app/result_cache.py
+
+Retrieval result cache in front of app.retrieval.search / search_batch (and
+ops_copilot's Retriever.search).
+
+Exact tier: keyed by (index version, normalized query, k, doc_filter,
+section_filter, retrieval mode, settings digest), with the query normalized as in
+app/query_cache.py, so a re-run of the same search skips embedding, the faiss
+call and the filter work.
+
+Semantic tier (optional, SETTINGS.result_cache_semantic_threshold > 0):
+after an exact miss the query is embedded anyway; if a cached query with the
+same index version, k and filters has an embedding at least that
+cosine-similar, its results are reused and only the faiss search is skipped.
+Only dense searches take part: the hybrid lexical fast path never embeds the
+query.
+
+The index version is the manifest's published "version" (app/versions.py), or
+a hash of the manifest for unversioned index directories, so results from an
+older build are never returned. Seeing a manifest whose parent_version is
+cached drops that parent's entries right away instead of waiting for LRU.
+The settings digest covers the SETTINGS fields that change results
+(RESULT_SETTINGS: hybrid / RRF, re-scoring and filter fallback, coarse and rerank knobs), so a
+reader whose settings change never serves results computed under the old ones.
+
+Each entry remembers how long computing it took; hits add that time (less
+the lookup) to saved_ms. One cache is shared by every caller in the process
+and is safe to use from several threads.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from app.config import SETTINGS
+from app.query_cache import normalize_query
+
+
+Scope = Tuple[str, int, Optional[str], Optional[str], str, str]  # (version, k, doc_filter, section_filter, mode, settings)
+
+RESULT_SETTINGS = (
+    "embedding_backend",
+    "retrieval_mode", "bm25_k1", "bm25_b", "lexical_fast_max_terms", "lexical_fast_coverage",
+    "lexical_fast_margin", "rrf_k", "fusion_candidates",
+    "rescore_factor", "filter_exact_rows", "filter_exact_fraction", "filter_max_widen",
+    "coarse_fanout", "coarse_level",
+    "rerank", "rerank_model_name", "rerank_candidates", "rerank_budget_ms",
+)
+
+
+def settings_digest() -> str:
+    """Hash of the SETTINGS fields in RESULT_SETTINGS, as they are now."""
+    blob = json.dumps([getattr(SETTINGS, name) for name in RESULT_SETTINGS], default=str).encode("utf-8")
+    return hashlib.sha1(blob).hexdigest()[:12]
+
+
+def index_version(manifest: dict) -> str:
+    """Identity of a build: its published version, else a hash of its manifest."""
+    if manifest.get("version"):
+        return manifest["version"]
+    blob = json.dumps(manifest, sort_keys=True, default=str).encode("utf-8")
+    return "sha1:" + hashlib.sha1(blob).hexdigest()[:16]
+
+
+class Entry:
+    __slots__ = ("value", "cost_ms")
+
+    def __init__(self, value: Any, cost_ms: float):
+        self.value = value
+        self.cost_ms = cost_ms
+
+
+class ResultCache:
+    def __init__(self, max_size: int = 512, semantic_threshold: float = 0.0):
+        self.max_size = max_size
+        self.semantic_threshold = semantic_threshold
+        self._lru: "OrderedDict[Tuple[Scope, str], Entry]" = OrderedDict()
+        self._vectors: Dict[Scope, Dict[str, np.ndarray]] = {}  # semantic tier: scope -> normalized query -> vector
+        self._parents: Dict[str, Optional[str]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        self.saved_ms = 0.0
+
+    @property
+    def semantic(self) -> bool:
+        return self.semantic_threshold > 0
+
+    @staticmethod
+    def scope(version: str, k: int, doc_filter: Optional[str], section_filter: Optional[str], mode: str = "dense") -> Scope:
+        return (version, int(k), doc_filter or None, section_filter or None, mode, settings_digest())
+
+    def observe(self, manifest: dict) -> str:
+        """The manifest's version; the first time a version is seen, its parent's entries are dropped."""
+        version = index_version(manifest)
+        with self._lock:
+            if version not in self._parents:
+                parent = manifest.get("parent_version")
+                self._parents[version] = parent
+                if parent and parent in self._parents:
+                    self._drop_version_locked(parent)
+        return version
+
+    def get(self, scope: Scope, query: str) -> Optional[Any]:
+        t0 = time.perf_counter()
+        key = (scope, normalize_query(query))
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._lru.move_to_end(key)
+            self.hits += 1
+            self.saved_ms += max(0.0, entry.cost_ms - (time.perf_counter() - t0) * 1000)
+            return entry.value
+
+    def get_similar(self, scope: Scope, vector: np.ndarray) -> Optional[Any]:
+        """Semantic tier: results of the most similar cached query in scope, if above the threshold."""
+        if not self.semantic:
+            return None
+        t0 = time.perf_counter()
+        with self._lock:
+            vectors = self._vectors.get(scope)
+            if not vectors:
+                return None
+            names = list(vectors)
+            sims = np.stack([vectors[n] for n in names]) @ np.asarray(vector, dtype="float32").ravel()
+            best = int(np.argmax(sims))
+            if sims[best] < self.semantic_threshold:
+                return None
+            key = (scope, names[best])
+            entry = self._lru[key]
+            self._lru.move_to_end(key)
+            # the lookup that counted a miss for this query turned into a hit
+            self.misses -= 1
+            self.semantic_hits += 1
+            self.saved_ms += max(0.0, entry.cost_ms - (time.perf_counter() - t0) * 1000)
+            return entry.value
+
+    def put(self, scope: Scope, query: str, value: Any, cost_ms: float, vector: Optional[np.ndarray] = None) -> None:
+        if self.max_size <= 0:
+            return
+        name = normalize_query(query)
+        if vector is not None and self.semantic:
+            vector = np.array(vector, dtype="float32").ravel()
+            vector /= max(float(np.linalg.norm(vector)), 1e-12)  # cosine = dot product
+        else:
+            vector = None
+        with self._lock:
+            key = (scope, name)
+            self._lru[key] = Entry(value, cost_ms)
+            self._lru.move_to_end(key)
+            if vector is not None:
+                self._vectors.setdefault(scope, {})[name] = vector
+            while len(self._lru) > self.max_size:
+                (old_scope, old_name), _ = self._lru.popitem(last=False)
+                self._forget_vector_locked(old_scope, old_name)
+
+    def _forget_vector_locked(self, scope: Scope, name: str) -> None:
+        vectors = self._vectors.get(scope)
+        if vectors is not None:
+            vectors.pop(name, None)
+            if not vectors:
+                del self._vectors[scope]
+
+    def _drop_version_locked(self, version: str) -> None:
+        stale = [key for key in self._lru if key[0][0] == version]
+        for scope, name in stale:
+            del self._lru[(scope, name)]
+            self._forget_vector_locked(scope, name)
+        self.invalidated += len(stale)
+
+    def invalidate(self, version: Optional[str] = None) -> None:
+        with self._lock:
+            if version is not None:
+                self._drop_version_locked(version)
+                return
+            self.invalidated += len(self._lru)
+            self._lru.clear()
+            self._vectors.clear()
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            lookups = self.hits + self.semantic_hits + self.misses
+            return {
+                "size": len(self._lru),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits + self.semantic_hits) / lookups if lookups else 0.0,
+                "saved_ms": round(self.saved_ms, 1),
+                "invalidated": self.invalidated,
+            }
+
+
+_SHARED: Optional[ResultCache] = None
+_SHARED_LOCK = threading.Lock()
+
+
+def shared_result_cache() -> Optional[ResultCache]:
+    """The process-wide cache, or None when SETTINGS.result_cache_size is 0."""
+    global _SHARED
+    if SETTINGS.result_cache_size <= 0:
+        return None
+    with _SHARED_LOCK:
+        if _SHARED is None:
+            _SHARED = ResultCache(SETTINGS.result_cache_size, SETTINGS.result_cache_semantic_threshold)
+        return _SHARED
+
+
+def result_cache_stats() -> Optional[Dict[str, object]]:
+    cache = shared_result_cache()
+    return cache.stats() if cache is not None else None
@@ -0,0 +1,291 @@
+"""
+app/retrieval.py
+
+UI-free retrieval core shared by the Streamlit app and the query daemon:
+loading an index directory and running a filtered search over it.
+
+faiss is imported on first load so that importing this module stays cheap.
+"""
+
+import json
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.config import SETTINGS
+from app.coarse import TwoStageIndex
+from app.embedder import Embedder
+from app.filters import FilteredIndex, FilterBitmaps, load_or_build, search_params
+from app.lexical import HYBRID_STATS, LexicalIndex, load_lexical, rrf_fuse
+from app.meta_store import load_meta
+from app.models import Chunk
+from app.rerank import shared_reranker
+from app.rescore import unwrap
+from app.result_cache import shared_result_cache
+from app.shards import ShardedIndex, load_search_index
+from app.tracing import span
+from app.versions import resolve
+
+
+def load_manifest(index_dir: Path) -> dict:
+    p = index_dir / "manifest.json"
+    if not p.exists():
+        return {}
+    return json.loads(p.read_text(encoding="utf-8"))
+
+
+def load_index_and_meta(index_dir: Path) -> Tuple["faiss.Index", Sequence[Chunk], FilterBitmaps, dict]:
+    index_dir = resolve(index_dir)  # the published version CURRENT points at
+    faiss_path = index_dir / "faiss.index"
+    meta_path = index_dir / "meta.jsonl"
+
+    manifest = load_manifest(index_dir)
+    if not (faiss_path.exists() or manifest.get("shards")) or not meta_path.exists():
+        raise FileNotFoundError(
+            f"Missing index files. Expected:\n- {faiss_path}\n- {meta_path}\n"
+            f"Run: python -m app.index_faiss"
+        )
+
+    index = load_search_index(index_dir, manifest)  # shard fan-out, exact re-score for lossy codecs
+    meta = load_meta(index_dir, expected_n=index.ntotal)  # columnar + mmap when available
+    bitmaps = load_or_build(index_dir, meta)
+    return index, meta, bitmaps, manifest
+
+
+def load_lexical_index(index_dir: Path) -> Optional[LexicalIndex]:
+    """BM25 index when SETTINGS.retrieval_mode is "hybrid" (None in dense mode or if the build has none)."""
+    if SETTINGS.retrieval_mode != "hybrid":
+        return None
+    return load_lexical(resolve(index_dir))
+
+
+def filtered_search(
+    index: "faiss.Index",
+    bitmaps: FilterBitmaps,
+    Q: np.ndarray,
+    k: int,
+    doc_filter: Optional[str] = None,
+    section_filter: Optional[str] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    One index.search over the query matrix Q, restricted to rows matching the filters.
+    Filters (and the short-chunk rule) run inside FAISS via an ID bitmap, so each row
+    comes back with exactly min(k, #matching rows) hits. A ShardedIndex splits the
+    bitmap per shard itself; a TwoStageIndex applies it to its candidate groups; a
+    FilteredIndex (HNSW / IVF) scores small filters exactly and fills short results.
+    """
+    k_eff = min(k, bitmaps.count(doc_filter or None, section_filter or None))
+    if k_eff <= 0:
+        return np.zeros((len(Q), 0), dtype="float32"), np.zeros((len(Q), 0), dtype="int64")
+    with span("search.filter"):
+        bits = bitmaps.select(doc_filter or None, section_filter or None)
+        Q = np.ascontiguousarray(Q, dtype="float32")
+        params = _bits = None
+        takes_bits = isinstance(index, (ShardedIndex, TwoStageIndex, FilteredIndex))
+        if not takes_bits:
+            params, _bits = search_params(bits, bitmaps.n, unwrap(index))
+    with span("search.faiss", n=len(Q), k=k_eff):
+        if takes_bits:
+            return index.search(Q, k_eff, bits=bits)
+        return index.search(Q, k_eff, params=params)
+
+
+def to_hits(meta: Sequence[Chunk], scores: np.ndarray, idxs: np.ndarray, k: int) -> List[Tuple[float, Chunk]]:
+    with span("search.meta"):
+        return [(float(s), meta[int(i)]) for s, i in zip(scores[:k].tolist(), idxs[:k].tolist()) if int(i) >= 0]
+
+
+def hybrid_rows(
+    index: "faiss.Index",
+    bitmaps: Optional[FilterBitmaps],
+    embedder: Embedder,
+    lexical: LexicalIndex,
+    queries: List[str],
+    ks: List[int],
+    filters: List[Tuple[Optional[str], Optional[str]]],
+) -> List[Tuple[np.ndarray, np.ndarray, bool]]:
+    """
+    retrieval_mode="hybrid": BM25 first. Confident lexical hits are returned without
+    running the transformer; the rest get one embed_queries call and their BM25 and
+    dense rankings are fused with RRF. Returns (scores, rows, fast_path) per query;
+    scores are BM25 on the fast path and RRF scores otherwise. bitmaps=None searches
+    every row (used by eval).
+    """
+    depth = max([SETTINGS.fusion_candidates] + list(ks))
+    out: List[Optional[Tuple[np.ndarray, np.ndarray, bool]]] = [None] * len(queries)
+    lexical_rows: Dict[int, np.ndarray] = {}
+    lexical_ms: Dict[int, float] = {}
+    for i, q in enumerate(queries):
+        t0 = time.perf_counter()
+        doc_filter, section_filter = filters[i]
+        bits = bitmaps.select(doc_filter or None, section_filter or None) if bitmaps is not None else None
+        with span("search.lexical") as attrs:
+            scores, rows, terms = lexical.search(q, depth, bits)
+            attrs["fast_path"] = lexical.confident(terms, scores, rows)
+        if attrs["fast_path"]:
+            out[i] = (scores[:ks[i]], rows[:ks[i]], True)
+            HYBRID_STATS.record(True, (time.perf_counter() - t0) * 1000)
+        else:
+            lexical_rows[i] = rows
+            lexical_ms[i] = (time.perf_counter() - t0) * 1000
+
+    pending = list(lexical_rows)
+    if pending:
+        t0 = time.perf_counter()
+        Q = embedder.embed_queries([queries[i] for i in pending])
+        groups: Dict[Tuple[Optional[str], Optional[str]], List[int]] = {}
+        for j, i in enumerate(pending):
+            groups.setdefault((filters[i][0] or None, filters[i][1] or None), []).append(j)
+        for (doc_filter, section_filter), js in groups.items():
+            if bitmaps is None:
+                _, dense = index.search(np.ascontiguousarray(Q[js]), min(depth, index.ntotal))
+            else:
+                _, dense = filtered_search(index, bitmaps, Q[js], depth, doc_filter, section_filter)
+            with span("search.fuse", n=len(js)):
+                for r, j in enumerate(js):
+                    i = pending[j]
+                    out[i] = (*rrf_fuse([dense[r], lexical_rows[i]], ks[i]), False)
+        shared_ms = (time.perf_counter() - t0) * 1000 / len(pending)
+        for i in pending:
+            HYBRID_STATS.record(False, lexical_ms[i] + shared_ms)
+    return out
+
+
+def search(
+    index: "faiss.Index",
+    meta: Sequence[Chunk],
+    bitmaps: FilterBitmaps,
+    embedder: Embedder,
+    query: str,
+    k: int,
+    doc_filter: Optional[str] = None,
+    section_filter: Optional[str] = None,
+    lexical: Optional[LexicalIndex] = None,
+    manifest: Optional[dict] = None,
+) -> List[Tuple[float, Chunk]]:
+    """
+    Top-k chunks for one query. Passing the index's manifest enables the shared
+    result cache (app/result_cache.py), keyed by the manifest's version. With
+    SETTINGS.rerank the top candidates are re-scored by a cross-encoder
+    (app/rerank.py) before the top k are returned.
+    """
+    with span("search", query=query, k=k, doc_filter=doc_filter, section_filter=section_filter,
+              mode=search_mode(lexical)) as attrs:
+        hits = _search(index, meta, bitmaps, embedder, query, k, doc_filter, section_filter, lexical, manifest, attrs)
+        attrs["hits"] = len(hits)
+        return hits
+
+
+def search_mode(lexical: Optional[LexicalIndex]) -> str:
+    """Retrieval mode label for spans and result-cache scopes: dense | hybrid, plus "+rerank"."""
+    return ("dense" if lexical is None else "hybrid") + ("+rerank" if SETTINGS.rerank else "")
+
+
+def _search(index, meta, bitmaps, embedder, query, k, doc_filter, section_filter, lexical, manifest,
+            attrs: Dict[str, object]) -> List[Tuple[float, Chunk]]:
+    if bitmaps.count(doc_filter or None, section_filter or None) == 0:
+        return []
+    cache = shared_result_cache() if manifest is not None else None
+    if cache is not None:
+        scope = cache.scope(cache.observe(manifest), k, doc_filter, section_filter, search_mode(lexical))
+        cached = cache.get(scope, query)
+        attrs["cache"] = "miss" if cached is None else "exact"
+        if cached is not None:
+            return list(cached)
+
+    t0 = time.perf_counter()
+    q = None
+    reranker = shared_reranker()
+    k_fetch = max(k, SETTINGS.rerank_candidates) if reranker is not None else k
+    if lexical is not None:
+        scores, rows, _ = hybrid_rows(index, bitmaps, embedder, lexical, [query], [k_fetch], [(doc_filter, section_filter)])[0]
+        hits = to_hits(meta, scores, rows, k_fetch)
+    else:
+        q = embedder.embed_query(query).reshape(1, -1).astype("float32")
+        cached = cache.get_similar(scope, q) if cache is not None else None
+        if cached is not None:
+            attrs["cache"] = "semantic"
+            return list(cached)
+        scores, idxs = filtered_search(index, bitmaps, q, k_fetch, doc_filter, section_filter)
+        hits = to_hits(meta, scores[0], idxs[0], k_fetch)
+    full = [True]
+    if reranker is not None:
+        hits = reranker.rerank(query, hits, k, full=full)
+        attrs["rerank_full"] = full[0]
+    if cache is not None and full[0]:  # a budget-cut rerank is not cached
+        cache.put(scope, query, tuple(hits), (time.perf_counter() - t0) * 1000, q)
+    return hits
+
+
+def search_batch(
+    index: "faiss.Index",
+    meta: Sequence[Chunk],
+    bitmaps: FilterBitmaps,
+    embedder: Embedder,
+    queries: List[str],
+    ks: List[int],
+    filters: List[Tuple[Optional[str], Optional[str]]],
+    lexical: Optional[LexicalIndex] = None,
+    manifest: Optional[dict] = None,
+) -> List[List[Tuple[float, Chunk]]]:
+    """
+    search() for many queries: one embed_queries call for all of them, then one
+    index.search per distinct (doc_filter, section_filter) combination. With a
+    manifest, queries in the exact tier of the result cache are answered from it
+    and only the rest are searched.
+    """
+    if not queries:
+        return []
+    with span("search_batch", n=len(queries), mode=search_mode(lexical)):
+        return _search_batch(index, meta, bitmaps, embedder, queries, ks, filters, lexical, manifest)
+
+
+def _search_batch(index, meta, bitmaps, embedder, queries, ks, filters, lexical, manifest,
+                  rerank: bool = True, full: Optional[List[bool]] = None) -> List[List[Tuple[float, Chunk]]]:
+    cache = shared_result_cache() if manifest is not None else None
+    if cache is not None:
+        version = cache.observe(manifest)
+        mode = search_mode(lexical)
+        scopes = [cache.scope(version, k, f[0], f[1], mode) for k, f in zip(ks, filters)]
+        answered: List[Optional[List[Tuple[float, Chunk]]]] = [None] * len(queries)
+        for i, q in enumerate(queries):
+            cached = cache.get(scopes[i], q)
+            if cached is not None:
+                answered[i] = list(cached)
+        todo = [i for i, hits in enumerate(answered) if hits is None]
+        if todo:
+            t0 = time.perf_counter()
+            full = [True] * len(todo)
+            fresh = _search_batch(index, meta, bitmaps, embedder, [queries[i] for i in todo],
+                                  [ks[i] for i in todo], [filters[i] for i in todo], lexical, None, full=full)
+            cost_ms = (time.perf_counter() - t0) * 1000 / len(todo)
+            for i, hits, complete in zip(todo, fresh, full):
+                answered[i] = hits
+                if complete:  # a budget-cut rerank is not cached
+                    cache.put(scopes[i], queries[i], tuple(hits), cost_ms)
+        return answered
+
+    reranker = shared_reranker() if rerank else None
+    if reranker is not None:  # one rerank over every query's candidates, under one budget
+        fetched = _search_batch(index, meta, bitmaps, embedder, queries,
+                                [max(k, SETTINGS.rerank_candidates) for k in ks], filters, lexical, None, rerank=False)
+        return reranker.rerank_many(queries, fetched, ks, full=full)
+
+    if lexical is not None:
+        return [to_hits(meta, scores, rows, k)
+                for (scores, rows, _), k in zip(hybrid_rows(index, bitmaps, embedder, lexical, queries, ks, filters), ks)]
+    Q = embedder.embed_queries(queries)
+
+    groups: Dict[Tuple[Optional[str], Optional[str]], List[int]] = {}
+    for i, f in enumerate(filters):
+        groups.setdefault((f[0] or None, f[1] or None), []).append(i)
+
+    out: List[List[Tuple[float, Chunk]]] = [[] for _ in queries]
+    for (doc_filter, section_filter), rows in groups.items():
+        k_max = max(ks[i] for i in rows)
+        scores, idxs = filtered_search(index, bitmaps, Q[rows], k_max, doc_filter, section_filter)
+        for j, i in enumerate(rows):
+            out[i] = to_hits(meta, scores[j], idxs[j], ks[i])
+    return out
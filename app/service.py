@@ -0,0 +1,297 @@
+"""
+app/service.py
+
+Asyncio HTTP retrieval service with dynamic micro-batching.
+
+Concurrent /search requests are gathered for up to SETTINGS.service_batch_window_ms
+(or SETTINGS.service_max_batch requests) and answered with a single
+embed_queries call plus one batched index.search per distinct filter
+combination (app.retrieval.search_batch). Each caller gets only its own results.
+
+Run:  python -m app.service [--host 127.0.0.1] [--port 8765]
+
+JSON API
+--------
+POST /search
+  request:  {"query": "trypan blue formula",     required
+             "k": 5,                              optional, default SETTINGS.top_k
+             "doc_filter": "sop-tc-007",          optional
+             "section_filter": "Procedure",       optional
+             "timeout_ms": 2000}                  optional, default SETTINGS.service_default_timeout_ms
+  200:      {"results": [{"score": 0.71, "chunk": {...Chunk fields...}}, ...],
+             "batch_size": 12, "queue_ms": 3.1, "total_ms": 41.7}
+  400:      {"error": "..."}                      malformed body / missing query
+  429:      {"error": "queue full"}               bounded queue is full; honour Retry-After
+  504:      {"error": "deadline exceeded"}        not answered within timeout_ms
+
+GET /healthz   {"ok": true, "n_chunks": 114, "index_dir": "data/index", "version": "20260101-120000-ab12cd"}
+GET /stats     request / batch / rejection counters, queue depth, embedding and result
+               cache stats, rerank stats (SETTINGS.rerank), lexical fast-path rate and
+               latency (retrieval_mode="hybrid")
+
+Every response is JSON and the connection is closed after it.
+
+Index versions published while the service runs are loaded in the background
+and swapped in between batches (app.versions.HotIndex); a batch never mixes
+two versions.
+"""
+
+import asyncio
+import json
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from app.config import SETTINGS
+from app.models import Chunk
+
+
+class PendingSearch:
+    __slots__ = ("query", "k", "doc_filter", "section_filter", "deadline", "enqueued", "future")
+
+    def __init__(self, query: str, k: int, doc_filter: Optional[str], section_filter: Optional[str],
+                 deadline: float, future: asyncio.Future):
+        self.query = query
+        self.k = k
+        self.doc_filter = doc_filter
+        self.section_filter = section_filter
+        self.deadline = deadline
+        self.enqueued = time.monotonic()
+        self.future = future
+
+
+class MicroBatcher:
+    def __init__(self, index_dir: Path, model_name: str):
+        from app.embedder import Embedder
+        from app.versions import HotIndex, load_bundle
+
+        self.index_dir = index_dir
+        self.hot = HotIndex(index_dir, load_bundle)  # (index, meta, bitmaps, manifest, lexical), swapped in the background
+        self.embedder = Embedder(model_name)
+        self.embedder.embed_query("warmup")
+
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SETTINGS.service_max_queue)
+        # One thread: the model and index see one batch at a time.
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="retrieval")
+        self.stats = {"requests": 0, "rejected": 0, "timeouts": 0, "batches": 0, "batched_requests": 0, "errors": 0}
+
+    def submit(self, query: str, k: int, doc_filter: Optional[str], section_filter: Optional[str],
+               timeout_s: float) -> asyncio.Future:
+        """Enqueue a search; raises asyncio.QueueFull when the service is saturated."""
+        fut = asyncio.get_running_loop().create_future()
+        item = PendingSearch(query, k, doc_filter, section_filter, time.monotonic() + timeout_s, fut)
+        self.stats["requests"] += 1
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.stats["rejected"] += 1
+            raise
+        return fut
+
+    async def run(self) -> None:
+        window = SETTINGS.service_batch_window_ms / 1000.0
+        while True:
+            batch = [await self.queue.get()]
+            close_at = time.monotonic() + window
+            while len(batch) < SETTINGS.service_max_batch:
+                remaining = close_at - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            # Skip callers that already gave up or whose deadline has passed
+            now = time.monotonic()
+            live = [p for p in batch if not p.future.done() and p.deadline > now]
+            if not live:
+                continue
+            await self._answer(live)
+
+    async def _answer(self, batch: List[PendingSearch]) -> None:
+        from app.retrieval import search_batch
+
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        index, meta, bitmaps, manifest, lexical = self.hot.current  # one version for the whole batch
+        try:
+            results = await loop.run_in_executor(
+                self.executor, search_batch,
+                index, meta, bitmaps, self.embedder,
+                [p.query for p in batch], [p.k for p in batch],
+                [(p.doc_filter, p.section_filter) for p in batch],
+                lexical, manifest,
+            )
+        except Exception as e:
+            self.stats["errors"] += 1
+            for p in batch:
+                if not p.future.done():
+                    p.future.set_exception(e)
+            return
+
+        self.stats["batches"] += 1
+        self.stats["batched_requests"] += len(batch)
+        for p, hits in zip(batch, results):
+            if not p.future.done():
+                p.future.set_result((hits, len(batch), (started - p.enqueued) * 1000))
+
+
+# -------------------------
+# HTTP
+# -------------------------
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 429: "Too Many Requests",
+               500: "Internal Server Error", 504: "Gateway Timeout"}
+
+
+async def read_request(reader: asyncio.StreamReader) -> Tuple[str, str, bytes]:
+    request_line = (await reader.readline()).decode("latin-1").strip()
+    method, path, _ = request_line.split(" ", 2)
+    length = 0
+    while True:
+        line = (await reader.readline()).decode("latin-1").strip()
+        if not line:
+            break
+        name, _, value = line.partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value.strip())
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), path.split("?", 1)[0], body
+
+
+def write_response(writer: asyncio.StreamWriter, status: int, payload: dict, headers: Optional[Dict[str, str]] = None) -> None:
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    head = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}",
+            "Content-Type: application/json",
+            f"Content-Length: {len(body)}",
+            "Connection: close"]
+    head += [f"{k}: {v}" for k, v in (headers or {}).items()]
+    writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+
+
+async def handle_search(batcher: MicroBatcher, body: bytes) -> Tuple[int, dict, Optional[Dict[str, str]]]:
+    t0 = time.monotonic()
+    try:
+        req = json.loads(body or b"{}")
+        query = str(req["query"]).strip()
+        if not query:
+            raise ValueError("empty query")
+        k = int(req.get("k", SETTINGS.top_k))
+        timeout_s = float(req.get("timeout_ms", SETTINGS.service_default_timeout_ms)) / 1000.0
+    except (ValueError, KeyError, TypeError) as e:
+        return 400, {"error": f"bad request: {e}"}, None
+
+    try:
+        fut = batcher.submit(query, k, req.get("doc_filter"), req.get("section_filter"), timeout_s)
+    except asyncio.QueueFull:
+        return 429, {"error": "queue full"}, {"Retry-After": "1"}
+
+    try:
+        hits, batch_size, queue_ms = await asyncio.wait_for(fut, timeout_s)
+    except asyncio.TimeoutError:
+        batcher.stats["timeouts"] += 1
+        return 504, {"error": "deadline exceeded"}, None
+
+    return 200, {
+        "results": [{"score": s, "chunk": c.model_dump()} for s, c in hits],
+        "batch_size": batch_size,
+        "queue_ms": round(queue_ms, 2),
+        "total_ms": round((time.monotonic() - t0) * 1000, 2),
+    }, None
+
+
+def make_handler(batcher: MicroBatcher):
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            method, path, body = await read_request(reader)
+            headers = None
+            if method == "POST" and path == "/search":
+                status, payload, headers = await handle_search(batcher, body)
+            elif method == "GET" and path == "/healthz":
+                status, payload = 200, {"ok": True, "n_chunks": len(batcher.hot.current[1]),
+                                        "index_dir": str(batcher.index_dir), "version": batcher.hot.version}
+            elif method == "GET" and path == "/stats":
+                from app.lexical import HYBRID_STATS
+                from app.rerank import rerank_stats
+                from app.result_cache import result_cache_stats
+                status, payload = 200, {**batcher.stats, "queue_depth": batcher.queue.qsize(),
+                                        "index": batcher.hot.stats(), **batcher.embedder.cache_stats(),
+                                        "result_cache": result_cache_stats(), "rerank": rerank_stats(),
+                                        "hybrid": HYBRID_STATS.snapshot() if batcher.hot.current[4] is not None else None}
+            else:
+                status, payload = 404, {"error": f"no route for {method} {path}"}
+        except (ValueError, asyncio.IncompleteReadError) as e:
+            status, payload, headers = 400, {"error": f"bad request: {e}"}, None
+        except Exception as e:
+            status, payload, headers = 500, {"error": f"{type(e).__name__}: {e}"}, None
+        try:
+            write_response(writer, status, payload, headers)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    return handle
+
+
+async def serve(host: str, port: int, index_dir: Path, model_name: str) -> None:
+    batcher = MicroBatcher(index_dir, model_name)
+    worker = asyncio.create_task(batcher.run())
+    server = await asyncio.start_server(make_handler(batcher), host, port)
+    print(f"Retrieval service on http://{host}:{port} ({len(batcher.hot.current[1])} chunks, "
+          f"version {batcher.hot.version or 'unversioned'})", flush=True)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        worker.cancel()
+        batcher.hot.close()
+
+
+# -------------------------
+# Client (used by the Streamlit app)
+# -------------------------
+
+def search_remote(
+    url: str,
+    query: str,
+    k: int,
+    doc_filter: Optional[str] = None,
+    section_filter: Optional[str] = None,
+    timeout_ms: Optional[int] = None,
+) -> List[Tuple[float, Chunk]]:
+    payload = {"query": query, "k": k, "doc_filter": doc_filter, "section_filter": section_filter}
+    if timeout_ms is not None:
+        payload["timeout_ms"] = timeout_ms
+    req = urllib.request.Request(
+        url.rstrip("/") + "/search",
+        data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    http_timeout = (timeout_ms or SETTINGS.service_default_timeout_ms) / 1000.0 + 5.0
+    try:
+        with urllib.request.urlopen(req, timeout=http_timeout) as resp:
+            data = json.loads(resp.read())
+    except urllib.error.HTTPError as e:
+        detail = json.loads(e.read() or b"{}").get("error", e.reason)
+        raise RuntimeError(f"Retrieval service returned {e.code}: {detail}") from None
+    return [(float(r["score"]), Chunk(**r["chunk"])) for r in data["results"]]
+
+
+def main():
+    import argparse
+    ap = argparse.ArgumentParser(description="Micro-batching HTTP retrieval service")
+    ap.add_argument("--host", default=SETTINGS.service_host)
+    ap.add_argument("--port", type=int, default=SETTINGS.service_port)
+    ap.add_argument("--index-dir", type=Path, default=SETTINGS.index_dir)
+    ap.add_argument("--model", default=SETTINGS.embedding_model_name)
+    args = ap.parse_args()
+    asyncio.run(serve(args.host, args.port, args.index_dir, args.model))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+app/shards.py
+
+Sharded indexes. With SETTINGS.shard_by = "family" or "hash", chunks are split
+by doc_id into <version>/shards/<name>/ (<version> being the published build
+directory, see app/versions.py), each a complete index directory of its own
+(faiss.index, vectors.npy, meta.jsonl, meta/, filters.npz, manifest.json).
+`python -m app.index_faiss --shard <name>` rebuilds one shard into a new
+version and hard-links the others unchanged from the previous one.
+
+The version directory keeps the global view: meta, filters.npz and
+lexical.npz over all chunks in shard order, and a manifest listing each shard
+with its row offset. Row r of shard s is global row offset[s] + r, so meta[i],
+the filter bitmaps and BM25 rows work exactly as for a single index.
+
+ShardedIndex fans a search out over the shards on a thread pool (faiss releases
+the GIL while searching) and merges the per-shard top-k into the exact global
+top-k.
+"""
+
+import os
+import re
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.config import SETTINGS
+from app.filters import FilteredIndex, pack, search_params, with_exact_filter
+from app.models import Chunk
+from app.rescore import unwrap, with_rescore
+from app.versions import read_manifest, resolve
+
+
+MISSING_SCORE = -np.finfo("float32").max  # what faiss reports for an empty inner-product slot
+
+
+def shard_of(doc_id: str, shard_by: Optional[str] = None, n_shards: Optional[int] = None) -> str:
+    """
+    Shard name for a doc_id. "family" drops the trailing id segment
+    ("sop-tc-006" → "sop-tc", "pio-1234" → "pio"), so each site's library is
+    one shard; "hash" spreads documents over n_shards by CRC32.
+    A document never spans shards, so a doc_id filter only ever hits one.
+    """
+    shard_by = shard_by or SETTINGS.shard_by
+    if shard_by == "family":
+        family = doc_id.rsplit("-", 1)[0] if "-" in doc_id else doc_id
+        return re.sub(r"[^A-Za-z0-9_.-]+", "_", family)
+    if shard_by == "hash":
+        n_shards = n_shards or SETTINGS.n_shards
+        return f"h{zlib.crc32(doc_id.encode('utf-8')) % n_shards:03d}"
+    raise SystemExit(f"Unknown shard_by {shard_by!r} (expected none | family | hash)")
+
+
+def partition(chunks: List[Chunk]) -> Dict[str, List[Chunk]]:
+    """Chunks per shard name (sorted by name; chunk order kept within a shard)."""
+    parts: Dict[str, List[Chunk]] = {}
+    for c in chunks:
+        parts.setdefault(shard_of(c.doc_id), []).append(c)
+    return dict(sorted(parts.items()))
+
+
+def shard_dir(index_dir: Path, name: str) -> Path:
+    return Path(index_dir) / "shards" / name
+
+
+class ShardedIndex:
+    """A faiss-like index over several shard indexes with one global id space."""
+
+    def __init__(self, names: List[str], indexes: List, threads: int = 0):
+        self.names = names
+        self.shards = indexes
+        self.offsets = np.zeros(len(indexes) + 1, dtype="int64")
+        np.cumsum([ix.ntotal for ix in indexes], out=self.offsets[1:])
+        self.ntotal = int(self.offsets[-1])
+        self.d = indexes[0].d
+        self.metric_type = indexes[0].metric_type
+        threads = threads or min(len(indexes), os.cpu_count() or 1)
+        self._pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="shard") if threads > 1 else None
+
+    def _search_shard(self, s: int, Q: np.ndarray, k: int, mask: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        index = self.shards[s]
+        lo, hi = int(self.offsets[s]), int(self.offsets[s + 1])
+        params = keep = None
+        if mask is None:
+            k_s = min(k, hi - lo)
+        else:
+            local = mask[lo:hi]
+            k_s = min(k, int(local.sum()))
+            if k_s > 0 and isinstance(index, FilteredIndex):
+                return self._found(*index.search(Q, k_s, bits=pack(local)), lo)
+            if k_s > 0:
+                params, keep = search_params(pack(local), hi - lo, unwrap(index))  # keep: selector's buffer
+        if k_s <= 0:
+            return np.zeros((len(Q), 0), dtype="float32"), np.zeros((len(Q), 0), dtype="int64")
+        return self._found(*index.search(Q, k_s, params=params), lo)
+
+    @staticmethod
+    def _found(D: np.ndarray, I: np.ndarray, lo: int) -> Tuple[np.ndarray, np.ndarray]:
+        found = I >= 0
+        return np.where(found, D, MISSING_SCORE).astype("float32"), np.where(found, I + lo, -1)
+
+    def search(self, Q: np.ndarray, k: int, bits: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k over every shard, optionally restricted to the global rows set in the
+        packed bitmap `bits`. Returns (scores, global row ids) like faiss, padded
+        with -1 ids when fewer than k rows qualify.
+        """
+        Q = np.ascontiguousarray(Q, dtype="float32")
+        mask = np.unpackbits(bits, count=self.ntotal, bitorder="little").astype(bool) if bits is not None else None
+        jobs = range(len(self.shards))
+        if self._pool is None:
+            parts = [self._search_shard(s, Q, k, mask) for s in jobs]
+        else:
+            parts = list(self._pool.map(lambda s: self._search_shard(s, Q, k, mask), jobs))
+
+        D = np.hstack([p[0] for p in parts])
+        I = np.hstack([p[1] for p in parts])
+        # Each shard returned its exact top-k, so the global top-k is among them
+        order = np.argsort(-D, axis=1, kind="stable")[:, :k]
+        D = np.take_along_axis(D, order, axis=1)
+        I = np.take_along_axis(I, order, axis=1)
+        if I.shape[1] < k:
+            pad = k - I.shape[1]
+            D = np.hstack([D, np.full((len(Q), pad), MISSING_SCORE, dtype="float32")])
+            I = np.hstack([I, np.full((len(Q), pad), -1, dtype="int64")])
+        return D, I
+
+
+def load_sharded(index_dir: Path, manifest: dict) -> ShardedIndex:
+    import faiss
+
+    names: List[str] = []
+    indexes = []
+    for entry in manifest["shards"]:
+        d = shard_dir(index_dir, entry["name"])
+        index = with_filter_vectors(with_rescore(faiss.read_index(str(d / "faiss.index")), d, read_manifest(d)), d)
+        if index.ntotal != entry["n_chunks"]:
+            raise RuntimeError(f"Shard {entry['name']} has {index.ntotal} rows, manifest says {entry['n_chunks']}; "
+                               f"rerun python -m app.index_faiss --shard {entry['name']}")
+        names.append(entry["name"])
+        indexes.append(index)
+    return ShardedIndex(names, indexes, SETTINGS.shard_search_threads)
+
+
+def load_search_index(index_dir: Path, manifest: Optional[dict] = None):
+    """
+    The index readers search: a ShardedIndex for sharded builds, else faiss.index
+    (re-scored if lossy, exact fallback for filters on HNSW / IVF, behind centroid
+    routing with SETTINGS.coarse_fanout).
+    """
+    import faiss
+    from app.coarse import with_coarse
+
+    index_dir = resolve(index_dir)
+    manifest = read_manifest(index_dir) if manifest is None else manifest
+    if manifest.get("shards"):
+        return load_sharded(index_dir, manifest)
+    index = with_rescore(faiss.read_index(str(index_dir / "faiss.index")), index_dir, manifest)
+    return with_coarse(with_filter_vectors(index, index_dir), index_dir)
+
+
+def with_filter_vectors(index, index_dir: Path):
+    """FilteredIndex (exact fallback from the memory-mapped vectors.npy) for HNSW / IVF builds."""
+    vectors_path = Path(index_dir) / "vectors.npy"
+    return with_exact_filter(index, np.load(vectors_path, mmap_mode="r") if vectors_path.exists() else None)
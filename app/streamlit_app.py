@@ -1,6 +1,5 @@
-import json
+import time
 from pathlib import Path
-from typing import List, Optional, Tuple
 
 import numpy as np
 import streamlit as st
@@ -14,7 +13,12 @@ except Exception as e:
 from app.config import SETTINGS
 from app.embedder import Embedder
 from app.models import Chunk
-from app.utils import read_jsonl
+from app.query_log import log_query
+from app.registry import index_key, load_embedder, load_index, model_key, shared_registry
+from app.result_cache import result_cache_stats
+from app.retrieval import search
+from app.service import search_remote
+from app.tracing import span
 
 
 # ---------- helpers ----------
@@ -27,67 +31,28 @@ def format_citation(c: Chunk) -> str:
     return f"{c.doc_id} • {c.section}{sub}{step_part} (L{c.line_start}–L{c.line_end})"
 
 
-def load_manifest(index_dir: Path) -> dict:
-    p = index_dir / "manifest.json"
-    if not p.exists():
-        return {}
-    return json.loads(p.read_text(encoding="utf-8"))
+# Indexes and models live in a process-wide registry (app/registry.py) instead of
+# st.cache_resource: it is shared by every session, bounded by
+# SETTINGS.registry_budget_mb, and evicts least recently used entries nobody is using.
+registry = shared_registry()
 
 
-@st.cache_resource
-def load_index_and_meta(index_dir_str: str) -> Tuple["faiss.Index", List[Chunk], dict]:
-    index_dir = Path(index_dir_str)
-    faiss_path = index_dir / "faiss.index"
-    meta_path = index_dir / "meta.jsonl"
+def show_registry_stats() -> None:
+    stats = registry.stats()
+    st.caption(f"{stats['resident_mb']} / {stats['budget_mb']} MB resident"
+               f"{' (over budget: all entries in use)' if stats['over_budget'] else ''} · "
+               f"{stats['loads']} loads · {stats['evictions']} evictions")
+    if stats["entries"]:
+        st.dataframe(stats["entries"], hide_index=True)
 
-    if not faiss_path.exists() or not meta_path.exists():
-        raise FileNotFoundError(
-            f"Missing index files. Expected:\n- {faiss_path}\n- {meta_path}\n"
-            f"Run: python -m app.index_faiss"
-        )
-
-    index = faiss.read_index(str(faiss_path))
-    meta = [Chunk(**row) for row in read_jsonl(meta_path)]
-    manifest = load_manifest(index_dir)
-    return index, meta, manifest
-
-
-@st.cache_resource
-def load_embedder(model_name: str) -> Embedder:
-    return Embedder(model_name)
-
-
-def search(
-    index: "faiss.Index",
-    meta: List[Chunk],
-    embedder: Embedder,
-    query: str,
-    k: int,
-    doc_filter: Optional[str] = None,
-    section_filter: Optional[str] = None,
-) -> List[Tuple[float, Chunk]]:
-    q = embedder.embed_query(query).reshape(1, -1).astype("float32")
 
-    # Over-retrieve then filter (simple and robust)
-    over_k = min(max(k * 5, k), len(meta))
-    scores, idxs = index.search(q, over_k)
-
-    results: List[Tuple[float, Chunk]] = []
-    for s, i in zip(scores[0].tolist(), idxs[0].tolist()):
-        c = meta[int(i)] 
-
-        if doc_filter and c.doc_id != doc_filter: 
-            continue
-        if section_filter and c.section != section_filter: 
-            continue
-
-        if len(c.text.strip()) < 80:  # skip short chunks
-            continue
-        results.append((float(s), c))
-        if len(results) >= k:
-            break
-
-    return results
+def show_result_cache_stats() -> None:
+    stats = result_cache_stats()
+    if stats is None:
+        st.caption("Result cache disabled (result_cache_size = 0)")
+        return
+    st.caption(f"{stats['size']} / {stats['max_size']} cached searches · hit ratio {stats['hit_ratio']:.0%} "
+               f"({stats['hits']} exact, {stats['semantic_hits']} semantic) · {stats['saved_ms'] / 1000:.1f}s saved")
 
 
 # ---------- UI ----------
@@ -102,91 +67,155 @@ with st.sidebar:
     index_dir = st.text_input("Index directory", value=str(SETTINGS.index_dir))
     model_name = st.text_input("Embedding model", value=SETTINGS.embedding_model_name)
     top_k = st.slider("Top-k", min_value=1, max_value=20, value=SETTINGS.top_k)
+    service_url = st.text_input(
+        "Retrieval service URL (optional)", value="",
+        help="e.g. http://127.0.0.1:8765 — run `python -m app.service`. Empty = search in this process.",
+    ).strip()
 
     st.divider()
     st.header("Filters")
     # We populate filter dropdowns after loading metadata
-    load_btn = st.button("Reload index (if you rebuilt)")
+    load_btn = st.button("Check for a new index version")
+
+# Load resources (leased from the registry for this script run; released at the end).
+# The index entry is a HotIndex: new published versions are loaded in the background and
+# swapped in, and this run keeps the one snapshot it took here.
+ikey, mkey = index_key(index_dir), model_key(model_name)
 
-# Load resources
-try:
-    if load_btn:
-        load_index_and_meta.clear()
-        load_embedder.clear()
 
-    index, meta, manifest = load_index_and_meta(index_dir)
-    embedder = load_embedder(model_name)
+def acquire_index():
+    return registry.acquire("index", ikey, lambda: load_index(
+        Path(index_dir), on_resize=lambda h, nbytes, detail: registry.resize("index", ikey, h, nbytes, detail)))
+
+
+leased = False
+try:
+    hot = acquire_index()
+    leased = True
+    if load_btn and not hot.refresh() and hot.version is None:
+        # unversioned index_dir: nothing to poll, so reload this one entry in place
+        registry.release("index", ikey, hot)
+        leased = False
+        registry.invalidate("index", ikey)
+        hot = acquire_index()
+        leased = True
+    index, meta, bitmaps, manifest, lexical = hot.current
 except Exception as e:
+    if leased:
+        registry.release("index", ikey, hot)
+    st.error(str(e))
+    st.stop()
+try:
+    embedder: Embedder = registry.acquire("model", mkey, lambda: load_embedder(model_name))
+except Exception as e:
+    registry.release("index", ikey, hot)
     st.error(str(e))
     st.stop()
 
-# Build filter options
-doc_ids = sorted({c.doc_id for c in meta})
-sections = sorted({c.section for c in meta})
+try:
+    # Build filter options (facet counts come from the same bitmaps the search uses)
+    with st.sidebar:
+        doc_counts = bitmaps.facet_counts("doc_id")
+        doc_filter = st.selectbox(
+            "Doc filter (optional)",
+            options=["(all)"] + bitmaps.doc_ids,
+            index=0,
+            format_func=lambda d: f"(all) ({bitmaps.count()})" if d == "(all)" else f"{d} ({doc_counts[d]})",
+        )
+        doc_filter_val = None if doc_filter == "(all)" else doc_filter
+
+        section_counts = bitmaps.facet_counts("section", doc_id=doc_filter_val)
+        section_filter = st.selectbox(
+            "Section filter (optional)",
+            options=["(all)"] + bitmaps.sections,
+            index=0,
+            format_func=lambda s: f"(all) ({bitmaps.count(doc_filter_val)})" if s == "(all)" else f"{s} ({section_counts[s]})",
+        )
 
-with st.sidebar:
-    doc_filter = st.selectbox("Doc filter (optional)", options=["(all)"] + doc_ids, index=0)
-    section_filter = st.selectbox("Section filter (optional)", options=["(all)"] + sections, index=0)
-
-doc_filter_val = None if doc_filter == "(all)" else doc_filter
-section_filter_val = None if section_filter == "(all)" else section_filter
-
-# Main query input
-default_q = "How do I do counting with trypan blue and ensure consistency?"
-query_text = st.text_area("Ask a question", value=default_q, height=80)
-
-col_a, col_b, col_c = st.columns([1, 1, 2])
-with col_a:
-    run = st.button("Search", type="primary")
-with col_b:
-    show_raw = st.checkbox("Show raw chunk text", value=True)
-with col_c:
-    st.write("")
-
-# Show manifest details
-with st.expander("Index info"):
-    st.write({
-        "n_chunks": manifest.get("n_chunks", len(meta)),
-        "dim": manifest.get("dim", "unknown"),
-        "embedding_model": manifest.get("embedding_model", model_name),
-        "faiss_index": manifest.get("faiss_index", str(Path(index_dir) / "faiss.index")),
-        "meta": manifest.get("meta", str(Path(index_dir) / "meta.jsonl")),
-    })
-
-if run:
-    q = query_text.strip()
-    if not q:
-        st.warning("Type a query first.")
-        st.stop()
-
-    results = search(
-        index=index,
-        meta=meta,
-        embedder=embedder,
-        query=q,
-        k=top_k,
-        doc_filter=doc_filter_val,
-        section_filter=section_filter_val,
-    )
-
-    if not results:
-        st.info("No results matched your filters. Try removing filters or increasing top-k.")
-        st.stop()
-
-    st.subheader(f"Top results ({len(results)})")
-
-    for rank, (score, chunk) in enumerate(results, start=1):
-        left, right = st.columns([3, 2])
-        with left:
-            st.markdown(f"### #{rank}")
-            st.markdown(f"**Citation:** {format_citation(chunk)}")
-            st.markdown(f"**Source:** `{chunk.source_path}`")
-        with right:
-            st.metric("Similarity", f"{score:.4f}")
-            st.code(chunk.chunk_id, language="text")
-
-        if show_raw:
-            with st.expander("Chunk text", expanded=(rank == 1)):
-                st.text(chunk.text)
-
-        st.divider()
+        with st.expander("Resident indexes & models"):
+            show_registry_stats()
+            show_result_cache_stats()
+
+    section_filter_val = None if section_filter == "(all)" else section_filter
+
+    # Main query input
+    default_q = "How do I do counting with trypan blue and ensure consistency?"
+    query_text = st.text_area("Ask a question", value=default_q, height=80)
+
+    col_a, col_b, col_c = st.columns([1, 1, 2])
+    with col_a:
+        run = st.button("Search", type="primary")
+    with col_b:
+        show_raw = st.checkbox("Show raw chunk text", value=True)
+    with col_c:
+        st.write("")
+
+    # Show manifest details
+    with st.expander("Index info"):
+        st.write({
+            "version": hot.version or "(unversioned)",
+            "n_chunks": manifest.get("n_chunks", len(meta)),
+            "dim": manifest.get("dim", "unknown"),
+            "embedding_model": manifest.get("embedding_model", model_name),
+            "faiss_index": manifest.get("faiss_index", str(Path(index_dir) / "faiss.index")),
+            "meta": manifest.get("meta", str(Path(index_dir) / "meta.jsonl")),
+        })
+
+    if run:
+        q = query_text.strip()
+        if not q:
+            st.warning("Type a query first.")
+            st.stop()
+
+        t0 = time.perf_counter()
+        mode = "service" if service_url else "in-process"
+        if service_url:
+            try:
+                results = search_remote(service_url, q, top_k, doc_filter_val, section_filter_val)
+            except Exception as e:
+                log_query("streamlit", mode, q, top_k, doc_filter_val, section_filter_val,
+                          (time.perf_counter() - t0) * 1000, error=str(e))
+                st.error(f"Retrieval service error: {e}")
+                st.stop()
+        else:
+            results = search(
+                index=index,
+                meta=meta,
+                bitmaps=bitmaps,
+                embedder=embedder,
+                query=q,
+                k=top_k,
+                doc_filter=doc_filter_val,
+                section_filter=section_filter_val,
+                lexical=lexical,
+                manifest=manifest,
+            )
+        log_query("streamlit", mode, q, top_k, doc_filter_val, section_filter_val,
+                  (time.perf_counter() - t0) * 1000, len(results))
+
+        if not results:
+            st.info("No results matched your filters. Try removing filters or increasing top-k.")
+            st.stop()
+
+        st.subheader(f"Top results ({len(results)})")
+
+        with span("render", n=len(results)):
+            for rank, (score, chunk) in enumerate(results, start=1):
+                left, right = st.columns([3, 2])
+                with left:
+                    st.markdown(f"### #{rank}")
+                    st.markdown(f"**Citation:** {format_citation(chunk)}")
+                    st.markdown(f"**Source:** `{chunk.source_path}`")
+                with right:
+                    # hybrid mode scores are BM25 (lexical fast path) or RRF, not cosine similarity
+                    st.metric("Similarity" if lexical is None else "Score", f"{score:.4f}")
+                    st.code(chunk.chunk_id, language="text")
+
+                if show_raw:
+                    with st.expander("Chunk text", expanded=(rank == 1)):
+                        st.text(chunk.text)
+
+                st.divider()
+finally:
+    registry.release("index", ikey, hot)
+    registry.release("model", mkey, embedder)
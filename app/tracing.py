@@ -0,0 +1,269 @@
+"""
+app/tracing.py
+
+Lightweight span tracing. Instrumented code wraps a stage in
+
+    with span("search.faiss", k=k) as attrs:
+        ...
+        attrs["hits"] = len(hits)   # attributes can be added before the span ends
+
+and every finished span is appended as one JSON line to
+<logs_dir>/spans.jsonl: name, start time, duration, trace / span / parent ids
+(spans opened inside another span on the same thread are its children), pid
+and the attributes. memory() records the resident size of a component (model,
+index, meta, ...) when it is loaded.
+
+The file is rotated at SETTINGS.trace_max_mb (spans.jsonl.1, .2, ... up to
+SETTINGS.trace_backups). The service, the daemon, Streamlit and CLI runs may
+all write to it; appends and rotation are serialized across processes with an
+flock on .spans.jsonl.lock, and a writer whose file was rotated away by
+another process reopens the new one. SETTINGS.tracing = False turns span() into a no-op.
+Only the standard library is used, so importing this stays cheap.
+
+  python -m app.tracing [--top 10] [--last-minutes 60]   # p50/p95 per stage, memory, slowest queries
+"""
+
+import fcntl
+import itertools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from app.config import SETTINGS
+
+
+SPANS_FILE = "spans.jsonl"
+
+
+class RotatingJsonlWriter:
+    """
+    Appends JSON lines to one file and rotates it by size; safe to use from
+    several threads and processes (an flock on a sibling .lock file).
+    """
+
+    def __init__(self, path: Path, max_bytes: int, backups: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._f = None
+        self._lock_f = None
+        self._lock = threading.Lock()
+
+    def write(self, record: Dict[str, Any]) -> None:
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            if self._lock_f is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._lock_f = self.path.with_name(f".{self.path.name}.lock").open("a")
+            fcntl.flock(self._lock_f, fcntl.LOCK_EX)
+            try:
+                self._reopen_if_moved()
+                self._f.write(line)
+                self._f.flush()
+                if os.fstat(self._f.fileno()).st_size >= self.max_bytes:
+                    self._rotate()
+            finally:
+                fcntl.flock(self._lock_f, fcntl.LOCK_UN)
+
+    def _reopen_if_moved(self) -> None:
+        """Open the file, or reopen it if another process rotated it away. Caller holds the flock."""
+        if self._f is not None:
+            try:
+                if os.stat(self.path).st_ino == os.fstat(self._f.fileno()).st_ino:
+                    return
+            except FileNotFoundError:
+                pass
+            self._f.close()
+        self._f = self.path.open("a", encoding="utf-8")
+
+    def _rotate(self) -> None:
+        self._f.close()
+        self._f = None
+        if self.backups <= 0:
+            self.path.unlink(missing_ok=True)
+            return
+        for i in range(self.backups - 1, 0, -1):
+            older = self.path.with_name(f"{self.path.name}.{i}")
+            if older.exists():
+                os.replace(older, self.path.with_name(f"{self.path.name}.{i + 1}"))
+        os.replace(self.path, self.path.with_name(f"{self.path.name}.1"))
+
+
+_WRITER: Optional[RotatingJsonlWriter] = None
+_WRITER_LOCK = threading.Lock()
+_IDS = itertools.count(1)
+_LOCAL = threading.local()
+
+
+def writer() -> RotatingJsonlWriter:
+    global _WRITER
+    with _WRITER_LOCK:
+        if _WRITER is None:
+            _WRITER = RotatingJsonlWriter(SETTINGS.logs_dir / SPANS_FILE, SETTINGS.trace_max_mb * 2**20, SETTINGS.trace_backups)
+        return _WRITER
+
+
+def _stack() -> List[str]:
+    stack = getattr(_LOCAL, "stack", None)
+    if stack is None:
+        stack = _LOCAL.stack = []
+    return stack
+
+
+@contextmanager
+def span(name: str, **attrs: Any) -> Iterator[Dict[str, Any]]:
+    if not SETTINGS.tracing:
+        yield attrs
+        return
+    stack = _stack()
+    span_id = f"{os.getpid():x}.{next(_IDS):x}"
+    parent = stack[-1] if stack else None
+    trace = getattr(_LOCAL, "trace", None) if parent else span_id
+    if parent is None:
+        _LOCAL.trace = span_id
+    stack.append(span_id)
+    start = time.time()
+    t0 = time.perf_counter()
+    error = None
+    try:
+        yield attrs
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        ms = (time.perf_counter() - t0) * 1000
+        stack.pop()
+        row = {"type": "span", "name": name, "ts": round(start, 6), "ms": round(ms, 3),
+               "trace": trace, "span": span_id, "parent": parent, "pid": os.getpid(), **attrs}
+        if error:
+            row["error"] = error
+        writer().write(row)
+
+
+def record(name: str, ms: float, **attrs: Any) -> None:
+    """A span measured elsewhere (e.g. in a worker process), recorded under the current span."""
+    if not SETTINGS.tracing:
+        return
+    stack = _stack()
+    parent = stack[-1] if stack else None
+    span_id = f"{os.getpid():x}.{next(_IDS):x}"
+    writer().write({"type": "span", "name": name, "ts": round(time.time() - ms / 1000, 6), "ms": round(ms, 3),
+                    "trace": getattr(_LOCAL, "trace", None) if parent else span_id, "span": span_id,
+                    "parent": parent, "pid": os.getpid(), **attrs})
+
+
+def memory(component: str, nbytes: int, **attrs: Any) -> None:
+    """Resident size of a loaded component (model, index, meta, filters, lexical)."""
+    if not SETTINGS.tracing:
+        return
+    writer().write({"type": "memory", "component": component, "ts": round(time.time(), 6),
+                    "bytes": int(nbytes), "pid": os.getpid(), **attrs})
+
+
+# -------------------------
+# Summary
+# -------------------------
+
+def read_rotated(path: Path) -> Iterator[Dict[str, Any]]:
+    """Every record in a RotatingJsonlWriter file and its rotated backups, oldest file first."""
+    path = Path(path)
+    backups = sorted(path.parent.glob(f"{path.name}.*"), key=lambda p: -int(p.suffix[1:]) if p.suffix[1:].isdigit() else 0)
+    for p in backups + [path]:
+        if not p.exists():
+            continue
+        with p.open(encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # a line cut short by a crash or a concurrent rotation
+
+
+def read_records(logs_dir: Path) -> Iterator[Dict[str, Any]]:
+    return read_rotated(Path(logs_dir) / SPANS_FILE)
+
+
+def quantile(sorted_ms: List[float], q: float) -> float:
+    return sorted_ms[min(len(sorted_ms) - 1, int(q * len(sorted_ms)))]
+
+
+def summarize(records: List[Dict[str, Any]], top: int = 10) -> Dict[str, Any]:
+    spans = [r for r in records if r.get("type") == "span"]
+    by_name: Dict[str, List[float]] = {}
+    for s in spans:
+        by_name.setdefault(s["name"], []).append(s["ms"])
+    stages = {}
+    for name, ms in sorted(by_name.items()):
+        ms.sort()
+        stages[name] = {"count": len(ms), "p50_ms": round(quantile(ms, 0.5), 3), "p95_ms": round(quantile(ms, 0.95), 3),
+                        "max_ms": round(ms[-1], 3), "total_s": round(sum(ms) / 1000, 3)}
+
+    memory_now: Dict[str, Dict[str, Any]] = {}
+    for r in records:
+        if r.get("type") == "memory":
+            memory_now[r["component"]] = r  # latest wins
+
+    children: Dict[str, List[Dict[str, Any]]] = {}
+    for s in spans:
+        if s.get("parent"):
+            children.setdefault(s["parent"], []).append(s)
+    queries = sorted((s for s in spans if s["name"] in ("search", "retriever.search") and "query" in s),
+                     key=lambda s: -s["ms"])[:top]
+    slowest = []
+    for s in queries:
+        breakdown: Dict[str, float] = {}
+        todo = list(children.get(s["span"], []))
+        while todo:  # self time (minus its own children) of every descendant, summed by stage name
+            c = todo.pop()
+            nested = children.get(c["span"], [])
+            own = c["ms"] - sum(n["ms"] for n in nested)
+            breakdown[c["name"]] = round(breakdown.get(c["name"], 0.0) + own, 3)
+            todo.extend(nested)
+        slowest.append({"ms": s["ms"], "query": s["query"], "ts": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(s["ts"])),
+                        "stages": breakdown})
+    return {"n_spans": len(spans), "stages": stages, "memory": memory_now, "slowest_queries": slowest}
+
+
+def main():
+    import argparse
+    ap = argparse.ArgumentParser(description="Per-stage latency, memory and slowest queries from traced spans")
+    ap.add_argument("--logs-dir", type=Path, default=SETTINGS.logs_dir)
+    ap.add_argument("--top", type=int, default=10, help="Slowest queries to list")
+    ap.add_argument("--last-minutes", type=float, default=0, help="Only spans from the last N minutes (0 = all)")
+    ap.add_argument("--json", action="store_true", help="Print the summary as JSON")
+    args = ap.parse_args()
+
+    records = list(read_records(args.logs_dir))
+    if args.last_minutes > 0:
+        cutoff = time.time() - args.last_minutes * 60
+        records = [r for r in records if r.get("ts", 0) >= cutoff]
+    summary = summarize(records, args.top)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+    if not records:
+        print(f"No spans in {args.logs_dir / SPANS_FILE}")
+        return
+
+    print(f"{summary['n_spans']} spans from {args.logs_dir / SPANS_FILE}\n")
+    print(f"{'stage':<28} {'count':>7} {'p50 ms':>10} {'p95 ms':>10} {'max ms':>10} {'total s':>9}")
+    for name, s in summary["stages"].items():
+        print(f"{name:<28} {s['count']:>7} {s['p50_ms']:>10.2f} {s['p95_ms']:>10.2f} {s['max_ms']:>10.2f} {s['total_s']:>9.2f}")
+    if summary["memory"]:
+        print("\nMemory (latest load):")
+        for component, r in summary["memory"].items():
+            extra = ", ".join(f"{k}={v}" for k, v in r.items() if k not in ("type", "component", "ts", "bytes", "pid"))
+            print(f"  {component:<10} {r['bytes'] / 2**20:>9.1f} MB  {extra}")
+    if summary["slowest_queries"]:
+        print("\nSlowest queries:")
+        for q in summary["slowest_queries"]:
+            parts = ", ".join(f"{k} {v:.1f}" for k, v in sorted(q["stages"].items(), key=lambda kv: -kv[1]))
+            print(f"  {q['ms']:>9.1f} ms  {q['ts']}  {q['query'][:60]!r}  [{parts}]")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,13 @@
 import hashlib
 import json
+import os
 import subprocess
+from collections import deque
 from pathlib import Path
-from typing import Iterable, Dict, Any, Optional
+from typing import Callable, Iterable, Iterator, Dict, Any, Optional, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
 
 
 def get_git_sha() -> Optional[str]:
@@ -32,3 +37,27 @@ def read_jsonl(path: Path) -> Iterable[Dict[str, Any]]:
             if not line:
                 continue
             yield json.loads(line)
+
+
+def bounded_imap(fn: Callable[[T], R], items: Iterable[T], workers: int = 0, max_in_flight: int = 0) -> Iterator[R]:
+    """
+    Ordered map of fn over items in a process pool, with at most max_in_flight
+    tasks submitted ahead of the consumer, so a lazy input is never materialized.
+    workers=0 uses every CPU; workers=1 runs inline (no pool). fn must be picklable.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1:
+        yield from map(fn, items)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    max_in_flight = max_in_flight or 4 * workers
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        pending: deque = deque()
+        for item in items:
+            pending.append(ex.submit(fn, item))
+            if len(pending) >= max_in_flight:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
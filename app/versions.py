@@ -0,0 +1,322 @@
+"""
+app/versions.py
+
+Versioned index publishing and hot swap.
+
+Every build of app.index_faiss goes into its own directory,
+<index_dir>/versions/<version>/, which is never modified after publication.
+<index_dir>/CURRENT holds the name of the live version and is replaced
+atomically (write a temp file, os.replace), so a reader sees either the old
+version or the new one, never a mix. A version is complete once its
+manifest.json carries "checksums" (sha256 of every other file in it); only
+complete versions are ever pointed to.
+
+An index_dir without CURRENT is read as a plain (pre-versioning) index
+directory, so older builds keep working.
+
+Readers that stay up (daemon, HTTP service, Streamlit) hold a HotIndex: it
+polls CURRENT in a background thread, loads a new version next to the old one,
+and swaps a single reference once loading has finished. Each request reads
+that reference once, so it uses one consistent (index, meta, bitmaps,
+manifest, lexical) bundle from start to end.
+
+  python -m app.versions                 # list versions
+  python -m app.versions --verify [V]    # re-check checksums (default: current)
+  python -m app.versions --use V         # point CURRENT at V (rollback)
+  python -m app.versions --prune         # drop old versions beyond SETTINGS.index_keep_versions
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app.config import SETTINGS
+
+
+CURRENT = "CURRENT"
+VERSIONS = "versions"
+
+
+# -------------------------
+# Layout
+# -------------------------
+
+def current_version(index_dir: Path) -> Optional[str]:
+    p = Path(index_dir) / CURRENT
+    try:
+        return p.read_text(encoding="utf-8").strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def resolve(index_dir: Path) -> Path:
+    """The directory holding the live build: versions/<CURRENT>, or index_dir itself for unversioned builds."""
+    index_dir = Path(index_dir)
+    version = current_version(index_dir)
+    return index_dir / VERSIONS / version if version else index_dir
+
+
+def new_version_dir(index_dir: Path) -> Path:
+    """A fresh, empty version directory; invisible to readers until publish() points CURRENT at it."""
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    d = Path(index_dir) / VERSIONS / name
+    d.mkdir(parents=True)
+    return d
+
+
+def link_tree(src: Path, dst: Path) -> None:
+    """Hard-link (copy where links fail) an already-published directory into a new version."""
+    for p in sorted(src.rglob("*")):
+        target = dst / p.relative_to(src)
+        if p.is_dir():
+            target.mkdir(parents=True, exist_ok=True)
+            continue
+        target.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(p, target)
+        except OSError:
+            shutil.copy2(p, target)
+
+
+# -------------------------
+# Checksums
+# -------------------------
+
+def file_sha256(path: Path, block: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        while True:
+            data = f.read(block)
+            if not data:
+                break
+            h.update(data)
+    return h.hexdigest()
+
+
+def checksums(version_dir: Path) -> Dict[str, str]:
+    """sha256 of every file in the version except its top-level manifest.json, by relative path."""
+    return {
+        str(p.relative_to(version_dir)): file_sha256(p)
+        for p in sorted(version_dir.rglob("*"))
+        if p.is_file() and p != version_dir / "manifest.json"
+    }
+
+
+def read_manifest(version_dir: Path) -> dict:
+    p = Path(version_dir) / "manifest.json"
+    return json.loads(p.read_text(encoding="utf-8")) if p.exists() else {}
+
+
+def verify(version_dir: Path) -> List[str]:
+    """Files that are missing, unexpected or whose checksum differs from the manifest (empty = intact)."""
+    expected = read_manifest(version_dir).get("checksums")
+    if expected is None:
+        return ["manifest.json has no checksums (unpublished or pre-versioning build)"]
+    actual = checksums(version_dir)
+    problems = [f"missing: {f}" for f in expected if f not in actual]
+    problems += [f"unexpected: {f}" for f in actual if f not in expected]
+    problems += [f"checksum mismatch: {f}" for f in expected if f in actual and actual[f] != expected[f]]
+    return problems
+
+
+# -------------------------
+# Publishing
+# -------------------------
+
+def swap_current(index_dir: Path, version: str) -> None:
+    tmp = Path(index_dir) / f".{CURRENT}.{os.getpid()}.tmp"
+    tmp.write_text(version + "\n", encoding="utf-8")
+    os.replace(tmp, Path(index_dir) / CURRENT)  # atomic on POSIX and Windows
+
+
+def publish(index_dir: Path, version_dir: Path, parent: Optional[str] = None) -> str:
+    """Seal a finished build (checksums + version in its manifest) and make it the current version."""
+    index_dir = Path(index_dir)
+    version = version_dir.name
+    manifest = read_manifest(version_dir)
+    manifest.update({
+        "version": version,
+        "parent_version": parent,
+        "published_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "checksums": checksums(version_dir),
+    })
+    tmp = version_dir / "manifest.json.tmp"
+    tmp.write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    os.replace(tmp, version_dir / "manifest.json")
+
+    swap_current(index_dir, version)
+    print(f"Published version {version} (CURRENT → {VERSIONS}/{version})")
+    return version
+
+
+def list_versions(index_dir: Path) -> List[Tuple[str, dict]]:
+    root = Path(index_dir) / VERSIONS
+    if not root.exists():
+        return []
+    return [(d.name, read_manifest(d)) for d in sorted(root.iterdir()) if d.is_dir()]
+
+
+def prune(index_dir: Path, keep: Optional[int] = None) -> List[str]:
+    """
+    Remove all but the newest `keep` published versions (the current one is always
+    kept) and any older unfinished build. Readers still serving a removed version
+    keep working: their files are open or mapped, and POSIX frees them on close.
+    """
+    keep = SETTINGS.index_keep_versions if keep is None else keep
+    current = current_version(index_dir)
+    versions = list_versions(index_dir)
+    published = [name for name, m in versions if "checksums" in m]
+    keep_names = set(published[-keep:] if keep > 0 else []) | {current}
+    newest = versions[-1][0] if versions else None
+
+    removed = []
+    for name, m in versions:
+        # an unfinished build newer than everything published may still be running
+        unfinished_in_progress = "checksums" not in m and name == newest
+        if name in keep_names or unfinished_in_progress:
+            continue
+        shutil.rmtree(Path(index_dir) / VERSIONS / name, ignore_errors=True)
+        removed.append(name)
+    return removed
+
+
+# Build outputs of an unversioned index_dir; removed once it is versioned so there is one source of truth
+LEGACY_FILES = ["faiss.index", "vectors.npy", "meta.jsonl", "filters.npz", "lexical.npz", "manifest.json", "meta", "shards"]
+
+
+def remove_legacy_layout(index_dir: Path) -> None:
+    for name in LEGACY_FILES:
+        p = Path(index_dir) / name
+        if p.is_dir():
+            shutil.rmtree(p)
+        elif p.exists():
+            p.unlink()
+
+
+# -------------------------
+# Hot swap for long-running readers
+# -------------------------
+
+class HotIndex:
+    """
+    The live bundle of an index_dir, swapped to new versions in the background.
+    `current` is replaced as a whole, so a request that reads it once has a
+    consistent snapshot for its whole lifetime.
+    """
+
+    def __init__(self, index_dir: Path, loader: Callable[[Path], tuple], poll_s: Optional[float] = None,
+                 on_swap: Optional[Callable[["HotIndex"], None]] = None):
+        self.index_dir = Path(index_dir)
+        self.loader = loader
+        self.poll_s = SETTINGS.index_poll_s if poll_s is None else poll_s
+        self.on_swap = on_swap
+        self.version = current_version(self.index_dir)
+        self.path = resolve(self.index_dir)  # version directory `current` was loaded from
+        self.current = loader(self.path)
+        self.swaps = 0
+        self.last_error: Optional[str] = None
+        self._failed_version: Optional[str] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        if self.poll_s > 0:
+            self._thread = threading.Thread(target=self._watch, name="index-watch", daemon=True)
+            self._thread.start()
+
+    def refresh(self) -> bool:
+        """Load and swap in the current version if it changed; True if a swap happened."""
+        with self._lock:  # one load at a time
+            version = current_version(self.index_dir)
+            if version == self.version or version == self._failed_version:
+                return False
+            path = resolve(self.index_dir)
+            try:
+                bundle = self.loader(path)
+            except Exception as e:
+                self._failed_version = version  # retried only after CURRENT moves again
+                self.last_error = f"{version}: {type(e).__name__}: {e}"
+                print(f"Index hot swap to {version} failed, still serving {self.version}: {e}", flush=True)
+                return False
+            self.current = bundle
+            self.path = path
+            self.version = version
+            self.swaps += 1
+            self.last_error = None
+        if self.on_swap is not None:
+            self.on_swap(self)
+        print(f"Index hot swap: now serving version {version}", flush=True)
+        return True
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.poll_s):
+            self.refresh()
+
+    def close(self) -> None:
+        self._stop.set()
+
+    def stats(self) -> Dict[str, object]:
+        return {"version": self.version, "swaps": self.swaps, "last_error": self.last_error}
+
+
+def load_bundle(version_dir: Path) -> tuple:
+    """(index, meta, bitmaps, manifest, lexical) from one resolved version directory."""
+    from app.registry import index_detail
+    from app.retrieval import load_index_and_meta, load_lexical_index
+    from app.tracing import memory, span
+
+    with span("index.load", path=str(version_dir)) as attrs:
+        index, meta, bitmaps, manifest = load_index_and_meta(version_dir)
+        lexical = load_lexical_index(version_dir)
+        attrs["version"] = manifest.get("version")
+    for component, nbytes in index_detail(Path(version_dir), index, meta, bitmaps, manifest, lexical).items():
+        memory(component, nbytes, version=manifest.get("version"))
+    return index, meta, bitmaps, manifest, lexical
+
+
+def main():
+    import argparse
+    ap = argparse.ArgumentParser(description="List, verify, roll back and prune published index versions")
+    ap.add_argument("--index-dir", type=Path, default=SETTINGS.index_dir)
+    ap.add_argument("--verify", nargs="?", const="", default=None, metavar="VERSION",
+                    help="Re-check a version's checksums (default: the current version)")
+    ap.add_argument("--use", metavar="VERSION", help="Point CURRENT at an existing published version")
+    ap.add_argument("--prune", action="store_true", help="Remove versions beyond SETTINGS.index_keep_versions")
+    args = ap.parse_args()
+
+    current = current_version(args.index_dir)
+    if args.use:
+        d = args.index_dir / VERSIONS / args.use
+        problems = verify(d) if d.exists() else [f"no such version: {args.use}"]
+        if problems:
+            raise SystemExit(f"Not switching to {args.use}:\n  " + "\n  ".join(problems))
+        swap_current(args.index_dir, args.use)
+        print(f"CURRENT: {current} → {args.use}")
+        return
+    if args.verify is not None:
+        version = args.verify or current
+        if not version:
+            raise SystemExit(f"{args.index_dir} has no CURRENT version")
+        problems = verify(args.index_dir / VERSIONS / version)
+        print(f"{version}: " + ("ok" if not problems else "\n  " + "\n  ".join(problems)))
+        if problems:
+            raise SystemExit(1)
+        return
+    if args.prune:
+        removed = prune(args.index_dir)
+        print(f"Removed {len(removed)} version(s): {', '.join(removed) or '-'}")
+        return
+
+    for name, m in list_versions(args.index_dir):
+        state = "*" if name == current else " " if "checksums" in m else "?"
+        print(f"{state} {name}  chunks={m.get('n_chunks', '?')}  type={m.get('index_type', '?')}  "
+              f"shards={m.get('n_shards', '-')}  published={m.get('published_at', 'unfinished')}")
+
+
+if __name__ == "__main__":
+    main()
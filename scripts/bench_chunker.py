@@ -0,0 +1,94 @@
+# scripts/bench_chunker.py
+"""
+Chunking throughput on a synthetic SOP corpus (lines per second).
+
+Generates --docs markdown documents shaped like the real SOPs (title, ## sections
+drawn from the section taxonomy plus unrecognised headers, ### subsections,
+numbered procedure steps, prose and bullet lines), then times:
+
+- classify_section over every header line, uncached and memoized
+- chunk_document over the whole corpus (single process, so the number is per core)
+
+Run from the repo root:  PYTHONPATH=. python scripts/bench_chunker.py [--docs 5000] [--repeat 3]
+"""
+import argparse
+import random
+import time
+from typing import List
+
+from app.chunker import _classify, chunk_document, classify_section
+from app.config import SETTINGS
+from app.models import Document
+
+WORDS = ("cells medium flask passage trypsin incubate centrifuge pellet resuspend count viability "
+         "seed plate wash pbs aspirate label record confluence sterile hood pipette volume").split()
+EXTRA_HEADERS = ["Notes", "Revision History", "Appendix A", "Background", "Definitions", "Responsibilities"]
+
+
+def sentence(rng: random.Random, n: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(n)).capitalize() + "."
+
+
+def synthetic_doc(rng: random.Random, i: int) -> Document:
+    keywords = [k.lstrip("=") for _, kws in SETTINGS.section_taxonomy for k in kws]
+    lines = [f"# Synthetic SOP {i}", ""]
+    for _ in range(rng.randint(6, 12)):
+        if rng.random() < 0.8:
+            header = f"{rng.choice(keywords).title()} {rng.choice(['', '& Notes', 'Overview', '(Required)'])}"
+        else:
+            header = rng.choice(EXTRA_HEADERS)
+        lines += [f"## {header.strip()}", ""]
+        if rng.random() < 0.3:
+            lines += [f"### {rng.choice(WORDS).title()} stage", ""]
+        if "procedure" in header.lower() or rng.random() < 0.25:
+            for step in range(1, rng.randint(5, 40)):
+                lines.append(f"{step}. {sentence(rng, rng.randint(6, 20))}")
+                if rng.random() < 0.3:
+                    lines.append(f"   - {sentence(rng, rng.randint(4, 10))}")
+        else:
+            for _ in range(rng.randint(3, 15)):
+                lines.append(f"- {sentence(rng, rng.randint(5, 18))}" if rng.random() < 0.5 else sentence(rng, rng.randint(8, 30)))
+        lines.append("")
+    return Document(doc_id=f"synthetic-{i:06d}", title=f"Synthetic SOP {i}", source_path=f"synthetic/{i}.md", lines=lines)
+
+
+def best_of(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--docs", type=int, default=5000)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    docs = [synthetic_doc(rng, i) for i in range(args.docs)]
+    n_lines = sum(len(d.lines) for d in docs)
+    headers: List[str] = [ln.lstrip("#").strip() for d in docs for ln in d.lines if ln.startswith("#")]
+    print(f"Corpus: {len(docs)} docs, {n_lines} lines, {len(headers)} headers ({len(set(headers))} distinct)")
+
+    t = best_of(lambda: [_classify(h) for h in headers], args.repeat)
+    print(f"classify_section (compiled, uncached): {len(headers) / t:>12,.0f} headers/s")
+    classify_section.cache_clear()
+    t = best_of(lambda: [classify_section(h) for h in headers], args.repeat)
+    print(f"classify_section (memoized):           {len(headers) / t:>12,.0f} headers/s  {classify_section.cache_info()}")
+
+    n_chunks = 0
+
+    def chunk_all():
+        nonlocal n_chunks
+        n_chunks = sum(len(chunk_document(d)) for d in docs)
+
+    t = best_of(chunk_all, args.repeat)
+    print(f"chunk_document:                        {n_lines / t:>12,.0f} lines/s  ({n_chunks} chunks, {t:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
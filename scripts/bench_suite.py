@@ -0,0 +1,411 @@
+# scripts/bench_suite.py
+"""
+End-to-end scaling benchmark: ingest → chunk → embed → index → search on
+synthetic SOP corpora of a given size (in chunks).
+
+The corpus is generated from the real SOPs in data_raw/sops: each synthetic
+document takes its sections from randomly chosen real SOPs, swaps in other
+cell lines, vessels and reagents, jitters the numbers, resamples and
+renumbers the procedure steps, and adds a markdown table (vessel / medium /
+seeding) to Materials or Preparation. Documents are added until
+chunk_document yields the target number of chunks.
+
+Each stage runs in its own subprocess with SETTINGS pointed at the work
+directory, so its peak RSS (ru_maxrss) is its own. Per stage the report has
+items, wall time, throughput and p50/p95/p99 latency per item: per document
+(ingest, chunk), per embedding batch (embed) and per query (search);
+throughput is over the timed items only, so model and index loading are
+excluded (with --workers > 1 the chunk stage uses wall time). The index
+stage is one `python -m app.index_faiss` build (with the embedding cache the
+embed stage filled, so it times everything but the model), so it reports wall
+time only. Embedding, query and result caches are off or cold everywhere else.
+
+Run from the repo root:
+  PYTHONPATH=. python scripts/bench_suite.py [--scales 1000,10000,100000] [--queries 200]
+        [--set index_type=hnsw --set retrieval_mode=hybrid] [--out bench.json] [--compare old.json]
+
+The JSON (default data/bench/bench-<commit>.json) records the commit, machine
+and relevant settings, so results from two commits can be compared with
+--compare.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config import SETTINGS, Settings
+from app.utils import get_git_sha, read_jsonl, write_jsonl
+
+STAGES = ["ingest", "chunk", "embed", "index", "search"]
+REPORTED_SETTINGS = ["embedding_model_name", "embedding_backend", "index_type", "vector_codec",
+                     "retrieval_mode", "shard_by", "n_shards", "max_chars", "procedure_steps_per_chunk"]
+
+CELL_LINES = ["HEK293", "HeLa", "CHO-K1", "A549", "MCF-7", "HepG2", "U2OS", "Vero", "NIH/3T3", "Caco-2",
+              "iPSC", "primary fibroblasts", "SH-SY5Y", "Jurkat", "THP-1"]
+VESSELS = [("T25 flask", 25), ("T75 flask", 75), ("T175 flask", 175), ("6-well plate", 9.5),
+           ("12-well plate", 3.8), ("24-well plate", 1.9), ("96-well plate", 0.32), ("10 cm dish", 55)]
+REAGENTS = ["Trypsin-EDTA", "TrypLE", "Accutase", "DPBS", "DMEM", "RPMI-1640", "Opti-MEM", "FBS",
+            "Pen-Strep", "L-glutamine", "DMSO", "trypan blue"]
+SECTION_ORDER = ["Purpose", "Scope", "Safety", "Materials", "Preparation", "Procedure",
+                 "Critical Points", "QC", "Troubleshooting", "References"]
+
+
+# -------------------------
+# Synthetic corpus
+# -------------------------
+
+def load_templates(sops_dir: Path) -> Dict[str, List[List[str]]]:
+    """Body lines of every `## ` section in the real SOPs, grouped by taxonomy section."""
+    from app.chunker import classify_section
+
+    templates: Dict[str, List[List[str]]] = {}
+    for p in sorted(sops_dir.glob("*.md")):
+        section, body = None, []
+        for ln in p.read_text(encoding="utf-8").splitlines() + ["## (end)"]:
+            if ln.startswith("## "):
+                if section is not None and any(b.strip() for b in body):
+                    templates.setdefault(section, []).append(body)
+                section, body = classify_section(ln[3:].strip()), []
+            elif section is not None:
+                body.append(re.sub(r"\s*:contentReference\[[^\]]*\]\{[^}]*\}", "", ln))
+    return templates
+
+
+def jitter_numbers(rng: random.Random, line: str) -> str:
+    def repl(m: "re.Match") -> str:
+        v = float(m.group(0))
+        out = v * rng.uniform(0.5, 1.5)
+        return f"{out:.0f}" if "." not in m.group(0) else f"{out:.1f}"
+    return re.sub(r"(?<![\w.])\d+(?:\.\d+)?(?![\w.])", repl, line)
+
+
+def substitute(rng: random.Random, line: str) -> str:
+    for names in (CELL_LINES, REAGENTS):
+        for name in names:
+            if name in line and rng.random() < 0.5:
+                line = line.replace(name, rng.choice(names))
+    return jitter_numbers(rng, line)
+
+
+def procedure_body(rng: random.Random, templates: List[List[str]]) -> List[str]:
+    """Numbered steps resampled from several real procedures and renumbered."""
+    steps: List[List[str]] = []
+    for body in rng.sample(templates, min(len(templates), rng.randint(1, 3))):
+        current: List[str] = []
+        for ln in body:
+            m = re.match(r"^\s*\d+\s*[\).:-]\s+(.*)$", ln)
+            if m:
+                if current:
+                    steps.append(current)
+                current = [m.group(1)]
+            elif current and ln.strip():
+                current.append(ln)
+        if current:
+            steps.append(current)
+    chosen = rng.sample(steps, min(len(steps), rng.randint(6, 40)))
+    out: List[str] = []
+    for n, (first, *rest) in enumerate(chosen, start=1):
+        out += [f"{n}. {first}", *rest, ""]
+    return out
+
+
+def table(rng: random.Random) -> List[str]:
+    rows = ["| Vessel | Surface area (cm²) | Medium (mL) | Seeding (cells/cm²) |", "|---|---|---|---|"]
+    for name, area in rng.sample(VESSELS, rng.randint(2, 5)):
+        rows.append(f"| {name} | {area} | {area * rng.uniform(0.15, 0.3):.1f} | {rng.choice([1, 2, 4, 5, 8]) * 10**4:,} |")
+    return rows + [""]
+
+
+def synthetic_sop(rng: random.Random, templates: Dict[str, List[List[str]]], i: int) -> Tuple[str, str]:
+    """(file name, markdown) of one synthetic SOP."""
+    topic = rng.choice(["Passaging", "Thawing", "Cryopreservation", "Counting", "Plating", "Media change",
+                        "Transfection", "Contamination response", "Coating", "Harvesting"])
+    cell_line = rng.choice(CELL_LINES)
+    lines = [f"# {topic} of {cell_line} cells (synthetic {i})", ""]
+    for section in SECTION_ORDER:
+        options = templates.get(section)
+        if not options or (section not in ("Purpose", "Procedure") and rng.random() < 0.2):
+            continue
+        lines += [f"## {section}", ""]
+        if section == "Procedure":
+            lines += procedure_body(rng, options)
+        else:
+            lines += [substitute(rng, ln) for ln in rng.choice(options)]
+        if section in ("Materials", "Preparation") and rng.random() < 0.6:
+            lines += table(rng)
+    slug = re.sub(r"[^a-z0-9]+", "-", f"{topic} {cell_line}".lower()).strip("-")
+    return f"sop-tc-{i:06d}-{slug}.md", "\n".join(lines) + "\n"
+
+
+def generate_corpus(sops_dir: Path, out_dir: Path, target_chunks: int, seed: int) -> Dict[str, Any]:
+    from app.chunker import chunk_document, is_useful_chunk
+    from app.ingest import infer_doc_id
+    from app.models import Document
+
+    rng = random.Random(seed)
+    templates = load_templates(sops_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    t0 = time.perf_counter()
+    n_docs = n_chunks = n_lines = 0
+    while n_chunks < target_chunks:
+        name, text = synthetic_sop(rng, templates, n_docs)
+        (out_dir / name).write_text(text, encoding="utf-8")
+        lines = text.splitlines()
+        doc = Document(doc_id=infer_doc_id(name), title=name, source_path=name, lines=lines)
+        n_chunks += sum(1 for c in chunk_document(doc) if is_useful_chunk(c))
+        n_docs += 1
+        n_lines += len(lines)
+    return {"docs": n_docs, "chunks": n_chunks, "lines": n_lines, "wall_s": round(time.perf_counter() - t0, 3)}
+
+
+# -------------------------
+# Stages (each runs in its own process)
+# -------------------------
+
+def percentiles(ms: List[float]) -> Optional[Dict[str, float]]:
+    if not ms:
+        return None
+    if len(ms) == 1:
+        return {"p50": ms[0], "p95": ms[0], "p99": ms[0]}
+    cuts = statistics.quantiles(ms, n=100, method="inclusive")
+    return {"p50": round(cuts[49], 3), "p95": round(cuts[94], 3), "p99": round(cuts[98], 3)}
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / 2**20 if sys.platform == "darwin" else peak / 1024, 1)  # bytes on macOS, KiB on Linux
+
+
+def stage_ingest(args) -> Tuple[int, List[float], Dict[str, Any]]:
+    from app.ingest import load_document
+
+    sha = get_git_sha()
+    ms: List[float] = []
+    docs = []
+    for p in sorted(SETTINGS.sops_dir.glob("*.md")):
+        t0 = time.perf_counter()
+        docs.append(load_document(p, sha))
+        ms.append((time.perf_counter() - t0) * 1000)
+    write_jsonl(SETTINGS.processed_dir / "docs.jsonl", (d.model_dump() for d in docs))
+    return len(docs), ms, {"lines": sum(len(d.lines) for d in docs)}
+
+
+def stage_chunk(args) -> Tuple[int, List[float], Dict[str, Any]]:
+    from app.chunker import chunk_row
+    from app.utils import bounded_imap
+
+    ms: List[float] = []
+    n_docs = 0
+
+    def rows():
+        nonlocal n_docs
+        for kept, timing in bounded_imap(chunk_row, read_jsonl(SETTINGS.processed_dir / "docs.jsonl"), workers=args.workers):
+            n_docs += 1
+            ms.append(timing["ms"])
+            yield from kept
+
+    write_jsonl(SETTINGS.processed_dir / "chunks.jsonl", rows())
+    n_chunks = sum(1 for _ in read_jsonl(SETTINGS.processed_dir / "chunks.jsonl"))
+    return n_docs, ms, {"chunks": n_chunks}
+
+
+def stage_embed(args) -> Tuple[int, List[float], Dict[str, Any]]:
+    from app.embedder import Embedder
+
+    texts = [row["text"] for row in read_jsonl(SETTINGS.processed_dir / "chunks.jsonl")]
+    embedder = Embedder(SETTINGS.embedding_model_name)
+    embedder.model  # load outside the timed batches
+    ms: List[float] = []
+    for i in range(0, len(texts), args.batch_size):
+        t0 = time.perf_counter()
+        embedder.embed_texts(texts[i:i + args.batch_size])
+        ms.append((time.perf_counter() - t0) * 1000)
+    return len(texts), ms, {"batches": len(ms), "batch_size": args.batch_size}
+
+
+def stage_index(args) -> Tuple[int, List[float], Dict[str, Any]]:
+    from app import index_faiss
+    from app.versions import read_manifest, resolve
+
+    sys.argv = ["app.index_faiss"]
+    index_faiss.main()
+    manifest = read_manifest(resolve(SETTINGS.index_dir))
+    return manifest.get("n_chunks", 0), [], {"index_type": manifest.get("index_type"),
+                                              "index_mb": round((manifest.get("memory") or {}).get("index_bytes", 0) / 2**20, 2)}
+
+
+def stage_search(args) -> Tuple[int, List[float], Dict[str, Any]]:
+    from app.embedder import Embedder
+    from app.retrieval import search
+    from app.versions import load_bundle, resolve
+
+    rng = random.Random(args.seed)
+    texts = [row["text"] for row in read_jsonl(SETTINGS.processed_dir / "chunks.jsonl")]
+    queries = []
+    for text in rng.sample(texts, min(args.queries, len(texts))):
+        words = re.findall(r"[A-Za-z][\w-]+", text)
+        start = rng.randint(0, max(0, len(words) - 8))
+        queries.append(" ".join(words[start:start + rng.randint(3, 10)]) or text[:40])
+
+    index, meta, bitmaps, _, lexical = load_bundle(resolve(SETTINGS.index_dir))
+    embedder = Embedder(SETTINGS.embedding_model_name)
+    search(index, meta, bitmaps, embedder, "warm up", SETTINGS.top_k, lexical=lexical)  # model load, first-touch pages
+    ms: List[float] = []
+    for q in queries:
+        t0 = time.perf_counter()
+        search(index, meta, bitmaps, embedder, q, SETTINGS.top_k, lexical=lexical)
+        ms.append((time.perf_counter() - t0) * 1000)
+    return len(queries), ms, {"k": SETTINGS.top_k}
+
+
+def apply_settings(work: Path, overrides: List[str]) -> None:
+    values = SETTINGS.model_dump()
+    for kv in overrides:
+        key, _, raw = kv.partition("=")
+        if key not in values:
+            raise SystemExit(f"Unknown setting {key!r}")
+        try:
+            values[key] = json.loads(raw)
+        except json.JSONDecodeError:
+            values[key] = raw
+    values.update({
+        "sops_dir": work / "sops",
+        "processed_dir": work / "processed",
+        "index_dir": work / "index",
+        "embedding_cache_dir": work / "cache",
+        "query_cache_size": 0,
+        "query_cache_persist": False,
+        "result_cache_size": 0,
+    })
+    for key, value in Settings(**values).model_dump().items():
+        setattr(SETTINGS, key, value)
+
+
+def run_stage(args) -> None:
+    apply_settings(args.workdir, args.set)
+    rss_start = peak_rss_mb()
+    t0 = time.perf_counter()
+    items, ms, extra = globals()[f"stage_{args.stage}"](args)
+    wall = time.perf_counter() - t0
+    busy = sum(ms) / 1000 if ms and args.workers == 1 else wall
+    result = {
+        "items": items,
+        "wall_s": round(wall, 3),
+        # per-item timings exclude setup (model / index load, file writes); single-shot stages use wall time
+        "throughput_per_s": round(items / busy, 1) if busy > 0 else None,
+        "latency_ms": percentiles(ms),
+        "rss_start_mb": rss_start,
+        "peak_rss_mb": peak_rss_mb(),
+        **extra,
+    }
+    print("BENCH_RESULT " + json.dumps(result), flush=True)
+
+
+# -------------------------
+# Driver
+# -------------------------
+
+def spawn_stage(stage: str, work: Path, args) -> Dict[str, Any]:
+    cmd = [sys.executable, __file__, "--stage", stage, "--workdir", str(work), "--queries", str(args.queries),
+           "--batch-size", str(args.batch_size), "--workers", str(args.workers), "--seed", str(args.seed)]
+    for kv in args.set:
+        cmd += ["--set", kv]
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [os.getcwd(), os.environ.get("PYTHONPATH")]))}
+    proc = subprocess.run(cmd, capture_output=True, text=True, env=env)
+    lines = [ln for ln in proc.stdout.splitlines() if ln.startswith("BENCH_RESULT ")]
+    if proc.returncode != 0 or not lines:
+        tail = "\n".join((proc.stdout + proc.stderr).splitlines()[-20:])
+        raise SystemExit(f"Stage {stage} failed (exit {proc.returncode}):\n{tail}")
+    return json.loads(lines[-1][len("BENCH_RESULT "):])
+
+
+def print_scale(scale: Dict[str, Any]) -> None:
+    print(f"\n== {scale['target_chunks']:,} chunks ({scale['corpus']['docs']:,} docs, {scale['corpus']['lines']:,} lines)")
+    for stage, r in scale["stages"].items():
+        lat = r["latency_ms"]
+        lat_s = f"p50 {lat['p50']:>8.2f}  p95 {lat['p95']:>8.2f}  p99 {lat['p99']:>8.2f} ms" if lat else " " * 44
+        print(f"  {stage:<7} {r['items']:>8,} items  {r['wall_s']:>8.2f}s  {r['throughput_per_s'] or 0:>10,.1f}/s  "
+              f"{lat_s}  peak RSS {r['peak_rss_mb']:>7.1f} MB")
+
+
+def compare(base: Dict[str, Any], new: Dict[str, Any]) -> None:
+    print(f"\nvs {str(base.get('commit'))[:10]}  (ratio new/base; throughput > 1 and latency < 1 are improvements)")
+    base_scales = {s["target_chunks"]: s for s in base["scales"]}
+    for scale in new["scales"]:
+        old = base_scales.get(scale["target_chunks"])
+        if old is None:
+            continue
+        for stage, r in scale["stages"].items():
+            o = old["stages"].get(stage)
+            if not o:
+                continue
+            ratio = lambda a, b: f"{a / b:>6.2f}x" if a and b else "     -"
+            p95 = ratio((r["latency_ms"] or {}).get("p95"), (o["latency_ms"] or {}).get("p95"))
+            print(f"  {scale['target_chunks']:>7,} {stage:<7} throughput {ratio(r['throughput_per_s'], o['throughput_per_s'])}"
+                  f"  p95 {p95}  peak RSS {ratio(r['peak_rss_mb'], o['peak_rss_mb'])}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Scaling benchmark on synthetic SOP corpora")
+    ap.add_argument("--scales", default="1000,10000,100000", help="Comma-separated corpus sizes in chunks")
+    ap.add_argument("--stages", default=",".join(STAGES))
+    ap.add_argument("--queries", type=int, default=200, help="Search queries sampled from the corpus")
+    ap.add_argument("--batch-size", type=int, default=64, help="Embedding batch size")
+    ap.add_argument("--workers", type=int, default=1, help="Chunking processes (1 = per-core numbers)")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="Override a SETTINGS field (repeatable)")
+    ap.add_argument("--workdir", type=Path, default=Path("data/bench/work"))
+    ap.add_argument("--out", type=Path, default=None, help="JSON report (default data/bench/bench-<commit>.json)")
+    ap.add_argument("--compare", type=Path, default=None, help="Earlier JSON report to compare against")
+    ap.add_argument("--keep", action="store_true", help="Keep each scale's generated corpus and index")
+    ap.add_argument("--stage", choices=STAGES, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.stage:
+        run_stage(args)
+        return
+
+    apply_settings(args.workdir, args.set)  # validates overrides before any work
+    stages = [s for s in args.stages.split(",") if s]
+    commit = get_git_sha()
+    report: Dict[str, Any] = {
+        "commit": commit,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "machine": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "settings": {k: str(getattr(SETTINGS, k)) for k in REPORTED_SETTINGS},
+        "overrides": args.set,
+        "params": {"queries": args.queries, "batch_size": args.batch_size, "workers": args.workers, "seed": args.seed},
+        "scales": [],
+    }
+    for target in [int(s) for s in args.scales.split(",") if s]:
+        work = args.workdir / f"{target}"
+        shutil.rmtree(work, ignore_errors=True)  # cold caches and a fresh index every run
+        corpus = generate_corpus(Path("data_raw/sops"), work / "sops", target, args.seed)
+        scale = {"target_chunks": target, "corpus": corpus, "stages": {}}
+        for stage in stages:
+            scale["stages"][stage] = spawn_stage(stage, work, args)
+        report["scales"].append(scale)
+        print_scale(scale)
+        if not args.keep:
+            shutil.rmtree(work, ignore_errors=True)
+
+    out = args.out or Path("data/bench") / f"bench-{(commit or 'nogit')[:10]}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"\nReport → {out}")
+    if args.compare:
+        compare(json.loads(args.compare.read_text(encoding="utf-8")), report)
+
+
+if __name__ == "__main__":
+    main()
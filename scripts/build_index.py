@@ -8,6 +8,11 @@ import numpy as np
 import faiss
 from sentence_transformers import SentenceTransformer
 
+try:  # columnar meta needs the repo root on sys.path (e.g. PYTHONPATH=.)
+    from app.meta_store import write_columnar
+except ImportError:
+    write_columnar = None
+
 # def read_markdown_files(docs_dir: Path) -> List[Dict]:
 #     items = []
 #     for p in sorted(docs_dir.glob("*.md")):
@@ -105,6 +110,14 @@ OUT_DIR.mkdir(parents=True, exist_ok=True)
 
 MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
 MAX_CHARS_PER_CHUNK = 2200  # if a section is longer, split further
+META_SCHEMA = {
+    "chunk_id": "text",
+    "doc_file": "category",
+    "doc_title": "category",
+    "section": "category",
+    "anchor": "category",
+    "text": "text",
+}
 
 
 def read_markdown_files(folder: Path) -> List[Tuple[str, str]]:
@@ -229,6 +242,8 @@ def main():
 
     faiss.write_index(index, str(OUT_DIR / "faiss.index"))
     (OUT_DIR / "meta.json").write_text(json.dumps(chunks, ensure_ascii=False, indent=2), encoding="utf-8")
+    if write_columnar is not None:
+        write_columnar(OUT_DIR / "meta", chunks, META_SCHEMA)
 
     print(f"Saved index to {OUT_DIR/'faiss.index'} and metadata to {OUT_DIR/'meta.json'}")
 
@@ -0,0 +1,71 @@
+# scripts/check_import_time.py
+"""
+Import-time budget check for the CLI entry points.
+
+Fails (exit 1) if
+- importing a light module pulls in a heavy dependency (torch, faiss, ...), or
+- `python -m app.query --help` takes longer than the budget (best of N runs).
+
+Run from the repo root:  python scripts/check_import_time.py [--budget-ms 600]
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+HEAVY = ["torch", "sentence_transformers", "transformers", "faiss", "numpy", "streamlit", "sympy"]
+
+# module -> heavy modules it is allowed to import at module level
+LIGHT_MODULES = {
+    "app.query": [],
+    "app.daemon": [],
+    "app.config": [],
+    "app.chunker": [],
+    "app.embedder": ["numpy"],
+    "app.retrieval": ["numpy"],
+}
+
+
+def heavy_imports(module: str) -> list:
+    code = (
+        "import importlib, json, sys; "
+        f"importlib.import_module({module!r}); "
+        f"print(json.dumps([m for m in {HEAVY!r} if m in sys.modules]))"
+    )
+    out = subprocess.check_output([sys.executable, "-c", code], text=True)
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def best_wall_time(cmd: list, runs: int) -> float:
+    best = float("inf")
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--budget-ms", type=float, default=600.0)
+    ap.add_argument("--runs", type=int, default=5)
+    args = ap.parse_args()
+
+    failed = False
+    for module, allowed in LIGHT_MODULES.items():
+        extra = [m for m in heavy_imports(module) if m not in allowed]
+        status = "FAIL" if extra else "ok"
+        failed |= bool(extra)
+        print(f"[{status}] import {module}: heavy modules loaded = {extra or 'none'}")
+
+    elapsed = best_wall_time([sys.executable, "-m", "app.query", "--help"], args.runs)
+    over = elapsed * 1000 > args.budget_ms
+    failed |= over
+    print(f"[{'FAIL' if over else 'ok'}] python -m app.query --help: {elapsed * 1000:.0f} ms (budget {args.budget_ms:.0f} ms)")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+# scripts/replay.py
+"""
+Replay load generator: sends a captured query log (app/query_log.py) or a
+synthetic workload built from eval/*.jsonl against the retriever, and reports
+throughput, latency percentiles and errors.
+
+Targets:
+  --target service  --url http://127.0.0.1:8765   (python -m app.service)
+  --target daemon   --socket data/run/query.sock   (python -m app.daemon)
+  --target inprocess                               (index + model loaded here; searches serialized like the daemon)
+
+Load shapes:
+  --concurrency N   closed loop: N clients, each sends its next query when the last one returns
+  --rate R          open loop: Poisson arrivals at R queries/s, whatever the latency
+  --rate log        open loop: the log's own inter-arrival gaps, divided by --speedup
+
+Open-loop latency is measured from each query's scheduled arrival, so time
+spent queued behind slow requests counts (no coordinated omission). The
+workload loops until --duration seconds or --requests queries have been sent.
+
+Run from the repo root:
+  PYTHONPATH=. python scripts/replay.py --target service --rate 50 --duration 60 --out data/bench/replay.json
+  PYTHONPATH=. python scripts/replay.py --eval --filter-share 0.3 --target daemon --concurrency 8
+"""
+import argparse
+import itertools
+import json
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from app.config import SETTINGS
+from app.utils import read_jsonl
+
+Query = Dict[str, Any]  # {"query", "k", "doc_filter", "section_filter", "ts"}
+
+
+# -------------------------
+# Workloads
+# -------------------------
+
+def logged_workload(path: Optional[Path]) -> List[Query]:
+    from app.query_log import read_query_log
+
+    return [{"query": r["query"], "k": r.get("k") or SETTINGS.top_k, "doc_filter": r.get("doc_filter"),
+             "section_filter": r.get("section_filter"), "ts": r.get("ts")}
+            for r in read_query_log(path) if not r.get("error")]
+
+
+def eval_workload(filter_share: float, seed: int) -> List[Query]:
+    """Every eval question; a filter_share of them restricted to their expected doc_id."""
+    rng = random.Random(seed)
+    out: List[Query] = []
+    for p in sorted(Path("eval").glob("*.jsonl")):
+        for ex in read_jsonl(p):
+            expected = ex.get("expected") or [{}]
+            doc = expected[0].get("doc_id") if rng.random() < filter_share else None
+            out.append({"query": ex["query"], "k": SETTINGS.top_k, "doc_filter": doc, "section_filter": None, "ts": None})
+    rng.shuffle(out)
+    return out
+
+
+# -------------------------
+# Targets
+# -------------------------
+
+def make_target(args) -> Callable[[Query], int]:
+    """A function that runs one query and returns the number of results (raising on errors)."""
+    if args.target == "service":
+        from app.service import search_remote
+
+        return lambda q: len(search_remote(args.url, q["query"], q["k"], q["doc_filter"], q["section_filter"],
+                                           timeout_ms=int(args.timeout * 1000)))
+
+    if args.target == "daemon":
+        from app.query import daemon_request
+
+        def run(q: Query) -> int:
+            reply = daemon_request(args.socket, {"op": "search", "q": q["query"], "k": q["k"],
+                                                 "doc_filter": q["doc_filter"], "section_filter": q["section_filter"]},
+                                   timeout=args.timeout)
+            if not reply.get("ok"):
+                raise RuntimeError(f"daemon: {reply.get('error')}")
+            return len(reply["results"])
+        return run
+
+    from app.embedder import Embedder
+    from app.retrieval import search
+    from app.versions import load_bundle, resolve
+
+    index, meta, bitmaps, manifest, lexical = load_bundle(resolve(SETTINGS.index_dir))
+    embedder = Embedder(SETTINGS.embedding_model_name)
+    lock = threading.Lock()  # same serialization as the daemon
+
+    def run_inprocess(q: Query) -> int:
+        with lock:
+            return len(search(index, meta, bitmaps, embedder, q["query"], q["k"], q["doc_filter"],
+                              q["section_filter"], lexical=lexical, manifest=manifest))
+    return run_inprocess
+
+
+# -------------------------
+# Load generation
+# -------------------------
+
+class Results:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies_ms: List[float] = []
+        self.errors: Dict[str, int] = {}
+        self.sent = 0
+
+    def add(self, latency_ms: float, error: Optional[str]) -> None:
+        with self.lock:
+            if error is None:
+                self.latencies_ms.append(latency_ms)
+            else:
+                self.errors[error] = self.errors.get(error, 0) + 1
+
+
+def error_kind(e: BaseException) -> str:
+    return f"{type(e).__name__}: {str(e)[:80]}"
+
+
+def timed_call(target: Callable[[Query], int], q: Query, started: float, results: Results, record: bool) -> None:
+    error = None
+    try:
+        target(q)
+    except Exception as e:
+        error = error_kind(e)
+    if record:
+        results.add((time.perf_counter() - started) * 1000, error)
+
+
+def closed_loop(target, workload: List[Query], args, results: Results) -> float:
+    queries = itertools.cycle(workload)
+    take = threading.Lock()
+    deadline = time.perf_counter() + args.duration if not args.requests else None
+    counter = itertools.count()
+
+    def client() -> None:
+        while True:
+            with take:
+                i = next(counter)
+                q = next(queries)
+            if (args.requests and i >= args.requests + args.warmup) or (deadline and time.perf_counter() >= deadline):
+                return
+            with results.lock:
+                results.sent += 1
+            timed_call(target, q, time.perf_counter(), results, record=i >= args.warmup)
+
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(args.concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - t0
+
+
+def arrival_gaps(workload: List[Query], args) -> Callable[[int], float]:
+    if args.rate == "log":
+        stamps = [q["ts"] for q in workload]
+        if any(ts is None for ts in stamps) or len(stamps) < 2:
+            raise SystemExit("--rate log needs a captured log with timestamps")
+        gaps = [max(0.0, b - a) / args.speedup for a, b in zip(stamps, stamps[1:])] + [0.0]
+        return lambda i: gaps[i % len(gaps)]
+    rate = float(args.rate)
+    rng = random.Random(args.seed)
+    return lambda i: rng.expovariate(rate)
+
+
+def open_loop(target, workload: List[Query], args, results: Results) -> float:
+    gap = arrival_gaps(workload, args)
+    pool = ThreadPoolExecutor(max_workers=args.max_in_flight)
+    t0 = time.perf_counter()
+    scheduled = t0
+    deadline = t0 + args.duration
+    for i, q in enumerate(itertools.cycle(workload)):
+        if (args.requests and i >= args.requests + args.warmup) or (not args.requests and scheduled >= deadline):
+            break
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        results.sent += 1
+        pool.submit(timed_call, target, q, scheduled, results, i >= args.warmup)
+        scheduled += gap(i)
+    pool.shutdown(wait=True)
+    return time.perf_counter() - t0
+
+
+def percentile(sorted_ms: List[float], p: float) -> float:
+    return sorted_ms[min(len(sorted_ms) - 1, int(p / 100 * len(sorted_ms)))]
+
+
+def report(results: Results, wall_s: float, args, n_workload: int) -> Dict[str, Any]:
+    ms = sorted(results.latencies_ms)
+    n_err = sum(results.errors.values())
+    done = len(ms) + n_err
+    out = {
+        "target": args.target,
+        "load": {"concurrency": args.concurrency} if args.concurrency else {"rate": args.rate, "speedup": args.speedup},
+        "workload": {"source": "eval" if args.eval else str(args.log or SETTINGS.logs_dir / "queries.jsonl"),
+                     "distinct_queries": n_workload},
+        "sent": results.sent,
+        "completed": len(ms),
+        "errors": n_err,
+        "error_rate": round(n_err / done, 4) if done else 0.0,
+        "error_kinds": results.errors,
+        "wall_s": round(wall_s, 3),
+        "throughput_qps": round(len(ms) / wall_s, 2) if wall_s > 0 else 0.0,
+        "latency_ms": {
+            "mean": round(statistics.fmean(ms), 3), "p50": round(percentile(ms, 50), 3),
+            "p90": round(percentile(ms, 90), 3), "p95": round(percentile(ms, 95), 3),
+            "p99": round(percentile(ms, 99), 3), "max": round(ms[-1], 3),
+        } if ms else None,
+    }
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Replay captured or synthetic queries against the retriever")
+    src = ap.add_mutually_exclusive_group()
+    src.add_argument("--log", type=Path, default=None, help="Query log to replay (default <logs_dir>/queries.jsonl)")
+    src.add_argument("--eval", action="store_true", help="Synthetic workload from eval/*.jsonl")
+    ap.add_argument("--filter-share", type=float, default=0.0, help="--eval: share of queries with a doc_id filter")
+    ap.add_argument("--target", choices=["service", "daemon", "inprocess"], default="service")
+    ap.add_argument("--url", default=f"http://{SETTINGS.service_host}:{SETTINGS.service_port}")
+    ap.add_argument("--socket", type=Path, default=SETTINGS.daemon_socket)
+    load = ap.add_mutually_exclusive_group()
+    load.add_argument("--concurrency", type=int, default=0, help="Closed loop with N clients")
+    load.add_argument("--rate", default=None, help="Open loop: queries/s, or 'log' for the log's own timing")
+    ap.add_argument("--speedup", type=float, default=1.0, help="--rate log: replay this many times faster")
+    ap.add_argument("--duration", type=float, default=30.0, help="Seconds to run (unless --requests)")
+    ap.add_argument("--requests", type=int, default=0, help="Send exactly this many measured queries")
+    ap.add_argument("--warmup", type=int, default=0, help="Initial queries not measured")
+    ap.add_argument("--max-in-flight", type=int, default=256, help="Open loop: concurrent requests at most")
+    ap.add_argument("--timeout", type=float, default=10.0, help="Per-request timeout (s)")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", type=Path, default=None, help="Write the report as JSON")
+    args = ap.parse_args()
+    if not args.concurrency and args.rate is None:
+        args.concurrency = 1
+
+    workload = eval_workload(args.filter_share, args.seed) if args.eval else logged_workload(args.log)
+    if not workload:
+        raise SystemExit("Empty workload: capture queries first (Streamlit app / python -m app.query) or use --eval")
+    target = make_target(args)
+
+    results = Results()
+    shape = f"{args.concurrency} clients" if args.concurrency else f"rate {args.rate}"
+    print(f"Replaying {len(workload)} queries against {args.target} ({shape}) ...", flush=True)
+    run = closed_loop if args.concurrency else open_loop
+    wall = run(target, workload, args, results)
+    out = report(results, wall, args, len(workload))
+
+    lat = out["latency_ms"]
+    print(f"sent {out['sent']}, completed {out['completed']}, errors {out['errors']} ({out['error_rate']:.2%}) "
+          f"in {out['wall_s']:.1f}s → {out['throughput_qps']:.1f} q/s")
+    if lat:
+        print(f"latency ms: mean {lat['mean']:.1f}  p50 {lat['p50']:.1f}  p90 {lat['p90']:.1f}  "
+              f"p95 {lat['p95']:.1f}  p99 {lat['p99']:.1f}  max {lat['max']:.1f}")
+    for kind, n in sorted(out["error_kinds"].items(), key=lambda kv: -kv[1]):
+        print(f"  {n:>6}  {kind}")
+    if args.out:
+        args.out.parent.mkdir(parents=True, exist_ok=True)
+        args.out.write_text(json.dumps(out, indent=2), encoding="utf-8")
+        print(f"Report → {args.out}")
+
+
+if __name__ == "__main__":
+    main()
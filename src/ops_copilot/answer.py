@@ -1,10 +1,60 @@
 # src/ops_copilot/answer.py
-from typing import List, Dict, Any
+import json
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple
 
+try:  # spans in <logs_dir>/spans.jsonl (app/tracing.py); no-op without `app`
+    from app.tracing import span
+except ImportError:
+    from contextlib import nullcontext
+
+    def span(name, **attrs):
+        return nullcontext(attrs)
+
+try:  # SETTINGS.abstain_calibration_path is written by `python -m app.eval --sweep`
+    from app.config import SETTINGS
+except ImportError:
+    SETTINGS = None
+
+DEFAULT_THRESHOLD = 0.30
+
+_calibration_cache: Dict[str, Tuple[float, float]] = {}
+
+
+def load_abstain_threshold(path: Optional[Path] = None) -> float:
+    """Recommended threshold from an eval sweep, or DEFAULT_THRESHOLD if there is none."""
+    if path is None and SETTINGS is None:
+        return DEFAULT_THRESHOLD
+    p = Path(path or SETTINGS.abstain_calibration_path)
+    try:
+        mtime = p.stat().st_mtime
+    except OSError:
+        return DEFAULT_THRESHOLD
+
+    cached = _calibration_cache.get(str(p))
+    if cached and cached[0] == mtime:
+        return cached[1]
+    try:
+        thr = float(json.loads(p.read_text(encoding="utf-8"))["recommended"]["threshold"])
+    except (ValueError, KeyError, TypeError):
+        thr = DEFAULT_THRESHOLD
+    _calibration_cache[str(p)] = (mtime, thr)
+    return thr
+
+
+def make_answer(query: str, hits: List[Dict[str, Any]], threshold: Optional[float] = None) -> Dict[str, Any]:
+    with span("answer", hits=len(hits)) as attrs:
+        out = _make_answer(query, hits, threshold)
+        attrs["abstained"] = not out["citations"]
+        return out
+
+
+def _make_answer(query: str, hits: List[Dict[str, Any]], threshold: Optional[float]) -> Dict[str, Any]:
+    if threshold is None:
+        threshold = load_abstain_threshold()
 
-def make_answer(query: str, hits: List[Dict[str, Any]]) -> Dict[str, Any]:
     # Simple rule: if retrieval is weak, refuse.
-    if not hits or hits[0]["score"] < 0.30:
+    if not hits or hits[0]["score"] < threshold:
         return {
             "answer": "I can’t find strong support for that question in the current SOP library. Try rephrasing, or add a protocol covering this topic.",
             "citations": [],
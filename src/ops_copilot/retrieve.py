@@ -1,5 +1,6 @@
 # src/ops_copilot/retrieve.py
 import json
+import time
 from pathlib import Path
 from typing import List, Dict, Any, Tuple
 
@@ -7,9 +8,28 @@ import numpy as np
 import faiss
 from sentence_transformers import SentenceTransformer
 
+try:  # mmap'd columnar meta written by scripts/build_index.py when `app` is importable
+    from app.meta_store import ColumnarStore
+except ImportError:
+    ColumnarStore = None
+
+try:  # result cache shared with app.retrieval (app/result_cache.py)
+    from app.result_cache import shared_result_cache
+except ImportError:
+    shared_result_cache = None
+
+try:  # spans in <logs_dir>/spans.jsonl (app/tracing.py); no-op without `app`
+    from app.tracing import span
+except ImportError:
+    from contextlib import nullcontext
+
+    def span(name, **attrs):
+        return nullcontext(attrs)
+
 MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
 INDEX_PATH = Path("indexes/faiss.index")
 META_PATH = Path("indexes/meta.json")
+META_COLUMNAR_DIR = Path("indexes/meta")
 
 
 class Retriever:
@@ -19,18 +39,49 @@ class Retriever:
 
         self.model = SentenceTransformer(MODEL_NAME)
         self.index = faiss.read_index(str(INDEX_PATH))
-        self.meta: List[Dict[str, Any]] = json.loads(META_PATH.read_text(encoding="utf-8"))
+        if ColumnarStore is not None and ColumnarStore.exists(META_COLUMNAR_DIR):
+            self.meta = ColumnarStore(META_COLUMNAR_DIR)  # rows decoded per hit
+        else:
+            self.meta = json.loads(META_PATH.read_text(encoding="utf-8"))
+        # identifies the build this instance loaded, so cached results never outlive a rebuild
+        st = INDEX_PATH.stat()
+        self.manifest = {"faiss_index": str(INDEX_PATH), "mtime_ns": st.st_mtime_ns, "size": st.st_size}
+        self.cache = shared_result_cache() if shared_result_cache is not None else None
 
     def search(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
-        q_emb = self.model.encode([query], normalize_embeddings=True)
-        q_emb = np.asarray(q_emb, dtype=np.float32)
-        scores, idxs = self.index.search(q_emb, k)
+        with span("retriever.search", query=query, k=k) as attrs:
+            results = self._search(query, k, attrs)
+            attrs["hits"] = len(results)
+            return results
+
+    def _search(self, query: str, k: int, attrs: Dict[str, Any]) -> List[Dict[str, Any]]:
+        if self.cache is not None:
+            scope = self.cache.scope(self.cache.observe(self.manifest), k, None, None, "retriever")
+            cached = self.cache.get(scope, query)
+            attrs["cache"] = "miss" if cached is None else "exact"
+            if cached is not None:
+                return [dict(item) for item in cached]
+
+        t0 = time.perf_counter()
+        with span("retriever.encode"):
+            q_emb = self.model.encode([query], normalize_embeddings=True)
+            q_emb = np.asarray(q_emb, dtype=np.float32)
+        if self.cache is not None:
+            cached = self.cache.get_similar(scope, q_emb)
+            if cached is not None:
+                attrs["cache"] = "semantic"
+                return [dict(item) for item in cached]
+        with span("retriever.faiss", k=k):
+            scores, idxs = self.index.search(q_emb, k)
 
         results = []
-        for score, idx in zip(scores[0], idxs[0]):
-            if idx < 0:
-                continue
-            item = dict(self.meta[idx])
-            item["score"] = float(score)
-            results.append(item)
+        with span("retriever.meta"):
+            for score, idx in zip(scores[0], idxs[0]):
+                if idx < 0:
+                    continue
+                item = dict(self.meta[idx])
+                item["score"] = float(score)
+                results.append(item)
+        if self.cache is not None:
+            self.cache.put(scope, query, tuple(dict(item) for item in results), (time.perf_counter() - t0) * 1000, q_emb)
         return results